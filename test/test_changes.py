@@ -0,0 +1,100 @@
+"""
+Test the change log kept by the store.
+"""
+
+import os
+
+import py.test
+
+from tiddlyweb import changes
+from tiddlyweb.changes import ChangeLog
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.user import User
+from tiddlyweb.store import Store, StoreMethodNotImplemented
+
+from .fixtures import reset_textstore
+
+LOG_PATH = os.path.join('store', 'changes')
+
+
+def setup_module(module):
+    reset_textstore()
+    log_config = dict(config, change_log=LOG_PATH)
+    module.store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': log_config})
+
+
+def test_changes_recorded():
+    store.put(Bag('logged'))
+    tiddler = Tiddler('one', 'logged')
+    tiddler.text = u'hello'
+    store.put(tiddler)
+    store.put(tiddler)
+    store.put(Recipe('recipe'))
+    store.put(User('cdent'))
+    store.delete(Tiddler('one', 'logged'))
+
+    changes = list(store.changes())
+    assert [change['seq'] for change in changes] == [1, 2, 3, 4, 5, 6]
+    assert [(change['action'], change['entity']) for change in changes] == [
+            ('put', 'bag'), ('put', 'tiddler'), ('put', 'tiddler'),
+            ('put', 'recipe'), ('put', 'user'), ('delete', 'tiddler')]
+    assert changes[0]['name'] == 'logged'
+    assert changes[2]['title'] == 'one'
+    assert changes[2]['bag'] == 'logged'
+    assert changes[2]['revision'] == 2
+    assert changes[4]['usersign'] == 'cdent'
+    assert changes[0]['time'] <= changes[5]['time']
+
+
+def test_changes_since():
+    for since in range(7):
+        assert [change['seq'] for change in store.changes(since)] == list(
+                range(since + 1, 7))
+    assert list(store.changes(100)) == []
+
+
+def test_put_many_recorded():
+    tiddlers = []
+    for numeral in range(3):
+        tiddler = Tiddler('many%s' % numeral, 'logged')
+        tiddler.text = u'%s' % numeral
+        tiddlers.append(tiddler)
+    store.put_many(tiddlers)
+    assert [change['title'] for change in store.changes(6)] == [
+            'many0', 'many1', 'many2']
+
+
+def test_sequence_continues_across_logs():
+    change_log = ChangeLog(LOG_PATH)
+    assert change_log.record('delete', [Bag('logged')]) == 10
+    assert [change['seq'] for change in store.changes(8)] == [9, 10]
+
+
+def test_partly_written_change():
+    with open(LOG_PATH, 'ab') as log_file:
+        log_file.write(b'{"seq": 11, "acti')
+    assert list(store.changes(9))[-1]['seq'] == 10
+    store.put(Bag('after'))
+    changes = list(store.changes(9))
+    assert [change['seq'] for change in changes] == [10, 11]
+    assert changes[1]['name'] == 'after'
+
+
+def test_change_longer_than_tail(monkeypatch):
+    monkeypatch.setattr(changes, 'TAIL_SIZE', 8)
+    with open(LOG_PATH, 'ab') as log_file:
+        log_file.write(b'{"seq": 12, "action": "put", "ent')
+    assert ChangeLog(LOG_PATH).record('put', [Bag('long')]) == 12
+    assert [change['seq'] for change in store.changes(10)] == [11, 12]
+
+
+def test_no_change_log():
+    plain_store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    assert plain_store.change_log is None
+    with py.test.raises(StoreMethodNotImplemented):
+        plain_store.changes()
@@ -2,6 +2,7 @@
 Test the manager a little bit.
 """
 
+import os
 import sys
 try:
     from StringIO import StringIO
@@ -174,6 +175,55 @@ def test_ltiddlers(capsys):
     assert '\ttiddler1' in results
 
 
+def test_upgradestore(capsys):
+    handle(['', u'upgradestore'])
+    results, err = capsys.readouterr()
+    assert 'upgraded 0 revisions' in results
+
+
+def test_reshard(capsys):
+    handle(['', u'reshard'])
+    results, err = capsys.readouterr()
+    assert 'moved 0 tiddlers' in results
+
+
+def test_reindex(capsys):
+    store_config = config['server_store'][1]
+    store_config['search_index'] = True
+    try:
+        handle(['', u'reindex'])
+    finally:
+        del store_config['search_index']
+    results, err = capsys.readouterr()
+    assert 'indexed 1 tiddlers' in results
+    assert os.path.exists(os.path.join('store', 'search.db'))
+
+
+def test_pack(capsys):
+    handle(['', u'pack'])
+    results, err = capsys.readouterr()
+    assert 'packed 0 revisions' in results
+
+
+def test_merge(capsys):
+    server_store = config['server_store']
+    config['server_store'] = ['bitcask', {'store_root':
+        os.path.join('store', 'merged'), 'merge_ratio': None}]
+    try:
+        cask_store = Store(config['server_store'][0],
+                config['server_store'][1],
+                environ={'tiddlyweb.config': config})
+        cask_store.put(Bag('merged'))
+        cask_store.put(Bag('merged'))
+        handle(['', u'merge'])
+    finally:
+        config['server_store'] = server_store
+    results, err = capsys.readouterr()
+    assert 'reclaimed' in results
+    assert 'reclaimed 0 bytes' not in results
+    assert cask_store.get(Bag('merged')).name == 'merged'
+
+
 def set_stdin(content):
     f = StringIO(content)
     sys.stdin = f
@@ -0,0 +1,71 @@
+"""
+Test the cache of bag descriptions and policies in the text store.
+"""
+
+import os
+
+import simplejson
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.store import Store
+
+import tiddlyweb.stores.text
+
+from .fixtures import reset_textstore
+
+BAG_PATH = os.path.join('store', 'bags', 'cached')
+
+
+def _store():
+    return Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+
+
+def setup_module(module):
+    reset_textstore()
+    bag = Bag('cached')
+    bag.desc = u'a cached bag'
+    bag.policy.read = [u'cdent']
+    _store().put(bag)
+
+
+def test_cached_across_stores(monkeypatch):
+    bag = _store().get(Bag('cached'))
+    assert bag.desc == 'a cached bag'
+    assert bag.policy.read == ['cdent']
+
+    def no_read(filename):
+        raise AssertionError('read %s' % filename)
+
+    monkeypatch.setattr(tiddlyweb.stores.text, 'read_utf8_file', no_read)
+    bag = _store().get(Bag('cached'))
+    assert bag.desc == 'a cached bag'
+    assert bag.policy.read == ['cdent']
+
+    bag.policy.read.append(u'fnd')
+    assert _store().get(Bag('cached')).policy.read == ['cdent']
+
+
+def test_cache_follows_changes():
+    store = _store()
+    bag = store.get(Bag('cached'))
+    bag.policy.write = [u'fnd']
+    store.put(bag)
+    assert _store().get(Bag('cached')).policy.write == ['fnd']
+
+    with open(os.path.join(BAG_PATH, 'policy.new'), 'w') as policy_file:
+        policy_file.write(simplejson.dumps({'read': [], 'write': [u'psd'],
+            'create': [], 'delete': [], 'manage': [], 'accept': [],
+            'owner': None}))
+    os.rename(os.path.join(BAG_PATH, 'policy.new'),
+            os.path.join(BAG_PATH, 'policy'))
+    bag = _store().get(Bag('cached'))
+    assert bag.policy.write == ['psd']
+    assert bag.policy.read == []
+
+    assert [path for path in tiddlyweb.stores.text.BAGS
+            if path.endswith(BAG_PATH)]
+    store.delete(bag)
+    assert not [path for path in tiddlyweb.stores.text.BAGS
+            if path.endswith(BAG_PATH)]
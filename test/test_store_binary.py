@@ -0,0 +1,76 @@
+"""
+Test the storage of binary tiddlers in the text store.
+"""
+
+import os
+
+import py.test
+
+from base64 import b64encode
+
+import tiddlyweb.stores.text
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.stores.text import BODY_HEADER
+
+from .fixtures import reset_textstore, _teststore
+
+TIDDLER_DIR = os.path.join('store', 'bags', 'binary', 'tiddlers', 'image')
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = _teststore()
+    if type(module.store.storage) != tiddlyweb.stores.text.Store:
+        py.test.skip('skipping this test for non-text store')
+    store.put(Bag('binary'))
+    with open('test/peermore.png', 'rb') as image_file:
+        module.image = image_file.read()
+
+
+def test_binary_sidecar():
+    tiddler = Tiddler('image', 'binary')
+    tiddler.type = 'image/png'
+    tiddler.text = image
+    tiddler.tags = [u'picture']
+    store.put(tiddler)
+
+    with open(os.path.join(TIDDLER_DIR, '1.bin'), 'rb') as body_file:
+        assert body_file.read() == image
+    with open(os.path.join(TIDDLER_DIR, '1')) as revision_file:
+        revision = revision_file.read()
+    assert revision.endswith('type: image/png\nserver.body: 1.bin\n\n')
+    assert b64encode(image).decode('ascii')[:20] not in revision
+
+    tiddler = store.get(Tiddler('image', 'binary'))
+    assert tiddler.text == image
+    assert tiddler.type == 'image/png'
+    assert tiddler.tags == ['picture']
+    assert BODY_HEADER not in tiddler.fields
+
+
+def test_binary_revisions():
+    tiddler = Tiddler('image', 'binary')
+    tiddler.type = 'image/png'
+    tiddler.text = image[:100]
+    store.put(tiddler)
+    assert sorted(os.listdir(TIDDLER_DIR)) == ['1', '1.bin', '2', '2.bin',
+            'index']
+    assert store.list_tiddler_revisions(tiddler) == [2, 1]
+
+    tiddler = store.get(Tiddler('image', 'binary'))
+    assert tiddler.text == image[:100]
+    revision = Tiddler('image', 'binary')
+    revision.revision = 1
+    assert store.get(revision).text == image
+
+
+def test_base64_revision_read():
+    os.unlink(os.path.join(TIDDLER_DIR, 'index'))
+    with open(os.path.join(TIDDLER_DIR, '3'), 'w') as revision_file:
+        revision_file.write('creator: cdent\ntype: image/png\n\n%s\n'
+                % b64encode(image).decode('ascii'))
+    tiddler = store.get(Tiddler('image', 'binary'))
+    assert tiddler.revision == 3
+    assert tiddler.text == image
@@ -0,0 +1,223 @@
+"""
+Test the bitcask store.
+"""
+
+import os
+import threading
+
+import py.test
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.user import User
+from tiddlyweb.store import (Store, NoBagError, NoRecipeError,
+        NoTiddlerError, NoUserError, StoreLockError)
+from tiddlyweb.stores import bitcask
+
+from .fixtures import reset_textstore
+
+STORE_ROOT = os.path.join('store', 'cask')
+STORE_CONFIG = {'store_root': STORE_ROOT, 'segment_size': 1024,
+        'merge_ratio': None}
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = _store()
+
+
+def _store():
+    return Store('bitcask', STORE_CONFIG,
+            environ={'tiddlyweb.config': config})
+
+
+def _reopen():
+    cask = store.storage.cask
+    cask.close()
+    del bitcask.CASKS[(os.path.abspath(STORE_ROOT), os.getpid())]
+    return _store()
+
+
+def _segments(suffix):
+    return sorted(name for name in os.listdir(STORE_ROOT)
+            if name.endswith(suffix))
+
+
+def test_bags_recipes_users():
+    bag = Bag('bagone', desc=u'a bag')
+    bag.policy = Policy(owner=u'cdent', read=[u'cdent'])
+    store.put(bag)
+    store.put(Bag('bagtwo'))
+    loaded = store.get(Bag('bagone'))
+    assert loaded.desc == 'a bag'
+    assert loaded.policy == bag.policy
+    assert [bag.name for bag in store.list_bags()] == ['bagone', 'bagtwo']
+
+    recipe = Recipe('recipeone')
+    recipe.set_recipe([(u'bagone', u''), (u'bagtwo', u'select=tag:one')])
+    store.put(recipe)
+    assert store.get(Recipe('recipeone')).get_recipe() == recipe.get_recipe()
+    store.delete(recipe)
+    with py.test.raises(NoRecipeError):
+        store.get(Recipe('recipeone'))
+    with py.test.raises(NoRecipeError):
+        store.delete(Recipe('recipeone'))
+
+    user = User('cdent')
+    user.set_password('cowpig')
+    user.add_role('ADMIN')
+    store.put(user)
+    loaded = store.get(User('cdent'))
+    assert loaded.check_password('cowpig')
+    assert loaded.list_roles() == ['ADMIN']
+    store.delete(loaded)
+    with py.test.raises(NoUserError):
+        store.get(User('cdent'))
+
+
+def test_tiddler_revisions():
+    tiddler = Tiddler('one', 'bagone')
+    tiddler.text = u'first ünïcode'
+    tiddler.tags = [u'one', u'two words']
+    tiddler.modifier = u'cdent'
+    tiddler.modified = u'20120101000000'
+    store.put(tiddler)
+    assert tiddler.revision == 1
+
+    tiddler.text = u'second'
+    tiddler.modifier = u'fnd'
+    store.put(tiddler)
+    assert tiddler.revision == 2
+
+    loaded = store.get(Tiddler('one', 'bagone'))
+    assert loaded.text == 'second'
+    assert loaded.tags == ['one', 'two words']
+    assert loaded.creator == 'cdent'
+    first = Tiddler('one', 'bagone')
+    first.revision = 1
+    assert store.get(first).text == u'first ünïcode'
+    assert store.list_tiddler_revisions(first) == [2, 1]
+    assert [tiddler.title for tiddler in store.search(u'SECOND')] == ['one']
+
+    with py.test.raises(NoBagError):
+        store.put(Tiddler('lost', 'nothing'))
+
+
+def test_binary_tiddler():
+    with open('test/peermore.png', 'rb') as image_file:
+        image = image_file.read()
+    tiddler = Tiddler('image', 'bagtwo')
+    tiddler.type = 'image/png'
+    tiddler.text = image
+    store.put(tiddler)
+    assert store.get(Tiddler('image', 'bagtwo')).text == image
+
+
+def test_put_many_is_one_write():
+    tiddlers = [Tiddler('many%s' % numeral, 'bagtwo') for numeral in range(3)]
+    tiddlers.append(Tiddler('lost', 'nothing'))
+    with py.test.raises(NoBagError):
+        store.put_many(tiddlers)
+    assert [tiddler.title for tiddler in store.list_bag_tiddlers(
+        Bag('bagtwo'))] == ['image']
+
+    tiddlers[2].title = 'many0'
+    store.put_many(tiddlers[:3])
+    assert [tiddler.revision for tiddler in tiddlers[:3]] == [1, 1, 2]
+
+
+def test_segments_are_sealed_with_hints():
+    assert len(_segments(bitcask.SEGMENT_SUFFIX)) > 1
+    assert len(_segments(bitcask.HINT_SUFFIX)) == len(
+            _segments(bitcask.SEGMENT_SUFFIX)) - 1
+
+
+def test_second_process_is_locked_out():
+    with py.test.raises(StoreLockError):
+        bitcask.Cask(STORE_ROOT)
+
+
+def test_reopen_from_hints():
+    global store
+    store = _reopen()
+    assert store.get(Tiddler('one', 'bagone')).text == 'second'
+    assert store.list_tiddler_revisions(Tiddler('one', 'bagone')) == [2, 1]
+    with py.test.raises(NoRecipeError):
+        store.get(Recipe('recipeone'))
+    tiddler = store.put(Tiddler('one', 'bagone'))
+    assert store.list_tiddler_revisions(Tiddler('one', 'bagone')) == [
+            3, 2, 1]
+
+
+def test_damaged_tail_is_removed():
+    global store
+    store.put(Bag('bagthree'))
+    active = _segments(bitcask.SEGMENT_SUFFIX)[-1]
+    with open(os.path.join(STORE_ROOT, active), 'ab') as segment_file:
+        segment_file.write(b'\x00\x01partial')
+    store = _reopen()
+    assert store.get(Bag('bagthree')).name == 'bagthree'
+    store.put(Bag('bagfour'))
+    store = _reopen()
+    assert 'bagfour' in [bag.name for bag in store.list_bags()]
+
+
+def test_deletes_and_merge():
+    global store
+    store.delete(Tiddler('one', 'bagone'))
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('one', 'bagone'))
+    with py.test.raises(NoTiddlerError):
+        store.delete(Tiddler('one', 'bagone'))
+    store.delete(Bag('bagtwo'))
+    with py.test.raises(NoBagError):
+        list(store.list_bag_tiddlers(Bag('bagtwo')))
+
+    size = sum(os.path.getsize(os.path.join(STORE_ROOT, name))
+            for name in _segments(bitcask.SEGMENT_SUFFIX))
+    reclaimed = store.storage.merge()
+    assert reclaimed > 0
+    assert sum(os.path.getsize(os.path.join(STORE_ROOT, name))
+            for name in _segments(bitcask.SEGMENT_SUFFIX)) == size - reclaimed
+
+    store = _reopen()
+    assert [bag.name for bag in store.list_bags()] == ['bagfour', 'bagone',
+            'bagthree']
+    assert list(store.list_bag_tiddlers(Bag('bagone'))) == []
+    with py.test.raises(NoBagError):
+        store.put(Tiddler('image', 'bagtwo'))
+    store.put(Bag('bagtwo'))
+    assert list(store.list_bag_tiddlers(Bag('bagtwo'))) == []
+
+
+def test_read_outside_lock_survives_merge():
+    cask = store.storage.cask
+    store.put(Bag('bagfive', desc=u'read while merging'))
+    store.put(Bag('bagfive', desc=u'read while merging'))
+    pread = bitcask.PREAD
+    lockable = []
+
+    def merge():
+        if cask.lock.acquire(False):
+            cask.lock.release()
+            lockable.append(True)
+        cask.merge()
+
+    def merging_pread(reader, size, offset):
+        bitcask.PREAD = pread
+        thread = threading.Thread(target=merge)
+        thread.start()
+        thread.join(5)
+        return pread(reader, size, offset)
+
+    bitcask.PREAD = merging_pread
+    try:
+        assert store.get(Bag('bagfive')).desc == u'read while merging'
+    finally:
+        bitcask.PREAD = pread
+    assert lockable == [True]
+    assert cask._retired == []
+    assert store.get(Bag('bagfive')).desc == u'read while merging'
@@ -0,0 +1,89 @@
+"""
+Test the content addressed blobs of the text store.
+"""
+
+import os
+
+from hashlib import sha1
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from .fixtures import reset_textstore
+
+BLOBS_DIR = os.path.join('store', 'blobs')
+
+
+def _blob_path(content):
+    digest = sha1(content).hexdigest()
+    return os.path.join(BLOBS_DIR, digest[:2], digest)
+
+
+def _blob_count():
+    return sum(len(files) for _, _, files in os.walk(BLOBS_DIR))
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = Store('text', {'store_root': 'store', 'blobs': True,
+        'blob_min_size': 100}, environ={'tiddlyweb.config': config})
+    store.put(Bag('one'))
+    store.put(Bag('two'))
+    with open('test/peermore.png', 'rb') as image_file:
+        module.image = image_file.read()
+
+
+def test_binary_blob_shared():
+    for bag_name in ['one', 'two']:
+        tiddler = Tiddler('image', bag_name)
+        tiddler.type = 'image/png'
+        tiddler.text = image
+        store.put(tiddler)
+
+    assert _blob_count() == 1
+    assert os.path.exists(_blob_path(image))
+    revision_filename = os.path.join('store', 'bags', 'two', 'tiddlers',
+            'image', '1')
+    with open(revision_filename) as revision_file:
+        assert revision_file.read().endswith('server.blob: %s\n\n'
+                % sha1(image).hexdigest())
+
+    tiddler = store.get(Tiddler('image', 'two'))
+    assert tiddler.text == image
+    assert 'server.blob' not in tiddler.fields
+
+
+def test_metadata_edit_keeps_blob():
+    blob_path = _blob_path(image)
+    modified = os.stat(blob_path).st_mtime - 10
+    os.utime(blob_path, (modified, modified))
+
+    tiddler = store.get(Tiddler('image', 'one'))
+    tiddler.tags = [u'picture']
+    store.put(tiddler)
+    assert os.stat(blob_path).st_mtime == modified
+    assert _blob_count() == 1
+
+    tiddler = store.get(Tiddler('image', 'one'))
+    assert tiddler.revision == 2
+    assert tiddler.tags == ['picture']
+    assert tiddler.text == image
+
+
+def test_text_blobs():
+    long_text = u'a long \u00fcn\u00efcode text ' * 10
+    tiddler = Tiddler('long', 'one')
+    tiddler.text = long_text
+    store.put(tiddler)
+    short = Tiddler('short', 'one')
+    short.text = u'short text'
+    store.put(short)
+
+    assert _blob_count() == 2
+    assert os.path.exists(_blob_path(long_text.encode('utf-8')))
+    assert store.get(Tiddler('long', 'one')).text == long_text.rstrip()
+    assert store.get(Tiddler('short', 'one')).text == 'short text'
+    assert [tiddler.title for tiddler in store.search(u'\u00efcode')] == [
+            'long']
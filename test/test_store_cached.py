@@ -0,0 +1,124 @@
+"""
+Test the caching store wrapper.
+"""
+
+import py.test
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.user import User
+from tiddlyweb.store import Store, NoBagError, NoTiddlerError
+from tiddlyweb.stores import cached
+
+from .fixtures import reset_textstore
+
+WRAPPED_STORE = ['text', {'store_root': 'store'}]
+
+
+def setup_module(module):
+    reset_textstore()
+    cached.CACHES.clear()
+    module.store = _store()
+    store.put(Bag('cached'))
+    tiddler = Tiddler('one', 'cached')
+    tiddler.text = u'first'
+    tiddler.tags = [u'alpha']
+    store.put(tiddler)
+
+
+def _store(cache_bytes=cached.DEFAULT_CACHE_BYTES):
+    return Store('cached', {'wrapped_store': WRAPPED_STORE,
+        'cache_bytes': cache_bytes}, environ={'tiddlyweb.config': config})
+
+
+def _stats():
+    return store.storage.cache.stats()
+
+
+def test_gets_are_cached_across_stores():
+    first = store.get(Tiddler('one', 'cached'))
+    second = _store().get(Tiddler('one', 'cached'))
+    assert second.text == 'first'
+    assert second.revision == first.revision
+    assert _stats()['misses'] == 1
+    assert _stats()['hits'] == 1
+
+    first.tags.append(u'beta')
+    assert store.get(Tiddler('one', 'cached')).tags == ['alpha']
+
+    store.get(Bag('cached'))
+    store.get(Bag('cached'))
+    assert _stats()['misses'] == 2
+    assert _stats()['hits'] == 3
+
+
+def test_other_entities():
+    recipe = Recipe('cached')
+    recipe.set_recipe([(u'cached', u'')])
+    store.put(recipe)
+    user = User('cdent')
+    user.add_role('ADMIN')
+    store.put(user)
+    for _ in range(2):
+        assert [list(item) for item in store.get(
+            Recipe('cached')).get_recipe()] == [['cached', '']]
+        assert store.get(User('cdent')).list_roles() == ['ADMIN']
+    assert _stats()['entries'] == 4
+
+
+def test_puts_through_other_stores_forget():
+    tiddler = Tiddler('one', 'cached')
+    tiddler.text = u'second'
+    Store(*WRAPPED_STORE, environ={'tiddlyweb.config': config}).put(tiddler)
+    assert store.get(Tiddler('one', 'cached')).text == 'second'
+
+    tiddler.text = u'third'
+    store.put_many([tiddler])
+    assert store.get(Tiddler('one', 'cached')).text == 'third'
+
+
+def test_deletes_forget():
+    store.put(Tiddler('two', 'cached'))
+    store.get(Tiddler('two', 'cached'))
+    store.delete(Tiddler('two', 'cached'))
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('two', 'cached'))
+
+    store.delete(Bag('cached'))
+    with py.test.raises(NoBagError):
+        store.get(Bag('cached'))
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('one', 'cached'))
+
+
+def test_stale_read_not_added():
+    cache = cached.EntityCache(1024)
+    generation = cache.generation
+    cache.forget(Tiddler('one', 'cached'))
+    cache.add(('tiddler', 'cached', 'one', None), Tiddler('one', 'cached'),
+            generation)
+    assert cache.stats()['entries'] == 0
+
+
+def test_evicts_least_recently_used():
+    bag_size = cached._entity_size(Bag('a'))
+    cache = cached.EntityCache(bag_size * 2)
+    for name in ['a', 'b']:
+        cache.add(('bag', name), Bag(name), cache.generation)
+    assert cache.get(('bag', 'a')).name == 'a'
+    cache.add(('bag', 'c'), Bag('c'), cache.generation)
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == bag_size * 2
+    assert cache.get(('bag', 'b')) is None
+    assert cache.get(('bag', 'a')).name == 'a'
+
+    big = Tiddler('big', 'a')
+    big.text = u'x' * bag_size * 2
+    cache.add(('tiddler', 'a', 'big', None), big, cache.generation)
+    assert cache.get(('tiddler', 'a', 'big', None)) is None
+
+
+def test_wrapped_methods():
+    assert store.storage.pack == store.storage.wrapped.pack
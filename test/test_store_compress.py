@@ -0,0 +1,161 @@
+"""
+Test the compressed bodies of the text store, and sending them as
+they are to clients that accept gzip.
+"""
+
+import gzip
+import io
+import os
+
+from .fixtures import reset_textstore, _teststore, initialize_app, get_http
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.util import copy_entity_state
+from tiddlyweb.web.handler.tiddler import _accepts_gzip, _stored_gzip
+
+TIDDLER_DIR = os.path.join('store', 'bags', 'squeezed', 'tiddlers')
+
+CSS = u'body {\n    color: red;\n}\n' * 100 + u'/* \u00fcn\u00efcode */\n'
+
+http = get_http()
+
+
+def _gunzip(content):
+    return gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+
+
+def setup_module(module):
+    initialize_app()
+    reset_textstore()
+    config['server_store'][1]['compress'] = True
+    module.store = _teststore()
+    store.put(Bag('squeezed'))
+
+    tiddler = Tiddler('style', 'squeezed')
+    tiddler.type = 'text/css'
+    tiddler.text = CSS
+    store.put(tiddler)
+
+    with open('test/peermore.png', 'rb') as image_file:
+        module.image = image_file.read()
+    tiddler = Tiddler('image', 'squeezed')
+    tiddler.type = 'image/png'
+    tiddler.text = image
+    store.put(tiddler)
+
+
+def teardown_module(module):
+    del config['server_store'][1]['compress']
+
+
+def test_bodies_compressed():
+    style_dir = os.path.join(TIDDLER_DIR, 'style')
+    with open(os.path.join(style_dir, '1')) as revision_file:
+        revision = revision_file.read()
+    assert 'server.body: 1.gz' in revision
+    assert 'color' not in revision
+    with open(os.path.join(style_dir, '1.gz'), 'rb') as body_file:
+        compressed = body_file.read()
+    assert len(compressed) < len(CSS) / 10
+    assert _gunzip(compressed).decode('utf-8') == CSS.rstrip()
+
+    with open(os.path.join(TIDDLER_DIR, 'image', '1.gz'), 'rb') as body_file:
+        assert _gunzip(body_file.read()) == image
+
+
+def test_read_decompressed():
+    tiddler = store.get(Tiddler('style', 'squeezed'))
+    assert tiddler.text == CSS.rstrip()
+    assert 'server.body' not in tiddler.fields
+    assert tiddler.gzipped_text[0] is tiddler.text
+
+    tiddler = store.get(Tiddler('image', 'squeezed'))
+    assert tiddler.text == image
+
+
+def test_search_compressed():
+    tiddlers = list(store.search(u'\u00fcn\u00efcode'))
+    assert [tiddler.title for tiddler in tiddlers] == ['style']
+
+
+def test_send_gzipped():
+    response, content = http.request(
+            'http://our_test_domain:8001/bags/squeezed/tiddlers/style',
+            headers={'Accept-Encoding': 'gzip'})
+    assert response['status'] == '200'
+    assert response['-content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response['vary']
+    assert content.decode('utf-8') == CSS.rstrip()
+
+    response, content = http.request(
+            'http://our_test_domain:8001/bags/squeezed/tiddlers/image',
+            headers={'Accept-Encoding': 'gzip'})
+    assert response['status'] == '200'
+    assert response['-content-encoding'] == 'gzip'
+    assert content == image
+
+
+def test_send_plain():
+    response, content = http.request(
+            'http://our_test_domain:8001/bags/squeezed/tiddlers/style',
+            headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    assert response['status'] == '200'
+    assert '-content-encoding' not in response
+    assert content.decode('utf-8') == CSS.rstrip()
+
+
+def test_serialized_not_gzipped():
+    response, content = http.request(
+            'http://our_test_domain:8001/bags/squeezed/tiddlers/style.json',
+            headers={'Accept-Encoding': 'gzip'})
+    assert response['status'] == '200'
+    assert '-content-encoding' not in response
+    assert response['vary'] == 'Accept'
+
+
+def test_gzip_etag_distinct():
+    url = 'http://our_test_domain:8001/bags/squeezed/tiddlers/style'
+    response, _ = http.request(url, headers={'Accept-Encoding': 'gzip'})
+    gzip_etag = response['etag']
+    response, _ = http.request(url, headers={'Accept-Encoding': 'identity'})
+    plain_etag = response['etag']
+    assert 'Accept-Encoding' in response['vary']
+    assert gzip_etag.endswith('-gzip"')
+    assert gzip_etag != plain_etag
+
+    response, _ = http.request(url, headers={'Accept-Encoding': 'gzip',
+        'If-None-Match': gzip_etag})
+    assert response['status'] == '304'
+    assert response['etag'] == gzip_etag
+    assert 'Accept-Encoding' in response['vary']
+
+    response, content = http.request(url, headers={
+        'Accept-Encoding': 'identity', 'If-None-Match': gzip_etag})
+    assert response['status'] == '200'
+    assert content.decode('utf-8') == CSS.rstrip()
+
+    response, _ = http.request(url, headers={'Accept-Encoding': 'gzip',
+        'If-None-Match': plain_etag})
+    assert response['status'] == '200'
+
+
+def test_accept_encoding_wildcard():
+    for header, accepted in [('gzip', True), ('x-gzip;q=0.5', True),
+            ('*', True), ('deflate, *;q=0.1', True), ('*;q=0', False),
+            ('gzip;q=0, *', False), ('*, GZIP;Q=0', False),
+            ('identity', False), ('', False)]:
+        assert _accepts_gzip({'HTTP_ACCEPT_ENCODING': header}) == accepted
+
+
+def test_stored_gzip_of_copy():
+    tiddler = store.get(Tiddler('style', 'squeezed'))
+    copied = Tiddler('style', 'squeezed')
+    copy_entity_state(tiddler, copied)
+    copied.text = u''.join(list(tiddler.text))
+    assert copied.text is not tiddler.text
+    assert _stored_gzip(copied) == tiddler.gzipped_text[1]
+
+    copied.text = u'changed'
+    assert _stored_gzip(copied) is None
@@ -0,0 +1,146 @@
+"""
+Test hooks called after the store method which called them returns.
+"""
+
+import threading
+
+from tiddlyweb import store as store_module
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import HOOKS, Store, deferred_hook
+
+from .fixtures import reset_textstore
+
+CALLS = []
+FAILURES = []
+STARTED = threading.Event()
+RELEASE = threading.Event()
+
+
+@deferred_hook
+def put_hook(store, tiddler):
+    CALLS.append((tiddler.title, tiddler.text, store.get(
+        Tiddler(tiddler.title, tiddler.bag)).text,
+        threading.current_thread().name))
+
+
+@deferred_hook
+def failing_hook(store, tiddler):
+    if tiddler.title == 'flaky':
+        FAILURES.append(tiddler.title)
+        if len(FAILURES) < 3:
+            raise IOError('not yet')
+        CALLS.append(tiddler.title)
+    elif tiddler.title == 'broken':
+        FAILURES.append(tiddler.title)
+        raise IOError('never')
+
+
+@deferred_hook
+def environ_hook(store, tiddler):
+    CALLS.append(sorted(store.environ.keys()))
+
+
+@deferred_hook
+def blocking_hook(store, tiddler):
+    if tiddler.title == 'block':
+        STARTED.set()
+        RELEASE.wait(5)
+    CALLS.append(tiddler.title)
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    store.put(Bag('deferred'))
+
+
+def setup_function(function):
+    store_module.DEFERRED = store_module.DeferredHooks(retry_delay=0)
+    del CALLS[:]
+    del FAILURES[:]
+
+
+def teardown_function(function):
+    store_module.DEFERRED.flush(5)
+    for hook in [put_hook, failing_hook, environ_hook, blocking_hook]:
+        if hook in HOOKS['tiddler']['put']:
+            HOOKS['tiddler']['put'].remove(hook)
+
+
+def test_called_by_worker():
+    HOOKS['tiddler']['put'].append(put_hook)
+    tiddler = Tiddler('one', 'deferred')
+    tiddler.text = u'first'
+    store.put(tiddler)
+    tiddler.text = u'changed'
+    assert store_module.DEFERRED.flush(5)
+    assert CALLS == [('one', 'first', 'first', 'tiddlyweb-deferred-hooks')]
+    stats = store_module.DEFERRED.stats()
+    assert stats['added'] == 1
+    assert stats['completed'] == 1
+    assert stats['depth'] == 0
+
+
+def test_retries():
+    HOOKS['tiddler']['put'].append(failing_hook)
+    store.put(Tiddler('flaky', 'deferred'))
+    store.put(Tiddler('broken', 'deferred'))
+    assert store_module.DEFERRED.flush(5)
+    assert CALLS == ['flaky']
+    assert FAILURES == ['flaky'] * 3 + ['broken'] * 4
+    stats = store_module.DEFERRED.stats()
+    assert stats['retried'] == 5
+    assert stats['failed'] == 1
+    assert stats['completed'] == 1
+
+
+def test_calls_made_while_failed_call_waits():
+    store_module.DEFERRED = store_module.DeferredHooks(retry_delay=0.5)
+    HOOKS['tiddler']['put'].append(failing_hook)
+    HOOKS['tiddler']['put'].append(blocking_hook)
+    store.put(Tiddler('flaky', 'deferred'))
+    store.put(Tiddler('after', 'deferred'))
+    assert store_module.DEFERRED.flush(5)
+    assert CALLS == ['flaky', 'after', 'flaky']
+    assert FAILURES == ['flaky'] * 3
+
+
+def test_environ_not_kept():
+    HOOKS['tiddler']['put'].append(environ_hook)
+    environ = {'tiddlyweb.config': config, 'tiddlyweb.query': {}}
+    Store('text', {'store_root': 'store'}, environ=environ).put(
+            Tiddler('one', 'deferred'))
+    assert store_module.DEFERRED.flush(5)
+    assert CALLS == [['tiddlyweb.config']]
+
+
+def test_full_queue_calls_at_once():
+    store_module.DEFERRED.size = 1
+    HOOKS['tiddler']['put'].append(blocking_hook)
+    store.put(Tiddler('block', 'deferred'))
+    assert STARTED.wait(5)
+    store.put(Tiddler('waiting', 'deferred'))
+    assert store_module.DEFERRED.stats()['depth'] == 1
+    store.put(Tiddler('now', 'deferred'))
+    assert CALLS == ['now']
+    RELEASE.set()
+    assert store_module.DEFERRED.flush(5)
+    assert CALLS == ['now', 'block', 'waiting']
+    stats = store_module.DEFERRED.stats()
+    assert stats['inline'] == 1
+    assert stats['max_depth'] == 1
+    assert stats['completed'] == 2
+
+
+def test_undecorated_hooks_called_at_once():
+    hook = lambda store, tiddler: CALLS.append(tiddler.title)  # noqa
+    HOOKS['tiddler']['put'].append(hook)
+    try:
+        store.put(Tiddler('now', 'deferred'))
+    finally:
+        HOOKS['tiddler']['put'].remove(hook)
+    assert CALLS == ['now']
+    assert store_module.DEFERRED.stats()['added'] == 0
@@ -0,0 +1,102 @@
+"""
+Test the delta revisions of the text store.
+"""
+
+import os
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+from tiddlyweb.stores import text as text_store
+
+from .fixtures import reset_textstore
+
+TIDDLER_DIR = os.path.join('store', 'bags', 'deltas', 'tiddlers', 'long')
+
+LINES = [u'line %s of a long tiddler with \u00fcn\u00efcode\n' % numeral
+        for numeral in range(200)]
+
+
+def _text(revision):
+    lines = list(LINES)
+    for numeral in range(1, revision + 1):
+        lines[numeral * 7] = u'changed in revision %s\n' % numeral
+    return u''.join(lines)
+
+
+def _revision_size(revision):
+    return os.path.getsize(os.path.join(TIDDLER_DIR, str(revision)))
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = Store('text', {'store_root': 'store',
+        'revision_deltas': 4}, environ={'tiddlyweb.config': config})
+    store.put(Bag('deltas'))
+    for revision in range(1, 10):
+        tiddler = Tiddler('long', 'deltas')
+        tiddler.text = _text(revision)
+        store.put(tiddler)
+
+
+def test_deltas_written():
+    for revision in (1, 5, 9):
+        assert _revision_size(revision) > len(LINES[0]) * 200
+    for revision in (2, 3, 4, 6, 7, 8):
+        assert _revision_size(revision) < len(LINES[0]) * 10
+        with open(os.path.join(TIDDLER_DIR, str(revision))) as revision_file:
+            assert 'server.delta: %s ' % (revision - 1) in revision_file.read()
+
+
+def test_revisions_read():
+    for revision in range(1, 10):
+        text_store.DELTA_TEXTS.clear()
+        tiddler = Tiddler('long', 'deltas')
+        tiddler.revision = revision
+        tiddler = store.get(tiddler)
+        assert tiddler.text == _text(revision).rstrip()
+        assert 'server.delta' not in tiddler.fields
+
+
+def test_rebuilt_text_cached(monkeypatch):
+    tiddler = Tiddler('long', 'deltas')
+    tiddler.revision = 8
+    store.get(tiddler)
+
+    original = store.storage._read_tiddler_file
+
+    def read_delta(tiddler, filename):
+        if filename.endswith(os.sep + '5'):
+            raise AssertionError('read base %s' % filename)
+        return original(tiddler, filename)
+
+    monkeypatch.setattr(store.storage, '_read_tiddler_file', read_delta)
+    tiddler = Tiddler('long', 'deltas')
+    tiddler.revision = 8
+    assert store.get(tiddler).text == _text(8).rstrip()
+
+
+def test_small_change_kept_whole():
+    tiddler = Tiddler('short', 'deltas')
+    tiddler.text = u'one'
+    store.put(tiddler)
+    tiddler.text = u'two'
+    store.put(tiddler)
+    short_dir = os.path.join('store', 'bags', 'deltas', 'tiddlers', 'short')
+    with open(os.path.join(short_dir, '2')) as revision_file:
+        assert revision_file.read().endswith('\n\ntwo\n')
+
+
+def test_packed_deltas_read():
+    assert store.storage.pack() == 9
+    text_store.DELTA_TEXTS.clear()
+    for revision in range(1, 10):
+        tiddler = Tiddler('long', 'deltas')
+        tiddler.revision = revision
+        assert store.get(tiddler).text == _text(revision).rstrip()
+
+
+def test_search_deltas():
+    tiddlers = list(store.search(u'revision 9'))
+    assert [tiddler.title for tiddler in tiddlers] == ['long']
@@ -0,0 +1,80 @@
+"""
+Test the bucketed layout of tiddler directories in the text store.
+"""
+
+import os
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from .fixtures import reset_textstore
+
+TIDDLERS_DIR = os.path.join('store', 'bags', 'spread', 'tiddlers')
+TITLES = [u'ab', u'tiddler one', u'tiddler/two', u'\u00fcn\u00efcode']
+
+
+def _store(fanout):
+    return Store('text', {'store_root': 'store', 'tiddler_fanout': fanout},
+            environ={'tiddlyweb.config': config})
+
+
+def _titles(store):
+    return sorted(tiddler.title
+            for tiddler in store.list_bag_tiddlers(Bag('spread')))
+
+
+def setup_module(module):
+    reset_textstore()
+    store = _store(0)
+    store.put(Bag('spread'))
+    for title in TITLES:
+        tiddler = Tiddler(title, 'spread')
+        tiddler.text = u'text of %s' % title
+        store.put(tiddler)
+
+
+def test_reshard_to_buckets():
+    store = _store(2)
+    assert store.storage.reshard() == len(TITLES)
+    assert store.storage.reshard() == 0
+
+    for bucket in os.listdir(TIDDLERS_DIR):
+        assert len(bucket) == 2
+        for sub_bucket in os.listdir(os.path.join(TIDDLERS_DIR, bucket)):
+            assert len(sub_bucket) == 2
+
+    assert _titles(store) == sorted(TITLES)
+    for title in TITLES:
+        tiddler = store.get(Tiddler(title, 'spread'))
+        assert tiddler.text == u'text of %s' % title
+
+
+def test_put_and_delete_in_buckets():
+    store = _store(2)
+    tiddler = Tiddler(u'new one', 'spread')
+    tiddler.text = u'fresh'
+    store.put(tiddler)
+    tiddler.text = u'fresher'
+    store.put(tiddler)
+
+    path = store.storage._tiddler_base_filename(tiddler)
+    assert path.startswith(TIDDLERS_DIR)
+    assert len(path[len(TIDDLERS_DIR):].split(os.sep)) == 4
+    assert store.list_tiddler_revisions(tiddler) == [2, 1]
+    assert u'new one' in _titles(store)
+
+    store.delete(tiddler)
+    assert u'new one' not in _titles(store)
+    assert [tiddler.title for tiddler in store.search(u'text of ab')] == [
+            u'ab']
+
+
+def test_reshard_back_to_flat():
+    store = _store(0)
+    assert store.storage.reshard() == len(TITLES)
+    assert sorted(os.listdir(TIDDLERS_DIR)) == sorted(
+            ['ab', 'tiddler%20one', 'tiddler%2Ftwo', '%C3%BCn%C3%AFcode'])
+    assert _titles(store) == sorted(TITLES)
+    assert store.get(Tiddler(u'ab', 'spread')).text == u'text of ab'
@@ -0,0 +1,100 @@
+"""
+Test getting many tiddlers at once.
+"""
+
+import os
+
+from tiddlyweb.config import config
+from tiddlyweb.control import filter_tiddlers
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.collections import Tiddlers
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, StoreError
+from tiddlyweb.stores import StorageInterface
+
+from .fixtures import reset_textstore
+
+TITLES = [u'c', u'a', u'\u00fcber', u'b']
+
+
+def setup_module(module):
+    reset_textstore()
+    module.text_store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    module.sqlite_store = Store('sqlite',
+            {'db_file': os.path.join('store', 'store.db')},
+            environ={'tiddlyweb.config': config})
+    for store in [text_store, sqlite_store]:
+        store.put(Bag('many'))
+        for index, title in enumerate(TITLES):
+            tiddler = Tiddler(title, 'many')
+            tiddler.text = u'text of %s' % title
+            tiddler.tags = [u'tag%s' % (index % 2)]
+            tiddler.fields[u'order'] = u'%s' % index
+            store.put(tiddler)
+
+
+def test_get_many_in_order():
+    for store in [text_store, sqlite_store]:
+        tiddlers = [Tiddler(title, 'many') for title in TITLES]
+        got = store.get_many(tiddlers)
+        assert [tiddler.title for tiddler in got] == TITLES
+        assert [tiddler.text for tiddler in got] == [
+                u'text of %s' % title for title in TITLES]
+        assert got[2] is tiddlers[2]
+        assert got[2].store is store
+        assert got[1].fields[u'order'] == u'1'
+
+
+def test_missing_left_unloaded():
+    for store in [text_store, sqlite_store]:
+        got = store.get_many([Tiddler('a', 'many'), Tiddler('nope', 'many'),
+            Tiddler('a', 'nobag')])
+        assert got[0].store is store
+        assert [tiddler.store for tiddler in got[1:]] == [None, None]
+
+
+def test_revisions():
+    for store in [text_store, sqlite_store]:
+        tiddler = Tiddler('a', 'many')
+        tiddler.text = u'changed'
+        store.put(tiddler)
+        old = Tiddler('a', 'many')
+        old.revision = store.list_tiddler_revisions(tiddler)[-1]
+        got = store.get_many([old, Tiddler('a', 'many')])
+        assert got[0].text == u'text of a'
+        assert got[1].text == u'changed'
+
+
+def test_sqlite_reads_heads_in_one_query():
+    statements = []
+    connection = sqlite_store.storage._connect()
+    connection.set_trace_callback(statements.append)
+    try:
+        sqlite_store.get_many([Tiddler(title, 'many') for title in TITLES])
+    finally:
+        connection.set_trace_callback(None)
+    assert len([statement for statement in statements
+        if statement.startswith('SELECT')]) == 1
+
+
+def test_default_get_many():
+    storage = StorageInterface()
+    storage.tiddler_get = text_store.storage.tiddler_get
+    results = list(storage.tiddler_get_many([Tiddler('b', 'many'),
+        Tiddler('nope', 'many')]))
+    assert results[0].text == u'text of b'
+    assert isinstance(results[1], StoreError)
+
+
+def test_collections_and_filters():
+    for store in [text_store, sqlite_store]:
+        tiddlers = Tiddlers(store=store)
+        for title in TITLES + [u'gone']:
+            tiddlers.add(Tiddler(title, 'many'))
+        assert [tiddler.title for tiddler in tiddlers] == TITLES
+
+        found = filter_tiddlers(store.list_bag_tiddlers(Bag('many')),
+                'select=tag:tag0;sort=-order', environ={
+                    'tiddlyweb.store': store, 'tiddlyweb.config': config})
+        assert [tiddler.title for tiddler in found] == [u'\u00fcber', u'c']
@@ -0,0 +1,100 @@
+"""
+Test the identity map of the store facade.
+"""
+
+import py.test
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, NoBagError, NoTiddlerError
+
+from .fixtures import reset_textstore
+
+GETS = []
+
+
+def setup_module(module):
+    reset_textstore()
+    map_config = dict(config)
+    map_config['store.identity_map'] = True
+    module.store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': map_config})
+    for method in ['tiddler_get', 'bag_get']:
+        _count(store, method)
+    store.put(Bag('mapped'))
+    tiddler = Tiddler('one', 'mapped')
+    tiddler.text = u'first'
+    tiddler.tags = [u'alpha']
+    store.put(tiddler)
+
+
+def _count(store, method):
+    getter = getattr(store.storage, method)
+
+    def counted(thing):
+        GETS.append(method)
+        return getter(thing)
+
+    setattr(store.storage, method, counted)
+
+
+def test_get_once():
+    del GETS[:]
+    first = store.get(Tiddler('one', 'mapped'))
+    second = store.get(Tiddler('one', 'mapped'))
+    assert GETS == ['tiddler_get']
+    assert first is not second
+    assert second.text == 'first'
+    assert second.revision == first.revision
+    assert second.store is store
+
+    first.tags.append(u'beta')
+    assert store.get(Tiddler('one', 'mapped')).tags == ['alpha']
+
+    store.get(Bag('mapped'))
+    store.get(Bag('mapped'))
+    assert GETS == ['tiddler_get', 'bag_get']
+
+
+def test_revisions_are_separate():
+    del GETS[:]
+    old = Tiddler('one', 'mapped')
+    old.revision = store.get(Tiddler('one', 'mapped')).revision
+    store.get(old)
+    store.get(old)
+    assert GETS == ['tiddler_get']
+
+
+def test_put_forgets():
+    del GETS[:]
+    tiddler = Tiddler('one', 'mapped')
+    tiddler.text = u'second'
+    store.put(tiddler)
+    assert store.get(Tiddler('one', 'mapped')).text == 'second'
+    assert GETS == ['tiddler_get']
+
+    store.put_many([tiddler])
+    store.get(Tiddler('one', 'mapped'))
+    assert GETS == ['tiddler_get', 'tiddler_get']
+
+
+def test_delete_forgets():
+    store.get(Tiddler('one', 'mapped'))
+    store.delete(Tiddler('one', 'mapped'))
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('one', 'mapped'))
+
+    store.put(Tiddler('two', 'mapped'))
+    store.get(Tiddler('two', 'mapped'))
+    store.delete(Bag('mapped'))
+    with py.test.raises(NoBagError):
+        store.get(Bag('mapped'))
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('two', 'mapped'))
+
+
+def test_off_by_default():
+    plain = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    assert plain._identity_map is None
@@ -0,0 +1,223 @@
+"""
+Test the write-ahead journal of the text store.
+"""
+
+import os
+import threading
+import time
+
+import py.test
+import simplejson
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, StoreError
+from tiddlyweb.stores import text as text_store
+
+from .fixtures import reset_textstore
+
+JOURNAL_DIR = os.path.join('store', 'journal')
+TIDDLERS_DIR = os.path.join('store', 'bags', 'journaled', 'tiddlers')
+
+
+def _store(durability='sync'):
+    return Store('text', {'store_root': 'store', 'journal': True,
+        'journal_durability': durability},
+        environ={'tiddlyweb.config': config})
+
+
+def _journal():
+    return store.storage._journal()
+
+
+def _journal_records():
+    records = []
+    for name in os.listdir(JOURNAL_DIR):
+        with open(os.path.join(JOURNAL_DIR, name), 'rb') as journal_file:
+            records.extend(text_store._read_journal(journal_file))
+    return records
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = _store()
+    store.put(Bag('journaled'))
+
+
+def teardown_module(module):
+    _journal().close()
+
+
+def test_put_journaled(monkeypatch):
+    journal_store = _journal().store
+    release = threading.Event()
+    write_revision = journal_store._write_revision
+
+    def held_write(*args):
+        release.wait()
+        return write_revision(*args)
+
+    monkeypatch.setattr(journal_store, '_write_revision', held_write)
+
+    tiddler = Tiddler('one', 'journaled')
+    tiddler.text = u'first \u00fcn\u00efcode'
+    tiddler.tags = [u'alpha']
+    store.put(tiddler)
+    assert tiddler.revision == 1
+    tiddler.text = u'second'
+    store.put(tiddler)
+    assert tiddler.revision == 2
+
+    assert not os.path.exists(os.path.join(TIDDLERS_DIR, 'one', '1'))
+    records = _journal_records()
+    assert [record['revision'] for record in records] == [1, 2]
+    assert records[0]['text'] == u'first \u00fcn\u00efcode'
+    assert records[0]['tags'] == [u'alpha']
+
+    release.set()
+    tiddler = store.get(Tiddler('one', 'journaled'))
+    assert tiddler.revision == 2
+    assert tiddler.text == 'second'
+    assert store.list_tiddler_revisions(tiddler) == [2, 1]
+
+    _journal().wait()
+    assert _journal_records() == []
+
+
+def test_concurrent_puts():
+    errors = []
+
+    def put_many(numeral):
+        try:
+            thread_store = _store()
+            for count in range(10):
+                tiddler = Tiddler('shared', 'journaled')
+                tiddler.text = u'%s %s' % (numeral, count)
+                thread_store.put(tiddler)
+                tiddler = Tiddler('own%s' % numeral, 'journaled')
+                tiddler.text = u'%s' % count
+                thread_store.put(tiddler)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=put_many, args=(numeral,))
+            for numeral in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    assert store.list_tiddler_revisions(Tiddler('shared', 'journaled')) == (
+            list(range(40, 0, -1)))
+    titles = sorted(tiddler.title for tiddler
+            in store.list_bag_tiddlers(Bag('journaled')))
+    assert titles == ['one', 'own0', 'own1', 'own2', 'own3', 'shared']
+    for numeral in range(4):
+        tiddler = store.get(Tiddler('own%s' % numeral, 'journaled'))
+        assert tiddler.revision == 10
+        assert tiddler.text == '9'
+
+
+def test_durability_apply():
+    apply_store = _store('apply')
+    tiddler = Tiddler('applied', 'journaled')
+    tiddler.text = u'on disk'
+    apply_store.put(tiddler)
+    assert os.path.exists(os.path.join(TIDDLERS_DIR, 'applied', '1'))
+
+
+def test_recover():
+    tiddler = Tiddler('lost', 'journaled')
+    tiddler.text = u'from the journal'
+    tiddler.revision = 1
+    record = text_store._journal_record(tiddler, {'first': 1})
+    with open(os.path.join(JOURNAL_DIR, '1-gone'), 'wb') as journal_file:
+        journal_file.write(('%s\n' % simplejson.dumps(record)).encode(
+            'utf-8'))
+        journal_file.write(b'{"title": "partly writ')
+
+    assert _journal().recover() == 1
+    assert not os.path.exists(os.path.join(JOURNAL_DIR, '1-gone'))
+    tiddler = store.get(Tiddler('lost', 'journaled'))
+    assert tiddler.text == 'from the journal'
+    assert tiddler.revision == 1
+
+
+def _write_journal(name, tiddler):
+    record = text_store._journal_record(tiddler, {'first': 1})
+    with open(os.path.join(JOURNAL_DIR, name), 'wb') as journal_file:
+        journal_file.write(('%s\n' % simplejson.dumps(record)).encode(
+            'utf-8'))
+
+
+def test_recover_revision_taken():
+    tiddler = Tiddler('taken', 'journaled')
+    tiddler.text = u'live'
+    store.put(tiddler)
+    _journal().wait()
+
+    stored = store.get(Tiddler('taken', 'journaled'))
+    _write_journal('1-same', stored)
+    assert _journal().recover() == 0
+    assert store.list_tiddler_revisions(stored) == [1]
+
+    journaled = Tiddler('taken', 'journaled')
+    journaled.text = u'from the journal'
+    journaled.revision = 1
+    _write_journal('1-taken', journaled)
+    assert _journal().recover() == 1
+    assert store.list_tiddler_revisions(journaled) == [2, 1]
+    tiddler = store.get(Tiddler('taken', 'journaled'))
+    assert tiddler.revision == 2
+    assert tiddler.text == 'from the journal'
+    old = Tiddler('taken', 'journaled')
+    old.revision = 1
+    assert store.get(old).text == 'live'
+
+
+def test_failed_write_kept(monkeypatch):
+    monkeypatch.setattr(text_store, 'JOURNAL_RETRY_DELAY', 0.01)
+    journal_store = _journal().store
+    fixed = threading.Event()
+    failures = []
+    write_revision = journal_store._write_revision
+
+    def failing_write(*args):
+        if not fixed.is_set():
+            failures.append(args[0].title)
+            raise IOError('disk trouble')
+        return write_revision(*args)
+
+    monkeypatch.setattr(journal_store, '_write_revision', failing_write)
+
+    tiddler = Tiddler('troubled', 'journaled')
+    tiddler.text = u'acknowledged'
+    store.put(tiddler)
+    with py.test.raises(StoreError) as exc:
+        store.get(Tiddler('troubled', 'journaled'))
+    assert 'disk trouble' in str(exc.value)
+    assert [record['title'] for record in _journal_records()] == [
+            'troubled']
+
+    fixed.set()
+    for _ in range(100):
+        try:
+            tiddler = store.get(Tiddler('troubled', 'journaled'))
+            break
+        except StoreError:
+            time.sleep(0.05)
+    assert tiddler.text == 'acknowledged'
+    assert set(failures) == set(['troubled'])
+    _journal().wait()
+    assert _journal_records() == []
+
+
+def test_bad_durability():
+    try:
+        _store('never')
+    except ValueError as exc:
+        assert 'journal_durability' in str(exc)
+    else:
+        raise AssertionError('bad durability accepted')
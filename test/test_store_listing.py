@@ -0,0 +1,76 @@
+"""
+Test the directory listings of the text store.
+"""
+
+import os
+import time
+
+import py.test
+
+import tiddlyweb.stores.text
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from .fixtures import reset_textstore
+
+TIDDLERS_DIR = os.path.join('store', 'bags', 'listed', 'tiddlers')
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    store.put(Bag('listed'))
+    for numeral in range(10):
+        tiddler = Tiddler('tiddler%s' % numeral, 'listed')
+        tiddler.text = u'text'
+        store.put(tiddler)
+
+
+def _age(path):
+    past = time.time() - 10
+    os.utime(path, (past, past))
+
+
+def _titles():
+    return sorted(tiddler.title
+            for tiddler in store.list_bag_tiddlers(Bag('listed')))
+
+
+def test_listing_without_stat(monkeypatch):
+    if tiddlyweb.stores.text.scandir is None:
+        py.test.skip('scandir is not available')
+
+    def no_isdir(path):
+        raise AssertionError('isdir on %s' % path)
+
+    monkeypatch.setattr(os.path, 'isdir', no_isdir)
+    assert _titles() == ['tiddler%s' % numeral for numeral in range(10)]
+
+
+def test_listing_reused(monkeypatch):
+    _age(TIDDLERS_DIR)
+    assert len(_titles()) == 10
+
+    def no_scan(path):
+        raise AssertionError('listed %s' % path)
+
+    monkeypatch.setattr(tiddlyweb.stores.text, 'scandir', no_scan)
+    monkeypatch.setattr(os, 'listdir', no_scan)
+    assert len(_titles()) == 10
+
+
+def test_listing_follows_changes():
+    _age(TIDDLERS_DIR)
+    assert len(_titles()) == 10
+    os.mkdir(os.path.join(TIDDLERS_DIR, 'made'))
+    assert 'made' in _titles()
+
+    tiddler = Tiddler('new', 'listed')
+    store.put(tiddler)
+    assert 'new' in _titles()
+    store.delete(tiddler)
+    assert 'new' not in _titles()
@@ -0,0 +1,164 @@
+"""
+Test the per-bag manifest kept by the text store.
+"""
+
+import os
+
+import py.test
+
+from tiddlyweb.config import config
+from tiddlyweb.filters import (FilterIndexRefused, parse_for_filters,
+        recursive_filter)
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, NoBagError
+from tiddlyweb.stores.text import index_query
+
+from .fixtures import reset_textstore
+
+MANIFEST_PATH = os.path.join('store', 'bags', 'manifested', 'manifest')
+
+
+def setup_module(module):
+    reset_textstore()
+    module.environ = {'tiddlyweb.config': config}
+    module.store = Store('text', {'store_root': 'store', 'manifest': True},
+            environ=module.environ)
+    module.environ['tiddlyweb.store'] = module.store
+
+    store.put(Bag('manifested'))
+    for numeral in range(5):
+        tiddler = Tiddler('tiddler%s' % numeral, 'manifested')
+        tiddler.text = u'text %s' % numeral
+        tiddler.modifier = u'cdent'
+        tiddler.tags = [u'tag%s' % (numeral % 2)]
+        tiddler.fields[u'number'] = u'%s' % numeral
+        store.put(tiddler)
+
+
+def test_manifest_listing():
+    assert os.path.exists(MANIFEST_PATH)
+    titles = sorted(tiddler.title
+            for tiddler in store.list_bag_tiddlers(Bag('manifested')))
+    assert titles == ['tiddler%s' % numeral for numeral in range(5)]
+
+
+def test_manifest_tracks_revisions_and_deletes():
+    tiddler = Tiddler('tiddler0', 'manifested')
+    tiddler.text = u'changed'
+    tiddler.modifier = u'fnd'
+    store.put(tiddler)
+
+    entries = store.storage._manifest_entries('manifested')
+    assert entries['tiddler0']['revision'] == 2
+    assert entries['tiddler0']['modifier'] == 'fnd'
+    assert entries['tiddler0']['creator'] == 'cdent'
+
+    store.delete(Tiddler('tiddler4', 'manifested'))
+    titles = [tiddler.title
+            for tiddler in store.list_bag_tiddlers(Bag('manifested'))]
+    assert 'tiddler4' not in titles
+    assert len(titles) == 4
+
+
+def test_missing_manifest_rebuilt():
+    os.unlink(MANIFEST_PATH)
+    titles = sorted(tiddler.title
+            for tiddler in store.list_bag_tiddlers(Bag('manifested')))
+    assert titles == ['tiddler%s' % numeral for numeral in range(4)]
+    entries = store.storage._manifest_entries('manifested')
+    assert entries['tiddler0']['revision'] == 2
+    assert entries['tiddler0']['creator'] == 'cdent'
+
+    with open(MANIFEST_PATH) as manifest:
+        assert manifest.readline().strip() == '{"manifest": 1}'
+
+
+def test_missing_bag():
+    with py.test.raises(NoBagError):
+        list(store.list_bag_tiddlers(Bag('nothere')))
+
+
+def test_index_query_select():
+    tiddlers = index_query(environ, tag=u'tag1', bag=u'manifested')
+    assert sorted(tiddler.title for tiddler in tiddlers) == [
+            'tiddler1', 'tiddler3']
+
+    tiddlers = index_query(environ, number=u'2', bag=u'manifested')
+    assert [tiddler.title for tiddler in tiddlers] == ['tiddler2']
+
+    tiddlers = index_query(environ, modifier=u'fnd', bag=u'manifested')
+    assert [tiddler.title for tiddler in tiddlers] == ['tiddler0']
+
+
+def test_index_query_refused():
+    with py.test.raises(FilterIndexRefused):
+        index_query(environ, text=u'text', bag=u'manifested')
+
+    other_environ = {'tiddlyweb.config': config,
+            'tiddlyweb.store': Store('text', {'store_root': 'store'},
+                environ={'tiddlyweb.config': config})}
+    with py.test.raises(FilterIndexRefused):
+        index_query(other_environ, tag=u'tag1', bag=u'manifested')
+
+
+def test_index_query_id():
+    assert index_query(environ, id=u'manifested:tiddler1')
+    assert not index_query(environ, id=u'manifested:tiddler4')
+
+
+def test_select_filter_uses_index():
+    config['indexer'] = 'tiddlyweb.stores.text'
+    try:
+        bag = Bag('manifested')
+        filters, _ = parse_for_filters('select=tag:tag1;sort=-title',
+                environ)
+        tiddlers = recursive_filter(filters, [], indexable=bag)
+        assert [tiddler.title for tiddler in tiddlers] == [
+                'tiddler3', 'tiddler1']
+    finally:
+        del config['indexer']
+
+
+def test_manifest_compaction():
+    tiddler = Tiddler('busy', 'manifested')
+    for numeral in range(120):
+        tiddler.text = u'%s' % numeral
+        store.put(tiddler)
+
+    with open(MANIFEST_PATH) as manifest:
+        lines = manifest.readlines()
+    assert len(lines) < 120
+    entries = store.storage._manifest_entries('manifested')
+    assert entries['busy']['revision'] == 120
+
+
+def test_delete_while_listing():
+    store.put(Bag('emptied'))
+    for numeral in range(5):
+        store.put(Tiddler('tiddler%s' % numeral, 'emptied'))
+    for tiddler in store.list_bag_tiddlers(Bag('emptied')):
+        store.delete(tiddler)
+    assert list(store.list_bag_tiddlers(Bag('emptied'))) == []
+
+
+def test_delete_during_batch_put():
+    putting = store.storage.tiddlers_put([Tiddler('batch0', 'manifested'),
+        Tiddler('batch1', 'manifested')])
+    next(putting)
+    store.delete(Tiddler('batch0', 'manifested'))
+    list(putting)
+    entries = store.storage._manifest_entries('manifested')
+    assert 'batch0' not in entries
+    assert 'batch1' in entries
+
+
+def test_manifest_removed_without_option():
+    plain = Store('text', {'store_root': 'store'}, environ=environ)
+    plain.put(Tiddler('unmanifested', 'manifested'))
+    assert not os.path.exists(MANIFEST_PATH)
+
+    titles = [tiddler.title
+            for tiddler in store.list_bag_tiddlers(Bag('manifested'))]
+    assert 'unmanifested' in titles
+    assert os.path.exists(MANIFEST_PATH)
@@ -0,0 +1,94 @@
+"""
+Test counting and timing the calls of instrumented stores.
+"""
+
+import py.test
+import simplejson
+
+from tiddlyweb import store as store_module
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, StoreMetrics, NoBagError, NoTiddlerError
+
+from .fixtures import reset_textstore
+
+
+def setup_module(module):
+    reset_textstore()
+    instrument_config = dict(config)
+    instrument_config['store.instrument'] = True
+    module.store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': instrument_config})
+
+
+def setup_function(function):
+    store_module.METRICS = StoreMetrics()
+
+
+def _methods():
+    return dict(((entry['method'], entry['entity']), entry)
+            for entry in store_module.METRICS.snapshot()['methods'])
+
+
+def test_calls_counted():
+    store.put(Bag('metered'))
+    tiddler = Tiddler('one', 'metered')
+    tiddler.text = u'hi'
+    store.put(tiddler)
+    store.get(Tiddler('one', 'metered'))
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('two', 'metered'))
+
+    methods = _methods()
+    assert methods[('put', 'bag')]['calls'] == 1
+    assert methods[('put', 'tiddler')]['calls'] == 1
+    get = methods[('get', 'tiddler')]
+    assert get['engine'] == 'text'
+    assert get['calls'] == 2
+    assert get['errors'] == 1
+    assert sum(get['buckets']) == 2
+    assert get['seconds'] > 0
+
+    bags = store_module.METRICS.snapshot()['bags']
+    assert bags == [{'engine': 'text', 'bag': 'metered', 'calls': 4,
+        'seconds': bags[0]['seconds']}]
+    simplejson.dumps(store_module.METRICS.snapshot())
+
+
+def test_lists_counted_when_iterated():
+    titles = [tiddler.title for tiddler
+            in store.list_bag_tiddlers(Bag('metered'))]
+    list(store.list_bags())
+    methods = _methods()
+    assert methods[('list_bag_tiddlers', 'tiddler')]['calls'] == 1
+    assert methods[('list_bags', 'bag')]['calls'] == 1
+    assert titles == ['one']
+
+    with py.test.raises(NoBagError):
+        list(store.list_bag_tiddlers(Bag('nothere')))
+    assert _methods()[('list_bag_tiddlers', 'tiddler')]['errors'] == 1
+
+
+def test_exposition():
+    store.get(Bag('metered'))
+    text = store_module.METRICS.exposition()
+    labels = 'engine="text",entity="bag",method="get"'
+    assert ('tiddlyweb_store_seconds_bucket{%s,le="+Inf"} 1' % labels
+            in text)
+    assert 'tiddlyweb_store_seconds_count{%s} 1' % labels in text
+    assert 'tiddlyweb_store_errors_total{%s} 0' % labels in text
+    assert ('tiddlyweb_store_bag_calls_total{bag="metered",engine="text"} 1'
+            in text)
+
+
+def test_label_escaping():
+    assert (store_module._labels(bag=u'a "b"\\c')
+            == u'bag="a \\"b\\"\\\\c"')
+
+
+def test_off_by_default():
+    plain = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    plain.get(Bag('metered'))
+    assert store_module.METRICS.snapshot()['methods'] == []
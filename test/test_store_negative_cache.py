@@ -0,0 +1,124 @@
+"""
+Test the negative cache of gets which found nothing.
+"""
+
+import py.test
+
+from tiddlyweb import store as store_module
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, NoBagError, NoTiddlerError
+
+from .fixtures import reset_textstore
+
+GETS = []
+
+
+def setup_module(module):
+    reset_textstore()
+    store_module.MISSING = store_module.NegativeCache()
+    module.store = _store()
+    store.put(Bag('present'))
+
+
+def _store(size=10, ttl=60):
+    negative_config = dict(config)
+    negative_config['store.negative_cache'] = size
+    negative_config['store.negative_cache_ttl'] = ttl
+    counted_store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': negative_config})
+    getter = counted_store.storage.tiddler_get
+
+    def counted(tiddler):
+        GETS.append(tiddler.title)
+        return getter(tiddler)
+
+    counted_store.storage.tiddler_get = counted
+    return counted_store
+
+
+def test_misses_are_remembered():
+    del GETS[:]
+    for _ in range(3):
+        with py.test.raises(NoTiddlerError):
+            store.get(Tiddler('polled', 'present'))
+    assert GETS == ['polled']
+    assert store_module.MISSING.hits == 2
+
+    with py.test.raises(NoTiddlerError):
+        _store().get(Tiddler('polled', 'present'))
+    assert GETS == ['polled']
+
+
+def test_put_forgets():
+    del GETS[:]
+    tiddler = Tiddler('polled', 'present')
+    tiddler.text = u'here now'
+    Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config}).put(tiddler)
+    assert store.get(Tiddler('polled', 'present')).text == 'here now'
+    assert GETS == ['polled']
+
+
+def test_bag_put_forgets_its_tiddlers():
+    with py.test.raises(NoBagError):
+        store.get(Bag('later'))
+    with py.test.raises((NoBagError, NoTiddlerError)):
+        store.get(Tiddler('waiting', 'later'))
+    store.put(Bag('later'))
+    assert store.get(Bag('later')).name == 'later'
+    del GETS[:]
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('waiting', 'later'))
+    assert GETS == ['waiting']
+
+
+def test_misses_expire():
+    del GETS[:]
+    expiring = _store(ttl=-1)
+    for _ in range(2):
+        with py.test.raises(NoTiddlerError):
+            expiring.get(Tiddler('expiring', 'present'))
+    assert GETS == ['expiring', 'expiring']
+
+
+def test_size_is_bounded():
+    del GETS[:]
+    small = _store(size=2)
+    for title in ['one', 'two', 'three', 'one']:
+        with py.test.raises(NoTiddlerError):
+            small.get(Tiddler(title, 'present'))
+    assert GETS == ['one', 'two', 'three', 'one']
+
+
+def test_miss_racing_a_put_is_not_added():
+    cache = store_module.NegativeCache()
+    generation = cache.generation
+    cache.forget(Tiddler('raced', 'present'))
+    key = ('store', 'tiddler', 'present', 'raced', None)
+    cache.add(key, NoTiddlerError('no tiddler'), generation, 10, 60)
+    cache.check(key)
+
+
+def test_off_by_default():
+    plain = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    assert plain._negative_cache is None
+
+
+def test_hook_registered_when_enabled():
+    hooks = [store_module.HOOKS[entity]['put']
+            for entity in ['recipe', 'bag', 'tiddler', 'user']]
+    for put_hooks in hooks:
+        put_hooks.remove(store_module._forget_missing)
+
+    Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    assert [store_module._forget_missing in put_hooks
+            for put_hooks in hooks] == [False] * 4
+
+    _store()
+    _store()
+    assert [put_hooks.count(store_module._forget_missing)
+            for put_hooks in hooks] == [1] * 4
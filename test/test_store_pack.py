@@ -0,0 +1,124 @@
+"""
+Test the packing of old tiddler revisions in the text store.
+"""
+
+import os
+
+import py.test
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, NoTiddlerError
+
+from .fixtures import reset_textstore
+
+TIDDLER_DIR = os.path.join('store', 'bags', 'packed', 'tiddlers', 'busy')
+PACK_INDEX = os.path.join(TIDDLER_DIR, 'pack.index')
+
+
+def _store(pack):
+    return Store('text', {'store_root': 'store', 'pack_revisions': pack},
+            environ={'tiddlyweb.config': config})
+
+
+def _revision(store, revision):
+    tiddler = Tiddler('busy', 'packed')
+    tiddler.revision = revision
+    return store.get(tiddler)
+
+
+def setup_module(module):
+    reset_textstore()
+    store = _store(False)
+    store.put(Bag('packed'))
+    for numeral in range(1, 5):
+        tiddler = Tiddler('busy', 'packed')
+        tiddler.text = u'revision %s' % numeral
+        tiddler.modifier = u'author%s' % numeral
+        store.put(tiddler)
+    with open('test/peermore.png', 'rb') as image_file:
+        module.image = image_file.read()
+
+
+def test_pack_store():
+    store = _store(False)
+    assert store.storage.pack() == 3
+    assert store.storage.pack() == 0
+    assert sorted(os.listdir(TIDDLER_DIR)) == ['4', 'index', 'pack',
+            'pack.index']
+
+    assert store.list_tiddler_revisions(Tiddler('busy', 'packed')) == [
+            4, 3, 2, 1]
+    tiddler = store.get(Tiddler('busy', 'packed'))
+    assert tiddler.text == 'revision 4'
+    assert tiddler.creator == 'author1'
+    for numeral in range(1, 4):
+        tiddler = _revision(store, numeral)
+        assert tiddler.text == u'revision %s' % numeral
+        assert tiddler.modifier == u'author%s' % numeral
+
+
+def test_pack_on_put():
+    store = _store(True)
+    tiddler = Tiddler('busy', 'packed')
+    tiddler.type = 'image/png'
+    tiddler.text = image
+    store.put(tiddler)
+    tiddler = Tiddler('busy', 'packed')
+    tiddler.text = u'revision 6'
+    store.put(tiddler)
+
+    assert sorted(os.listdir(TIDDLER_DIR)) == ['6', 'index', 'pack',
+            'pack.index']
+    assert _revision(store, 5).text == image
+    assert _revision(store, 4).text == 'revision 4'
+    assert store.get(Tiddler('busy', 'packed')).text == 'revision 6'
+    assert store.list_tiddler_revisions(Tiddler('busy', 'packed')) == [
+            6, 5, 4, 3, 2, 1]
+
+
+def _pack_index_lines():
+    with open(PACK_INDEX, 'rb') as pack_index_file:
+        return pack_index_file.read().splitlines()
+
+
+def test_pack_index_appended_and_compacted():
+    store = _store(True)
+    assert len(_pack_index_lines()) == 3
+    with open(PACK_INDEX, 'ab') as pack_index_file:
+        pack_index_file.write(b'{"9": [0, ')
+    tiddler = Tiddler('busy', 'packed')
+    tiddler.text = u'revision 7'
+    store.put(tiddler)
+    assert len(_pack_index_lines()) == 5
+    assert _revision(store, 6).text == 'revision 6'
+
+    assert store.storage.pack() == 0
+    assert len(_pack_index_lines()) == 1
+    assert store.list_tiddler_revisions(Tiddler('busy', 'packed')) == [
+            7, 6, 5, 4, 3, 2, 1]
+    assert _revision(store, 5).text == image
+    assert _revision(store, 1).text == 'revision 1'
+
+
+def test_whole_pack_index_appended_to():
+    store = _store(True)
+    with open(PACK_INDEX, 'rb') as pack_index_file:
+        whole = pack_index_file.read().rstrip()
+    with open(PACK_INDEX, 'wb') as pack_index_file:
+        pack_index_file.write(whole)
+    tiddler = Tiddler('busy', 'packed')
+    tiddler.text = u'revision 8'
+    store.put(tiddler)
+    assert len(_pack_index_lines()) == 2
+    assert _revision(store, 7).text == 'revision 7'
+    assert _revision(store, 2).text == 'revision 2'
+
+
+def test_packed_revision_missing():
+    store = _store(True)
+    tiddler = Tiddler('busy', 'packed')
+    tiddler.revision = 10
+    with py.test.raises(NoTiddlerError):
+        store.get(tiddler)
@@ -0,0 +1,93 @@
+"""
+Test reusing storage between requests.
+"""
+
+import threading
+
+from tiddlyweb import store as store_module
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.store import Store, pooled_store
+from tiddlyweb.web.wsgi import StoreSet
+
+from .fixtures import reset_textstore
+
+STORES = []
+
+
+def setup_module(module):
+    reset_textstore()
+    store_module.POOL = threading.local()
+
+
+def _app(environ, start_response):
+    STORES.append(environ['tiddlyweb.store'])
+    return []
+
+
+def _request(pool=True):
+    pool_config = dict(config)
+    pool_config['store.pool'] = pool
+    environ = {'tiddlyweb.config': pool_config}
+    StoreSet(_app)(environ, None)
+    return environ
+
+
+def test_storage_reused_in_thread():
+    del STORES[:]
+    first_environ = _request()
+    second_environ = _request()
+    first, second = STORES
+    assert first is not second
+    assert first.storage is second.storage
+    assert second.environ is second_environ
+    assert second.storage.environ is second_environ
+    assert first.environ is first_environ
+
+    second.put(Bag('pooled'))
+    assert first.get(Bag('pooled')).name == 'pooled'
+
+
+def test_storage_per_thread():
+    del STORES[:]
+    _request()
+    thread = threading.Thread(target=_request)
+    thread.start()
+    thread.join()
+    assert STORES[0].storage is not STORES[1].storage
+
+
+def test_storage_per_config():
+    environ = {'tiddlyweb.config': config}
+    text = pooled_store('text', {'store_root': 'store'}, environ)
+    other = pooled_store('text', {'store_root': 'store/pooled'}, environ)
+    assert text.storage is not other.storage
+    assert pooled_store('text', {'store_root': 'store'},
+            environ).storage is text.storage
+
+
+def test_cached_store_binds_wrapped():
+    environ = {'tiddlyweb.config': config}
+    store_config = {'wrapped_store': ['text', {'store_root': 'store'}]}
+    cached = pooled_store('cached', store_config, environ)
+    new_environ = {'tiddlyweb.config': config}
+    assert pooled_store('cached', store_config,
+            new_environ).storage is cached.storage
+    assert cached.storage.wrapped.environ is new_environ
+
+
+def test_off_by_default():
+    del STORES[:]
+    _request(pool=False)
+    _request(pool=False)
+    assert STORES[0].storage is not STORES[1].storage
+    assert not config['store.pool']
+    assert isinstance(STORES[0], Store)
+
+
+def test_text_listings_forgotten_when_bound():
+    environ = {'tiddlyweb.config': config}
+    store = pooled_store('text', {'store_root': 'store'}, environ)
+    store.storage._listings['store'] = (0, [])
+    assert pooled_store('text', {'store_root': 'store'},
+            environ).storage._listings == {}
@@ -0,0 +1,111 @@
+"""
+Test putting many tiddlers at once.
+"""
+
+import os
+
+import py.test
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store, HOOKS, NoBagError, StoreLockError
+from tiddlyweb.stores import StorageInterface
+from tiddlyweb.util import write_lock, write_unlock
+
+from .fixtures import reset_textstore
+
+HOOKED = []
+
+
+def put_hook(store, tiddler):
+    HOOKED.append(tiddler.title)
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = Store('text', {'store_root': 'store', 'manifest': True},
+            environ={'tiddlyweb.config': config})
+    store.put(Bag('one'))
+    store.put(Bag('two'))
+    HOOKS['tiddler']['put'].append(put_hook)
+
+
+def teardown_module(module):
+    HOOKS['tiddler']['put'].remove(put_hook)
+
+
+def _tiddlers(bag_name, count, text=u'text'):
+    tiddlers = []
+    for numeral in range(count):
+        tiddler = Tiddler('tiddler%s' % numeral, bag_name)
+        tiddler.text = u'%s %s' % (text, numeral)
+        tiddler.modifier = u'importer'
+        tiddlers.append(tiddler)
+    return tiddlers
+
+
+def test_put_many():
+    del HOOKED[:]
+    tiddlers = _tiddlers('one', 5) + _tiddlers('two', 3)
+    store.put_many(tiddlers)
+
+    assert HOOKED == [tiddler.title for tiddler in tiddlers]
+    assert [tiddler.revision for tiddler in tiddlers] == [1] * 8
+    assert sorted(tiddler.title for tiddler in
+            store.list_bag_tiddlers(Bag('one'))) == [
+                    'tiddler%s' % numeral for numeral in range(5)]
+
+    tiddler = store.get(Tiddler('tiddler2', 'two'))
+    assert tiddler.text == 'text 2'
+    assert tiddler.creator == 'importer'
+
+
+def test_put_many_revisions():
+    tiddlers = _tiddlers('one', 2, u'again') + _tiddlers('one', 1, u'more')
+    store.put_many(tiddlers)
+    assert [tiddler.revision for tiddler in tiddlers] == [2, 2, 3]
+    assert store.get(Tiddler('tiddler0', 'one')).text == 'more 0'
+
+    entries = store.storage._manifest_entries('one')
+    assert entries['tiddler0']['revision'] == 3
+    assert entries['tiddler1']['revision'] == 2
+
+
+def test_put_many_failure():
+    del HOOKED[:]
+    lock_path = os.path.join('store', 'bags', 'two', 'tiddlers', 'tiddler1')
+    write_lock(lock_path)
+    store.storage._lock_timeout = 0
+    try:
+        with py.test.raises(StoreLockError):
+            store.put_many(_tiddlers('two', 3, u'changed'))
+    finally:
+        store.storage._lock_timeout = 5
+        write_unlock(lock_path)
+    assert HOOKED == ['tiddler0']
+    assert store.storage._manifest_entries('two')['tiddler0'][
+            'revision'] == 2
+
+    with py.test.raises(NoBagError):
+        store.put_many(_tiddlers('three', 1))
+
+
+class PutOnly(StorageInterface):
+
+    def __init__(self):
+        StorageInterface.__init__(self)
+        self.put = []
+
+    def tiddler_put(self, tiddler):
+        self.put.append(tiddler.title)
+
+
+def test_put_many_fallback():
+    del HOOKED[:]
+    other_store = Store('text', {'store_root': 'store'},
+            environ={'tiddlyweb.config': config})
+    other_store.storage = PutOnly()
+    other_store.put_many(_tiddlers('one', 2))
+    assert other_store.storage.put == ['tiddler0', 'tiddler1']
+    assert HOOKED == ['tiddler0', 'tiddler1']
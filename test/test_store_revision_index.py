@@ -0,0 +1,114 @@
+"""
+Test the per-tiddler revision index kept by the text store.
+"""
+
+import os
+import simplejson
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+
+from .fixtures import reset_textstore, _teststore
+
+TIDDLER_DIR = os.path.join('store', 'bags', 'indexed', 'tiddlers', 'edited')
+INDEX_PATH = os.path.join(TIDDLER_DIR, 'index')
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = _teststore()
+    store.put(Bag('indexed'))
+    for numeral in range(1, 4):
+        tiddler = Tiddler('edited', 'indexed')
+        tiddler.text = u'edit %s' % numeral
+        tiddler.modifier = u'editor%s' % numeral
+        tiddler.modified = u'2012010100000%s' % numeral
+        store.put(tiddler)
+
+
+def test_index_written():
+    with open(INDEX_PATH) as index_file:
+        revision_index = simplejson.load(index_file)
+    assert revision_index == {'head': 3, 'first': 1,
+            'created': '20120101000001', 'creator': 'editor1'}
+
+
+def test_get_without_listing(monkeypatch):
+
+    def no_listing(path):
+        raise AssertionError('listed %s' % path)
+
+    monkeypatch.setattr(os, 'listdir', no_listing)
+    tiddler = store.get(Tiddler('edited', 'indexed'))
+    assert tiddler.revision == 3
+    assert tiddler.text == 'edit 3'
+    assert tiddler.created == '20120101000001'
+    assert tiddler.creator == 'editor1'
+    assert tiddler.modifier == 'editor3'
+
+    tiddler = Tiddler('edited', 'indexed')
+    tiddler.revision = 2
+    tiddler = store.get(tiddler)
+    assert tiddler.text == 'edit 2'
+    assert tiddler.creator == 'editor1'
+
+
+def test_legacy_tiddler_without_index():
+    os.unlink(INDEX_PATH)
+    tiddler = store.get(Tiddler('edited', 'indexed'))
+    assert tiddler.revision == 3
+    assert tiddler.creator == 'editor1'
+
+    tiddler.text = u'edit 4'
+    tiddler.modifier = u'editor4'
+    store.put(tiddler)
+    assert tiddler.revision == 4
+
+    with open(INDEX_PATH) as index_file:
+        revision_index = simplejson.load(index_file)
+    assert revision_index['head'] == 4
+    assert revision_index['creator'] == 'editor1'
+    assert store.list_tiddler_revisions(tiddler) == [4, 3, 2, 1]
+
+
+def test_revision_carries_created():
+    tiddler = Tiddler('edited', 'indexed')
+    tiddler.revision = 4
+    with open(os.path.join(TIDDLER_DIR, '4')) as revision_file:
+        assert revision_file.read().startswith(
+                'creator: editor1\ncreated: 20120101000001\n')
+    os.unlink(INDEX_PATH)
+    tiddler = store.get(tiddler)
+    assert tiddler.creator == 'editor1'
+    assert tiddler.created == '20120101000001'
+
+
+def test_upgrade_legacy_revisions():
+    store.put(Bag('legacy'))
+    tiddler_dir = os.path.join('store', 'bags', 'legacy', 'tiddlers', 'old')
+    os.mkdir(tiddler_dir)
+    with open(os.path.join(tiddler_dir, '1'), 'w') as revision_file:
+        revision_file.write('modifier: cdent\nmodified: 20090101000000\n'
+                'created: 19990101000000\n\nold text\n')
+    with open(os.path.join(tiddler_dir, '2'), 'w') as revision_file:
+        revision_file.write('modifier: fnd\nmodified: 20100101000000\n'
+                'tags: one\n\nnew text\n')
+
+    tiddler = store.get(Tiddler('old', 'legacy'))
+    assert tiddler.created == '20090101000000'
+    assert tiddler.creator == 'cdent'
+
+    assert store.storage.upgrade() == 2
+    assert store.storage.upgrade() == 0
+
+    with open(os.path.join(tiddler_dir, '2')) as revision_file:
+        assert revision_file.read() == ('creator: cdent\n'
+                'created: 20090101000000\nmodifier: fnd\n'
+                'modified: 20100101000000\ntags: one\n\nnew text\n')
+
+    tiddler = store.get(Tiddler('old', 'legacy'))
+    assert tiddler.revision == 2
+    assert tiddler.text == 'new text'
+    assert tiddler.tags == ['one']
+    assert tiddler.created == '20090101000000'
+    assert tiddler.creator == 'cdent'
@@ -0,0 +1,133 @@
+"""
+Test the search index kept by the text store.
+"""
+
+import os
+
+from tiddlyweb.config import config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from .fixtures import reset_textstore
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = Store('text', {'store_root': 'store',
+        'search_index': True}, environ={'tiddlyweb.config': config})
+
+    store.put(Bag('indexed'))
+    store.put(Bag('other'))
+    for numeral, words in enumerate([u'alpha beta', u'beta gamma',
+            u'gamma delta \u00dcn\u00efcode']):
+        tiddler = Tiddler('tiddler%s' % numeral, 'indexed')
+        tiddler.text = words
+        tiddler.tags = [u'tag%s' % numeral]
+        tiddler.fields[u'colour'] = u'red%s' % numeral
+        store.put(tiddler)
+    tiddler = Tiddler('Title With Spaces', 'other')
+    tiddler.text = u'beta'
+    store.put(tiddler)
+
+
+def _titles(query):
+    return sorted(tiddler.title for tiddler in store.search(query))
+
+
+def test_index_used():
+    assert os.path.exists(os.path.join('store', 'search.db'))
+    assert store.storage._search_index.complete()
+
+    def no_grep(query):
+        raise AssertionError('grepped for %s' % query)
+
+    store.storage._grep = no_grep
+    try:
+        assert _titles(u'beta') == ['Title With Spaces', 'tiddler0',
+                'tiddler1']
+        assert _titles(u'Beta GAMMA') == ['tiddler1']
+        assert _titles(u'\u00fcn\u00efcode') == ['tiddler2']
+        assert _titles(u'tag1') == ['tiddler1']
+        assert _titles(u'red2') == ['tiddler2']
+        assert _titles(u'title with spaces') == ['Title With Spaces']
+        assert _titles(u'nothing') == []
+    finally:
+        del store.storage._grep
+
+
+def test_results_unloaded():
+    tiddler = list(store.search(u'alpha'))[0]
+    assert tiddler.bag == 'indexed'
+    assert tiddler.store is None
+    assert tiddler.text == ''
+
+
+def test_index_follows_changes():
+    tiddler = Tiddler('tiddler0', 'indexed')
+    tiddler.text = u'omega'
+    store.put(tiddler)
+    assert _titles(u'alpha') == []
+    assert _titles(u'omega') == ['tiddler0']
+
+    store.delete(Tiddler('tiddler1', 'indexed'))
+    assert _titles(u'gamma') == ['tiddler2']
+
+    store.delete(Bag('other'))
+    assert _titles(u'beta') == []
+
+
+def test_reindex():
+    os.unlink(os.path.join('store', 'search.db'))
+    store.storage._search_index.close()
+    assert not store.storage._search_index.complete()
+    assert _titles(u'delta') == ['tiddler2']
+
+    assert store.storage.reindex() == 2
+    assert store.storage._search_index.complete()
+    assert _titles(u'omega') == ['tiddler0']
+    assert _titles(u'delta') == ['tiddler2']
+
+
+def test_index_behind_cached_store():
+    cached_store = Store('cached', {'wrapped_store': ['text',
+        {'store_root': 'store', 'search_index': True}]},
+        environ={'tiddlyweb.config': config})
+    tiddler = Tiddler('cached', 'indexed')
+    tiddler.text = u'hello'
+    cached_store.put(tiddler)
+    assert [found.title for found in cached_store.search(u'hello')] == [
+            'cached']
+    assert _titles(u'hello') == ['cached']
+
+    cached_store.delete(tiddler)
+    assert _titles(u'hello') == []
+
+
+def test_scan_matches_index():
+    queries = [u'gamma', u'gam', u'Delta GAMMA', u'delta omega',
+            u'tiddler2', u'TIDDLER0', u'red', u'red2', u'tag0', u'']
+    indexed = [_titles(query) for query in queries]
+    assert indexed[0] == ['tiddler2']
+    assert indexed[1] == []
+    assert indexed[3] == []
+
+    store.storage._search_index.clear(complete=False)
+    assert [_titles(query) for query in queries] == indexed
+
+    store.storage.reindex()
+    assert [_titles(query) for query in queries] == indexed
+
+
+def test_connection_shared():
+    search_index = store.storage._search_index
+    other = Store('text', {'store_root': 'store', 'search_index': True},
+            environ={'tiddlyweb.config': config}).storage._search_index
+    assert other is not search_index
+    assert other._connect() is search_index._connect()
+
+    search_index.close()
+    connection = other._connect()
+    assert connection is not None
+    assert search_index._connect() is connection
+    assert _titles(u'gamma') == ['tiddler2']
@@ -0,0 +1,219 @@
+"""
+Test the sqlite store.
+"""
+
+import os
+
+import py.test
+
+from tiddlyweb.config import config
+from tiddlyweb.filters import recursive_filter, parse_for_filters
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.user import User
+from tiddlyweb.store import (Store, NoBagError, NoRecipeError,
+        NoTiddlerError, NoUserError)
+from tiddlyweb.stores import sqlite as sqlite_store
+
+from .fixtures import reset_textstore
+
+DB_FILE = os.path.join('store', 'store.db')
+
+
+def setup_module(module):
+    reset_textstore()
+    module.store = Store('sqlite', {'db_file': DB_FILE},
+            environ={'tiddlyweb.config': config})
+
+
+def test_wal_mode():
+    store.put(Bag('bagone'))
+    connection = store.storage._connect()
+    assert connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert os.path.exists(DB_FILE)
+
+
+def test_bags():
+    bag = Bag('bagtwo', desc=u'a bag')
+    bag.policy = Policy(owner=u'cdent', read=[u'cdent'], manage=[u'R:ADMIN'])
+    store.put(bag)
+
+    loaded = store.get(Bag('bagtwo'))
+    assert loaded.desc == 'a bag'
+    assert loaded.policy == bag.policy
+    assert [bag.name for bag in store.list_bags()] == ['bagone', 'bagtwo']
+
+    with py.test.raises(NoBagError):
+        store.get(Bag('nothing'))
+
+
+def test_recipes():
+    recipe = Recipe('recipeone', desc=u'a recipe')
+    recipe.set_recipe([(u'bagone', u''), (u'bagtwo', u'select=tag:one')])
+    store.put(recipe)
+
+    loaded = store.get(Recipe('recipeone'))
+    assert loaded.desc == 'a recipe'
+    assert loaded.get_recipe() == recipe.get_recipe()
+    assert [recipe.name for recipe in store.list_recipes()] == ['recipeone']
+
+    store.delete(loaded)
+    with py.test.raises(NoRecipeError):
+        store.get(Recipe('recipeone'))
+    with py.test.raises(NoRecipeError):
+        store.delete(Recipe('recipeone'))
+
+
+def test_users():
+    user = User('cdent', note=u'a note')
+    user.set_password('cowpig')
+    user.add_role('ADMIN')
+    store.put(user)
+
+    loaded = store.get(User('cdent'))
+    assert loaded.note == 'a note'
+    assert loaded.check_password('cowpig')
+    assert loaded.list_roles() == ['ADMIN']
+    assert [user.usersign for user in store.list_users()] == ['cdent']
+
+    store.delete(loaded)
+    with py.test.raises(NoUserError):
+        store.get(User('cdent'))
+
+
+def test_tiddler_revisions():
+    tiddler = Tiddler('one', 'bagone')
+    tiddler.text = u'first \u00fcn\u00efcode'
+    tiddler.tags = [u'one', u'two words']
+    tiddler.fields[u'colour'] = u'red'
+    tiddler.modifier = u'cdent'
+    tiddler.modified = u'20120101000000'
+    store.put(tiddler)
+    assert tiddler.revision == 1
+
+    tiddler.text = u'second'
+    tiddler.modifier = u'fnd'
+    tiddler.modified = u'20120202000000'
+    store.put(tiddler)
+    assert tiddler.revision == 2
+
+    loaded = store.get(Tiddler('one', 'bagone'))
+    assert loaded.revision == 2
+    assert loaded.text == 'second'
+    assert loaded.tags == ['one', 'two words']
+    assert loaded.fields == {'colour': 'red'}
+    assert loaded.modifier == 'fnd'
+    assert loaded.creator == 'cdent'
+    assert loaded.created == '20120101000000'
+
+    first = Tiddler('one', 'bagone')
+    first.revision = 1
+    first = store.get(first)
+    assert first.text == u'first \u00fcn\u00efcode'
+    assert first.modifier == 'cdent'
+    assert store.list_tiddler_revisions(first) == [2, 1]
+
+    missing = Tiddler('one', 'bagone')
+    missing.revision = 3
+    with py.test.raises(NoTiddlerError):
+        store.get(missing)
+
+
+def test_binary_tiddler():
+    with open('test/peermore.png', 'rb') as image_file:
+        image = image_file.read()
+    tiddler = Tiddler('image', 'bagone')
+    tiddler.type = 'image/png'
+    tiddler.text = image
+    store.put(tiddler)
+    assert store.get(Tiddler('image', 'bagone')).text == image
+
+
+def test_put_needs_bag():
+    with py.test.raises(NoBagError):
+        store.put(Tiddler('lost', 'nothing'))
+
+
+def test_put_many_is_one_transaction():
+    tiddlers = [Tiddler('many%s' % numeral, 'bagtwo') for numeral in range(3)]
+    tiddlers.append(Tiddler('lost', 'nothing'))
+    with py.test.raises(NoBagError):
+        store.put_many(tiddlers)
+    assert list(store.list_bag_tiddlers(Bag('bagtwo'))) == []
+
+    store.put_many(tiddlers[:3])
+    assert [tiddler.title for tiddler in store.list_bag_tiddlers(
+        Bag('bagtwo'))] == ['many0', 'many1', 'many2']
+
+
+def test_search():
+    assert [tiddler.title for tiddler in store.search(u'second')] == ['one']
+    assert [tiddler.title for tiddler in store.search(u'words')] == ['one']
+    assert [tiddler.title for tiddler in store.search(u'many1')] == ['many1']
+    assert list(store.search(u'first')) == []
+    assert list(store.search(u'"')) == []
+
+
+def test_index_query():
+    environ = {'tiddlyweb.store': store,
+            'tiddlyweb.config': dict(config,
+                indexer='tiddlyweb.stores.sqlite')}
+
+    def select(filter_string):
+        filters, _ = parse_for_filters(filter_string, environ)
+        return [tiddler.title for tiddler in recursive_filter(filters,
+            store.list_bag_tiddlers(Bag('bagone')), indexable=Bag('bagone'))]
+
+    assert select('select=tag:two words') == ['one']
+    assert select('select=colour:red') == ['one']
+    assert select('select=field:colour') == ['one']
+    assert select('select=modifier:fnd') == ['one']
+    assert select('select=title:image') == ['image']
+    assert select('select=colour:blue') == []
+    assert sqlite_store.index_query(environ, id='bagone:one')[0].title == (
+            'one')
+
+    with py.test.raises(sqlite_store.FilterIndexRefused):
+        sqlite_store.index_query(environ, bag='bagone', text='second')
+
+
+def test_deletes():
+    store.delete(Tiddler('one', 'bagone'))
+    with py.test.raises(NoTiddlerError):
+        store.get(Tiddler('one', 'bagone'))
+    with py.test.raises(NoTiddlerError):
+        store.list_tiddler_revisions(Tiddler('one', 'bagone'))
+    assert list(store.search(u'second')) == []
+
+    store.delete(Bag('bagtwo'))
+    with py.test.raises(NoBagError):
+        list(store.list_bag_tiddlers(Bag('bagtwo')))
+    assert list(store.search(u'many1')) == []
+    connection = store.storage._connect()
+    assert connection.execute('SELECT COUNT(*) FROM revisions').fetchone()[
+            0] == 1
+
+
+def test_search_without_fts():
+    store.storage._searchable = False
+    try:
+        assert [tiddler.title for tiddler in store.search(u'IMAGE')] == [
+                'image']
+        assert list(store.search(u'second')) == []
+    finally:
+        store.storage._searchable = True
+
+
+def test_server_fields_not_stored():
+    store.put(Bag('served'))
+    tiddler = Tiddler('served', 'served')
+    tiddler.fields[u'server.etag'] = u'"stale"'
+    tiddler.fields[u'server.bag'] = u'elsewhere'
+    tiddler.fields[u'colour'] = u'blue'
+    store.put(tiddler)
+    tiddler = store.get(Tiddler('served', 'served'))
+    assert tiddler.fields == {u'colour': u'blue'}
+    assert store.storage._connect().execute('SELECT name FROM fields '
+            'WHERE name LIKE ?', ('server.%',)).fetchall() == []
@@ -9,12 +9,13 @@ Prequisites:
 """
 
 import os
+import threading
 
 from tiddlyweb.store import StoreLockError, NoTiddlerError, NoBagError
 from tiddlyweb.model.bag import Bag
 from tiddlyweb.model.tiddler import Tiddler
 from tiddlyweb.stores.text import Store as Texter
-from tiddlyweb.util import write_lock, LockError
+from tiddlyweb.util import write_lock, write_unlock, LockError
 
 from .fixtures import tiddlers, reset_textstore, _teststore
 
@@ -23,7 +24,9 @@ import py.test
 expected_stored_filename = os.path.join('store', 'bags', 'bagone',
     'tiddlers', 'TiddlerOne', '1')
 
-expected_stored_text = """modifier: AuthorOne
+expected_stored_text = """creator: AuthorOne
+created: 200803030303
+modifier: AuthorOne
 modified: 200803030303
 tags: tagone tagtwo [[tag five]]
 
@@ -166,8 +169,38 @@ def test_store_lock():
     tiddler = Tiddler('foobar')
     tiddler.text = 'hello'
     tiddler.bag = u'bagone'
-    with py.test.raises(StoreLockError):
-        store.put(tiddler)
+    store.storage._lock_timeout = 0.2
+    try:
+        with py.test.raises(StoreLockError):
+            store.put(tiddler)
+    finally:
+        store.storage._lock_timeout = 5
+    write_unlock('store/bags' + '/bagone/tiddlers/foobar')
+
+
+def test_store_lock_waits():
+    """
+    A writer waits for the lock to be released rather than failing.
+    """
+    if type(store.storage) != Texter:
+        py.test.skip('skipping this test for non-text store')
+
+    tiddler = Tiddler('waiter', 'bagone')
+    tiddler.text = 'hello'
+    store.put(tiddler)
+
+    tiddler_dir = os.path.join('store', 'bags', 'bagone', 'tiddlers',
+            'waiter')
+    write_lock(tiddler_dir)
+    threading.Timer(0.2, write_unlock, [tiddler_dir]).start()
+    store.put(tiddler)
+    assert tiddler.revision == 2
+
+    assert not os.path.exists(os.path.join('store', 'bags', 'bagone',
+        'tiddlers', '#waiter.lock'))
+    assert sorted(os.listdir(tiddler_dir)) == ['1', '2', 'index']
+    assert 'waiter' in [tiddler.title for tiddler in
+            store.list_bag_tiddlers(Bag('bagone'))]
 
 
 def test_put_with_slash():
@@ -0,0 +1,197 @@
+"""
+A durable, append-only log of the changes made through a
+:py:class:`Store <tiddlyweb.store.Store>`: every put or delete of a
+tiddler, bag, recipe or user, each with a sequence number one greater
+than the change before it.
+
+The log is kept when the ``change_log`` key of :py:mod:`config
+<tiddlyweb.config>` names a file. Read it with
+:py:meth:`Store.changes <tiddlyweb.store.Store.changes>`, or a
+:py:class:`ChangeLog` of the same file, to find what has changed since
+a sequence number already seen, without looking through the store.
+"""
+
+import os
+import threading
+import time
+
+import simplejson
+
+from tiddlyweb.util import superclass_name, write_lock, write_unlock
+
+
+# The size of the log file, and the sequence number of the last change
+# in it, when last written or read by this process, keyed by path.
+SEQUENCES = {}
+SEQUENCES_LOCK = threading.Lock()
+
+# How much of the end of the log is read to find the last change.
+TAIL_SIZE = 65536
+
+
+class ChangeLog(object):
+    """
+    A change log in the file at ``path``, one JSON object per line.
+
+    Each change has a ``seq``, the ``time`` it was logged, an
+    ``action`` of ``put`` or ``delete`` and the ``entity`` changed,
+    ``tiddler``, ``bag``, ``recipe`` or ``user``. A tiddler change has
+    the tiddler's ``bag``, ``title`` and ``revision``, a bag or recipe
+    change its ``name``, a user change its ``usersign``.
+
+    Changes are appended under a write lock on the file, which is
+    synced before the lock is released, so sequence numbers are unique
+    and increasing across processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def record(self, action, things):
+        """
+        Log an ``action`` on each of ``things``, returning the sequence
+        number of the last.
+        """
+        changes = [_describe(action, thing) for thing in things]
+        if not changes:
+            return None
+        write_lock(self.path, timeout=30)
+        try:
+            with open(self.path, 'ab+') as log_file:
+                sequence = self._last_sequence(log_file)
+                now = time.time()
+                lines = []
+                for change in changes:
+                    sequence += 1
+                    change['seq'] = sequence
+                    change['time'] = now
+                    lines.append('%s\n' % simplejson.dumps(change))
+                log_file.write(''.join(lines).encode('utf-8'))
+                log_file.flush()
+                os.fsync(log_file.fileno())
+                with SEQUENCES_LOCK:
+                    SEQUENCES[self.path] = (log_file.tell(), sequence)
+        finally:
+            write_unlock(self.path)
+        return sequence
+
+    def since(self, sequence=0):
+        """
+        Yield, in order, the changes logged after the one numbered
+        ``sequence``.
+        """
+        try:
+            log_file = open(self.path, 'rb')
+        except IOError:
+            return
+        with log_file:
+            log_file.seek(0, os.SEEK_END)
+            low, high = 0, log_file.tell()
+            # Find the first line with a later change by bisecting
+            # the file, the changes being in order.
+            while low < high:
+                middle = (low + high) // 2
+                if _sequence_at(log_file, middle) > sequence:
+                    high = middle
+                else:
+                    low = middle + 1
+            _line_start(log_file, low)
+            for line in log_file:
+                change = _parse(line)
+                if change is None:
+                    return
+                yield change
+
+    def _last_sequence(self, log_file):
+        """
+        Return the sequence number of the last change in ``log_file``,
+        opened for appending, removing any change partly written.
+        """
+        log_file.seek(0, os.SEEK_END)
+        size = log_file.tell()
+        with SEQUENCES_LOCK:
+            known_size, sequence = SEQUENCES.get(self.path, (None, 0))
+        if size == known_size:
+            return sequence
+        if not size:
+            return 0
+
+        end = _rfind_newline(log_file, size) + 1
+        if end < size:
+            # A change was partly written when its writer failed.
+            log_file.truncate(end)
+        if not end:
+            return 0
+        start = _rfind_newline(log_file, end - 1) + 1
+        log_file.seek(start)
+        return _parse(log_file.read(end - start))['seq']
+
+
+def _rfind_newline(log_file, end):
+    """
+    Return the position of the last newline in ``log_file`` before
+    ``end``, or ``-1`` if there is none, reading back ``TAIL_SIZE``
+    bytes at a time, as one change may be longer than that.
+    """
+    while end > 0:
+        start = max(end - TAIL_SIZE, 0)
+        log_file.seek(start)
+        found = log_file.read(end - start).rfind(b'\n')
+        if found >= 0:
+            return start + found
+        end = start
+    return -1
+
+
+def _describe(action, thing):
+    """
+    Return a dict describing an ``action`` on ``thing``.
+    """
+    entity = superclass_name(thing)
+    change = {'action': action, 'entity': entity}
+    if entity == 'tiddler':
+        change['bag'] = thing.bag
+        change['title'] = thing.title
+        change['revision'] = thing.revision
+    elif entity == 'user':
+        change['usersign'] = thing.usersign
+    else:
+        change['name'] = thing.name
+    return change
+
+
+def _line_start(log_file, offset):
+    """
+    Move ``log_file`` to the start of the first line at or after
+    ``offset``.
+    """
+    if offset:
+        log_file.seek(offset - 1)
+        log_file.readline()
+    else:
+        log_file.seek(0)
+
+
+def _sequence_at(log_file, offset):
+    """
+    Return the sequence number of the first change starting at or after
+    ``offset`` in ``log_file``, or infinity if there is none.
+    """
+    _line_start(log_file, offset)
+    change = _parse(log_file.readline())
+    if change is None:
+        return float('inf')
+    return change['seq']
+
+
+def _parse(line):
+    """
+    Return the change logged on ``line``, or ``None`` if the line is
+    not a whole change.
+    """
+    if not line.endswith(b'\n'):
+        return None
+    try:
+        return simplejson.loads(line.decode('utf-8'))
+    except ValueError:
+        return None
@@ -16,7 +16,7 @@ from __future__ import print_function
 
 import sys
 
-from tiddlyweb.store import Store, NoBagError
+from tiddlyweb.store import Store, NoBagError, StoreMethodNotImplemented
 from tiddlyweb.serializer import Serializer
 from tiddlyweb.model.user import User
 
@@ -241,6 +241,60 @@ def init(config):
         except NoBagError as exc:
             usage('unable to inspect bag %s: %s' % (listed_bag.name, exc))
 
+    @make_command()
+    def upgradestore(args):
+        """Upgrade the data in the store to the format of this TiddlyWeb."""
+        store = _store()
+        try:
+            upgrade = store.storage.upgrade
+        except AttributeError:
+            usage('the %s store has nothing to upgrade'
+                    % config['server_store'][0])
+        print('upgraded %s revisions' % upgrade())
+
+    @make_command()
+    def reindex(args):
+        """Rebuild the search index of the store."""
+        store = _store()
+        try:
+            indexed = store.storage.reindex()
+        except (AttributeError, StoreMethodNotImplemented):
+            usage('the current store has no search index')
+        print('indexed %s tiddlers' % indexed)
+
+    @make_command()
+    def reshard(args):
+        """Move tiddlers in the store to match its tiddler_fanout config."""
+        store = _store()
+        try:
+            reshard = store.storage.reshard
+        except AttributeError:
+            usage('the %s store can not be resharded'
+                    % config['server_store'][0])
+        print('moved %s tiddlers' % reshard())
+
+    @make_command()
+    def pack(args):
+        """Move old tiddler revisions in the store into pack files."""
+        store = _store()
+        try:
+            pack = store.storage.pack
+        except AttributeError:
+            usage('the %s store can not be packed'
+                    % config['server_store'][0])
+        print('packed %s revisions' % pack())
+
+    @make_command()
+    def merge(args):
+        """Merge the segments of the store, dropping dead records."""
+        store = _store()
+        try:
+            merge = store.storage.merge
+        except AttributeError:
+            usage('the %s store can not be merged'
+                    % config['server_store'][0])
+        print('reclaimed %s bytes' % merge())
+
     @make_command()
     def interact(args):
         """Enter a Python interactive shell."""
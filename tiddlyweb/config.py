@@ -138,6 +138,41 @@ collections.use_memory
     If ``True`` :py:class:`Tiddler Collections
     <tiddlyweb.model.collections.Tiddlers>` are kept in memory during a
     single request. Defaults to ``False`` to save memory.
+
+change_log
+    The path, relative to ``root_dir``, of a file in which to log every
+    put and delete made through the :py:class:`Store
+    <tiddlyweb.store.Store>`. See :py:mod:`tiddlyweb.changes`. Defaults
+    to ``None``, no log.
+
+store.identity_map
+    If ``True`` each :py:class:`Store <tiddlyweb.store.Store>`, and so
+    each web request, gets an entity from storage only once, until it is
+    put or deleted through that Store. Defaults to ``False``.
+
+store.instrument
+    If ``True`` the calls of the methods of each :py:class:`Store
+    <tiddlyweb.store.Store>` are counted and timed in the
+    :py:class:`StoreMetrics <tiddlyweb.store.StoreMetrics>` of the
+    process. Defaults to ``False``.
+
+store.negative_cache
+    The number of gets which found no entity the process remembers, so
+    that repeating them does not ask the storage again. ``0``, the
+    default, remembers none. See :py:class:`NegativeCache
+    <tiddlyweb.store.NegativeCache>`.
+
+store.negative_cache_ttl
+    The number of seconds a get which found no entity is remembered,
+    unless the entity is put by this process first. Puts by other
+    processes do not clear what this process remembers, so keep it
+    short if they put to the same store. Defaults to ``5``.
+
+store.pool
+    If ``True`` the storage of ``server_store`` is made once by each
+    thread serving web requests, rather than for each request, and
+    keeps its connections and caches between requests. Defaults to
+    ``False``. See :py:func:`pooled_store <tiddlyweb.store.pooled_store>`.
 """
 
 try:
@@ -214,6 +249,12 @@ DEFAULT_CONFIG = {
         'root_dir': '',
         'special_bag_detectors': [],
         'collections.use_memory': False,
+        'change_log': None,
+        'store.identity_map': False,
+        'store.instrument': False,
+        'store.negative_cache': 0,
+        'store.negative_cache_ttl': 5,
+        'store.pool': False,
 }
 
 
@@ -38,7 +38,7 @@ except ImportError:  # Python3 has built in filter that iterates
 from operator import gt, lt
 
 from tiddlyweb.filters.sort import ATTRIBUTE_SORT_KEY
-from tiddlyweb.store import get_entity
+from tiddlyweb.store import get_entities
 
 
 def select_parse(command):
@@ -176,26 +176,27 @@ def select_by_attribute(attribute, value, entities, negate=False,
     else:
         select = ATTRIBUTE_SELECTOR.get(attribute, default_func)
 
-        def _posfilter(entity):
+        def _posfilter(pair):
             """
-            Return True if the entity's attribute matches value.
+            Return True if the attribute of the entity, as loaded from
+            the store, matches value.
             """
-            stored_entity = get_entity(entity, store)
-            return select(stored_entity, attribute, value)
+            return select(pair[1], attribute, value)
 
         if negate:
 
-            def _negfilter(entity):
+            def _negfilter(pair):
                 """
                 Return True if the entity's attribute does not match value.
                 """
-                return not _posfilter(entity)
+                return not _posfilter(pair)
 
             _filter = _negfilter
         else:
             _filter = _posfilter
 
-        return filter(_filter, entities)
+        return (entity for entity, _ in
+                filter(_filter, get_entities(entities, store)))
 
 
 def select_relative_attribute(attribute, value, entities,
@@ -225,12 +226,12 @@ def select_relative_attribute(attribute, value, entities,
     else:
         comparator = lambda x, y: True  # noqa
 
-    def _select(entity):
+    def _select(pair):
         """
         Return true if entity's attribute is < or > (depending on
         comparator) the value in the filter.
         """
-        stored_entity = get_entity(entity, store)
+        stored_entity = pair[1]
         if hasattr(stored_entity, 'fields'):
             return comparator(func(getattr(stored_entity, attribute,
                 stored_entity.fields.get(attribute, ''))), func(value))
@@ -238,4 +239,5 @@ def select_relative_attribute(attribute, value, entities,
             return comparator(func(getattr(stored_entity, attribute, None)),
                     func(value))
 
-    return filter(_select, entities)
+    return (entity for entity, _ in
+            filter(_select, get_entities(entities, store)))
@@ -10,7 +10,7 @@ Atribute is either a real entity attribute or a key in
 key to pass to the sort. ``ATTRIBUTE_SORT_KEY`` can be extended by plugins.
 """
 
-from tiddlyweb.store import get_entity
+from tiddlyweb.store import get_entities
 
 
 def date_to_canonical(datestring):
@@ -71,12 +71,11 @@ def sort_by_attribute(attribute, entities, reverse=False, environ=None):
 
     func = ATTRIBUTE_SORT_KEY.get(attribute, lambda x: x.lower())
 
-    def key_gen(entity):
+    def key_gen(stored_entity):
         """
-        Reify the attribute needed for sorting. If the entity
-        has not already been loaded from the store, do so.
+        Reify the attribute needed for sorting from the entity as
+        loaded from the store.
         """
-        stored_entity = get_entity(entity, store)
         try:
             return func(getattr(stored_entity, attribute))
         except AttributeError as attribute_exc:
@@ -86,5 +85,7 @@ def sort_by_attribute(attribute, entities, reverse=False, environ=None):
                 raise AttributeError('on %s, no attribute: %s, %s, %s'
                         % (stored_entity, attribute, attribute_exc, exc))
 
-    return (entity for entity in
-            sorted(entities, key=key_gen, reverse=reverse))
+    keyed = [(key_gen(stored_entity), entity) for entity, stored_entity
+            in get_entities(entities, store)]
+    return (entity for _, entity in
+            sorted(keyed, key=lambda pair: pair[0], reverse=reverse))
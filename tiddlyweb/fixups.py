@@ -19,6 +19,12 @@ except NameError:
     bytes = bytes
 
 
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+
 try:
     from Cookie import SimpleCookie, CookieError
 except ImportError:
@@ -43,3 +49,12 @@ except ImportError:
         from urlparse import parse_qs
     except ImportError:
         from cgi import parse_qs
+
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
@@ -11,7 +11,7 @@ generate a hash suitable for use as an ETag.
 
 import logging
 
-from tiddlyweb.store import StoreError
+from tiddlyweb.store import GET_MANY_SIZE, StoreError
 from tiddlyweb.util import sha
 
 from tiddlyweb.model.tiddler import Tiddler
@@ -125,18 +125,22 @@ class Tiddlers(Collection):
         """
         Generate the items in this container. Since these are
         :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`,
-        load them if they are not loaded. If a tiddler has been removed since
-        this request was started, skip it.
-        """
-        for tiddler in self._container:
-            if not tiddler.store and self.store:
-                try:
-                    tiddler = self.store.get(tiddler)
-                except StoreError as exc:
-                    LOGGER.debug('missed tiddler in collection: %s, %s',
-                            tiddler, exc)
+        load them if they are not loaded, ``GET_MANY_SIZE`` at a time
+        with :py:meth:`get_many <tiddlyweb.store.Store.get_many>`. If a
+        tiddler has been removed since this request was started, skip it.
+        """
+        if not self.store:
+            for tiddler in self._container:
+                yield tiddler
+            return
+        for start in range(0, len(self._container), GET_MANY_SIZE):
+            for tiddler in self.store.get_many(
+                    self._container[start:start + GET_MANY_SIZE]):
+                if not tiddler.store:
+                    LOGGER.debug('missed tiddler in collection: %s',
+                            tiddler)
                     continue
-            yield tiddler
+                yield tiddler
 
     def add(self, tiddler):
         """
@@ -128,7 +128,8 @@ class Serialization(SerializationInterface):
         If ``omit_empty`` is True, don't emit empty Tiddler members.
 
         ``omit_members`` can be used to provide a list of members to not
-        include in the output.
+        include in the output. If it includes ``text`` the output is
+        headers only.
         """
         omit_members = omit_members or []
 
@@ -149,7 +150,9 @@ class Serialization(SerializationInterface):
         custom_fields = self.fields_as(tiddler)
         headers.extend(custom_fields)
 
-        if binary_tiddler(tiddler):
+        if 'text' in omit_members:
+            body = ''
+        elif binary_tiddler(tiddler):
             body = b64encode(tiddler.text).decode('UTF-8')
         else:
             body = tiddler.text
@@ -11,13 +11,31 @@ data in the store being retrieved or updated, such as updating an
 index.
 """
 
+import atexit
+import heapq
+import logging
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from collections import OrderedDict
 from copy import deepcopy
+from functools import wraps
+from types import GeneratorType
+
+import simplejson
 
+from tiddlyweb.changes import ChangeLog
 from tiddlyweb.specialbag import get_bag_retriever, SpecialBagError
 from tiddlyweb.model.policy import Policy
-from tiddlyweb.util import superclass_name
+from tiddlyweb.util import (UNSTORED_ATTRIBUTES, copy_entity_state,
+        entity_key, superclass_name)
+
+from tiddlyweb.fixups import basestring, Queue, Empty, Full
 
-from tiddlyweb.fixups import basestring
+
+LOGGER = logging.getLogger(__name__)
 
 
 class StoreError(IOError):
@@ -87,6 +105,13 @@ class StoreEncodingError(StoreError):
     pass
 
 
+# How many tiddlers get_entities loads with each get_many.
+GET_MANY_SIZE = 100
+
+# The storage made by pooled_store in each thread, keyed by a
+# description of the store.
+POOL = threading.local()
+
 EMPTY_HOOKS = {
         'put': [],
         'delete': [],
@@ -99,6 +124,76 @@ HOOKS = {
         'user': deepcopy(EMPTY_HOOKS),
 }
 
+# The upper bounds, in seconds, of the buckets of the latency histograms
+# of StoreMetrics.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+        0.5, 1, 2.5, 5, 10)
+
+# The most precise clock available for timing store calls.
+CLOCK = getattr(time, 'perf_counter', time.time)
+
+
+def _instrumented(entity_type=None):
+    """
+    Decorate a :py:class:`Store` method to record its calls in
+    ``METRICS`` when the store is instrumented. ``entity_type`` is the
+    type of entity the method handles, if that is not the type of its
+    first argument. The time spent iterating a generator the method
+    returns is added to the call.
+    """
+    def decorate(method):
+        name = method.__name__
+
+        @wraps(method)
+        def instrumented(self, *args):
+            if not self._instrument:
+                return method(self, *args)
+            kind = entity_type or superclass_name(args[0])
+            bag = None
+            if args and kind in ('tiddler', 'bag'):
+                bag = getattr(args[0], 'bag', getattr(args[0], 'name',
+                    None))
+            start = CLOCK()
+            try:
+                result = method(self, *args)
+            except Exception:
+                METRICS.record(self.engine, name, kind, CLOCK() - start,
+                        bag, error=True)
+                raise
+            elapsed = CLOCK() - start
+            if isinstance(result, GeneratorType):
+                return _timed_generator(result, self.engine, name, kind,
+                        elapsed, bag)
+            METRICS.record(self.engine, name, kind, elapsed, bag)
+            return result
+        return instrumented
+    return decorate
+
+
+def _timed_generator(generator, engine, name, kind, elapsed, bag):
+    """
+    Yield from ``generator``, recording the call which returned it,
+    which took ``elapsed`` seconds, and the time spent iterating it when
+    it is exhausted, fails or is closed.
+    """
+    error = False
+    try:
+        while True:
+            start = CLOCK()
+            try:
+                item = next(generator)
+            except StopIteration:
+                elapsed += CLOCK() - start
+                return
+            except Exception:
+                elapsed += CLOCK() - start
+                error = True
+                raise
+            elapsed += CLOCK() - start
+            yield item
+    finally:
+        METRICS.record(engine, name, kind, elapsed, bag, error=error)
+
 
 class Store(object):
     """
@@ -119,7 +214,37 @@ class Store(object):
     place in operation that could be described as population. Dispatch
     is based on the class of the provided entity.
 
-    After any of those operations optional ``HOOKS`` are called.
+    After any of those operations optional ``HOOKS`` are called. A
+    hook marked with :py:func:`deferred_hook` is called later, by the
+    worker thread of :py:class:`DeferredHooks`.
+
+    The Store makes its own ``storage`` unless it is given one, as
+    :py:func:`pooled_store` does.
+
+    Many tiddlers can be put at once with :py:meth:`put_many`.
+
+    If the ``change_log`` key of :py:mod:`config <tiddlyweb.config>`
+    names a file, every put and delete is recorded in that
+    :py:class:`change log <tiddlyweb.changes.ChangeLog>`, which can be
+    read with :py:meth:`changes`.
+
+    If the ``store.identity_map`` key of :py:mod:`config
+    <tiddlyweb.config>` is ``True``, the Store remembers each entity it
+    gets and fills later gets of the same entity from that memory,
+    rather than the storage, until the entity is put or deleted through
+    this Store. As a Store is made for each web request, this saves
+    reading the same entity more than once in one request.
+
+    If the ``store.instrument`` key of :py:mod:`config
+    <tiddlyweb.config>` is ``True``, the calls of the Store's methods
+    are counted and timed in :py:class:`StoreMetrics`.
+
+    If the ``store.negative_cache`` key of :py:mod:`config
+    <tiddlyweb.config>` is more than ``0``, up to that many gets which
+    found no entity are remembered by the process in a
+    :py:class:`NegativeCache`, for ``store.negative_cache_ttl`` seconds
+    or until the entity is put through a Store of this process, and
+    repeating them raises the same error without asking the storage.
 
     With collections there are specific ``list`` methods:
 
@@ -133,14 +258,33 @@ class Store(object):
     search works and what it even means is up to the implementation.
     """
 
-    def __init__(self, engine, config=None, environ=None):
+    def __init__(self, engine, config=None, environ=None, storage=None):
         if config is None:
             config = {}
         self.engine = engine
         self.environ = environ
         self.storage = None
         self.config = config
-        self._import()
+        self.change_log = None
+        tiddlyweb_config = (environ or {}).get('tiddlyweb.config', {})
+        if tiddlyweb_config.get('change_log'):
+            self.change_log = ChangeLog(os.path.join(
+                tiddlyweb_config.get('root_dir', ''),
+                tiddlyweb_config['change_log']))
+        self._identity_map = None
+        if tiddlyweb_config.get('store.identity_map'):
+            self._identity_map = {}
+        self._instrument = bool(tiddlyweb_config.get('store.instrument'))
+        self._negative_cache = None
+        if tiddlyweb_config.get('store.negative_cache'):
+            self._negative_cache = (_storage_key(engine, config, environ),
+                tiddlyweb_config['store.negative_cache'],
+                tiddlyweb_config.get('store.negative_cache_ttl', 5))
+            _hook_negative_cache()
+        if storage is None:
+            self._import()
+        else:
+            self.storage = storage
 
     def _import(self):
         """
@@ -158,19 +302,81 @@ class Store(object):
                         % (self.engine, err, err1))
         self.storage = imported_module.Store(self.config, self.environ)
 
+    @_instrumented()
     def delete(self, thing):
         """
         Delete a thing: recipe, bag, tiddler or user.
         """
         func = self._figure_function('delete', thing)
+        self._forget(thing)
         result = func(thing)
+        if self.change_log:
+            self.change_log.record('delete', [thing])
         self._do_hook('delete', thing)
         return result
 
+    @_instrumented()
     def get(self, thing):
         """
         Get a thing: recipe, bag, tiddler or user.
         """
+        key = entity_key(thing)
+        known = self._known(thing, key)
+        if known is not None:
+            return known
+        generation = MISSING.generation
+        func = self._figure_function('get', thing)
+        try:
+            thing = func(thing)
+        except StoreError as exc:
+            self._missed(key, exc, generation)
+            raise
+        return self._got(thing, key)
+
+    @_instrumented('tiddler')
+    def get_many(self, tiddlers):
+        """
+        Get many tiddlers, through the ``tiddler_get_many`` method of the
+        :py:class:`tiddlyweb.stores.StorageInterface`, which may read
+        them more efficiently than a :py:meth:`get` of each.
+
+        Return a list of the tiddlers, each filled in place as by
+        :py:meth:`get`. A tiddler which has a ``store`` already, or which
+        can not be got, is left as it is.
+        """
+        tiddlers = list(tiddlers)
+        wanted = []
+        for index, tiddler in enumerate(tiddlers):
+            if tiddler.store:
+                continue
+            key = entity_key(tiddler)
+            try:
+                known = self._known(tiddler, key)
+            except StoreError:
+                continue
+            if known is not None:
+                tiddlers[index] = known
+            else:
+                wanted.append((index, key))
+        if not wanted:
+            return tiddlers
+
+        generation = MISSING.generation
+        results = self.storage.tiddler_get_many(
+                [tiddlers[index] for index, _ in wanted])
+        for (index, key), result in zip(wanted, results):
+            if isinstance(result, StoreError):
+                self._missed(key, result, generation)
+            else:
+                tiddlers[index] = self._got(result, key)
+        return tiddlers
+
+    def _known(self, thing, key):
+        """
+        Return ``thing`` filled without asking the storage, from a
+        special bag or the identity map, or ``None``. Raise the error
+        remembered in the negative cache for it, if there is one.
+        """
         lower_class = superclass_name(thing)
         if lower_class == 'tiddler':
             retriever = get_bag_retriever(self.environ, thing.bag)
@@ -192,21 +398,101 @@ class Store(object):
                 thing.store = self
                 self._do_hook('get', thing)
                 return thing
-        func = self._figure_function('get', thing)
-        thing = func(thing)
+        if self._identity_map is not None:
+            known = self._identity_map.get(key)
+            if known is not None:
+                copy_entity_state(known, thing)
+                thing.store = self
+                self._do_hook('get', thing)
+                return thing
+        if self._negative_cache:
+            MISSING.check((self._negative_cache[0],) + key)
+        return None
+
+    def _got(self, thing, key):
+        """
+        Finish a get of ``thing`` from the storage, which was asked for
+        with ``key``.
+        """
+        if self._identity_map is not None:
+            known = thing.__class__.__new__(thing.__class__)
+            copy_entity_state(thing, known)
+            self._identity_map[key] = known
         thing.store = self
         self._do_hook('get', thing)
         return thing
 
+    def _missed(self, key, error, generation):
+        """
+        Remember in the negative cache that a get of ``key``, started
+        at ``generation``, found nothing.
+        """
+        if self._negative_cache and isinstance(error, (NoBagError,
+                NoRecipeError, NoTiddlerError, NoUserError)):
+            namespace, size, ttl = self._negative_cache
+            MISSING.add((namespace,) + key, error, generation, size, ttl)
+
+    @_instrumented()
     def put(self, thing):
         """
         Put a thing, recipe, bag, tiddler or user.
         """
         func = self._figure_function('put', thing)
+        self._forget(thing)
         result = func(thing)
+        if self.change_log:
+            self.change_log.record('put', [thing])
         self._do_hook('put', thing)
         return result
 
+    @_instrumented('tiddler')
+    def put_many(self, tiddlers):
+        """
+        Put many tiddlers, through the ``tiddlers_put`` method of the
+        :py:class:`tiddlyweb.stores.StorageInterface`, which may store
+        them more efficiently than a :py:meth:`put` of each.
+
+        The tiddler put ``HOOKS`` are called for each tiddler after the
+        batch has been stored, or if storing fails part way, for those
+        tiddlers which were stored.
+        """
+        stored = []
+        try:
+            for tiddler in self.storage.tiddlers_put(tiddlers):
+                self._forget(tiddler)
+                stored.append(tiddler)
+        finally:
+            if self.change_log:
+                self.change_log.record('put', stored)
+            for tiddler in stored:
+                self._do_hook('put', tiddler)
+
+    def changes(self, since=0):
+        """
+        Yield, in order, the changes recorded in the change log after
+        the one numbered ``since``. See :py:class:`ChangeLog
+        <tiddlyweb.changes.ChangeLog>`.
+        """
+        if not self.change_log:
+            raise StoreMethodNotImplemented('no change_log is configured')
+        return self.change_log.since(since)
+
+    def _forget(self, thing):
+        """
+        Remove ``thing`` from the identity map, with every revision of a
+        tiddler, or every tiddler in a bag.
+        """
+        if not self._identity_map:
+            return
+        key = entity_key(thing)
+        if key[0] == 'tiddler':
+            key = key[:3]
+        for known in list(self._identity_map):
+            if known[:len(key)] == key:
+                del self._identity_map[known]
+            elif key[0] == 'bag' and known[:2] == ('tiddler', key[1]):
+                del self._identity_map[known]
+
     def _figure_function(self, activity, storable):
         """
         Determine which function on the StorageInterface
@@ -220,6 +506,7 @@ class Store(object):
                     % (lower_class, exc))
         return func
 
+    @_instrumented('bag')
     def list_bags(self):
         """
         List all the available bags in the system.
@@ -227,6 +514,7 @@ class Store(object):
         list_func = getattr(self.storage, 'list_bags')
         return list_func()
 
+    @_instrumented('tiddler')
     def list_bag_tiddlers(self, bag):
         """
         List all the tiddlers in the bag.
@@ -241,6 +529,7 @@ class Store(object):
         list_func = getattr(self.storage, 'list_bag_tiddlers')
         return list_func(bag)
 
+    @_instrumented('recipe')
     def list_recipes(self):
         """
         List all the available recipes in the system.
@@ -248,6 +537,7 @@ class Store(object):
         list_func = getattr(self.storage, 'list_recipes')
         return list_func()
 
+    @_instrumented()
     def list_tiddler_revisions(self, tiddler):
         """
         List the revision ids of the revisions of the indicated tiddler
@@ -256,6 +546,7 @@ class Store(object):
         list_func = getattr(self.storage, 'list_tiddler_revisions')
         return list_func(tiddler)
 
+    @_instrumented('user')
     def list_users(self):
         """
         List all the available users in the system.
@@ -263,6 +554,7 @@ class Store(object):
         list_func = getattr(self.storage, 'list_users')
         return list_func()
 
+    @_instrumented('tiddler')
     def search(self, search_query):
         """
         Search in the store, using a search algorithm
@@ -279,7 +571,417 @@ class Store(object):
         hooked_class = superclass_name(thing)
         hooks = _get_hooks(method, hooked_class)
         for hook in hooks:
-            hook(self, thing)
+            if getattr(hook, 'deferred', False):
+                DEFERRED.add(hook, self, thing)
+            else:
+                hook(self, thing)
+
+
+class NegativeCache(object):
+    """
+    Gets which found no entity, each with the error raised, keyed by a
+    description of the store and the :py:func:`entity_key
+    <tiddlyweb.util.entity_key>` of what was got. Each is kept for
+    ``ttl`` seconds, or until the entity, or the bag of a tiddler, is
+    put. The oldest are dropped when there are more than ``size``.
+
+    Only puts through a :py:class:`Store` of this process remove
+    entries, by a hook registered when the first Store with a negative
+    cache is made. An entity put by another process is missed until its
+    entry expires.
+
+    ``hits`` counts the gets answered by the cache. ``generation``
+    counts the puts. A miss is only added if there has been no put
+    since the get started, as the get may have missed the entity put.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        # The keys of the entries for each entity put, including those
+        # of the tiddlers in a bag.
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """
+        Raise the error remembered for ``key``, if there is one.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry[0] < time.time():
+                self._remove(key)
+                return
+            self.hits += 1
+        raise entry[1](*entry[2])
+
+    def add(self, key, error, generation, size, ttl):
+        """
+        Remember ``error`` for ``key`` if nothing has been put since
+        ``generation``.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._remove(key)
+            self._entries[key] = (time.time() + ttl, error.__class__,
+                    error.args)
+            for group in _negative_groups(key):
+                self._groups.setdefault(group, set()).add(key)
+            while len(self._entries) > size:
+                self._remove(next(iter(self._entries)))
+
+    def forget(self, thing):
+        """
+        Remove the entries for ``thing``, every revision of a tiddler,
+        or every tiddler in a bag.
+        """
+        key = entity_key(thing)
+        if key[0] == 'tiddler':
+            key = key[:3]
+        with self._lock:
+            self.generation += 1
+            for known in list(self._groups.get(key, [])):
+                self._remove(known)
+
+    def _remove(self, key):
+        """
+        Remove the entry for ``key``, if there is one.
+        """
+        if self._entries.pop(key, None) is None:
+            return
+        for group in _negative_groups(key):
+            keys = self._groups[group]
+            keys.discard(key)
+            if not keys:
+                del self._groups[group]
+
+
+class DeferredHooks(object):
+    """
+    A queue of calls to hooks marked with :py:func:`deferred_hook`,
+    made in order by a worker thread so that the store method which
+    called them, and the request making it, need not wait.
+
+    Each hook is called with a :py:func:`pooled_store` of the worker
+    thread, made with the engine and config of the store which called
+    it and an ``environ`` holding only its ``tiddlyweb.config``, and a
+    copy of the entity as it was when it was called. A hook which
+    raises an exception is called again up to ``retries`` times, each
+    time ``retry_delay`` seconds more after it failed, before the call
+    is logged and dropped. Other calls are made while a failed call
+    waits. When ``size`` calls are waiting, later hooks are called at
+    once, as if they were not deferred.
+
+    The worker is started by the first call added, and stopped by
+    :py:meth:`flush`, which is run when the process exits, waiting up
+    to ``exit_timeout`` seconds for the calls still waiting.
+
+    ``added``, ``completed``, ``retried``, ``failed`` and ``inline``
+    count the calls added, made, repeated, dropped and made at once
+    because the queue was full. ``max_depth`` is the most calls that
+    have been waiting at once.
+
+    The queue of the process is ``DEFERRED``. A plugin may change its
+    ``size``, ``retries``, ``retry_delay`` and ``exit_timeout`` before
+    it is started.
+    """
+
+    def __init__(self, size=1000, retries=3, retry_delay=1,
+            exit_timeout=10):
+        self.size = size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.exit_timeout = exit_timeout
+        self.added = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.inline = 0
+        self.max_depth = 0
+        self._queue = None
+        self._worker = None
+        self._pid = None
+        self._flush_at_exit = False
+        self._lock = threading.Lock()
+
+    def add(self, hook, store, thing):
+        """
+        Queue a call of ``hook`` for ``thing`` put, got or deleted by
+        ``store``, or make it now if the queue is full.
+        """
+        queued = _copy_entity(thing)
+        with self._lock:
+            self._start()
+            try:
+                self._queue.put_nowait((hook, store.engine, store.config,
+                    {'tiddlyweb.config': store.environ.get(
+                        'tiddlyweb.config', {})}, queued))
+            except Full:
+                self.inline += 1
+            else:
+                self.added += 1
+                self.max_depth = max(self.max_depth, self._queue.qsize())
+                return
+        hook(store, thing)
+
+    def flush(self, timeout=None):
+        """
+        Wait up to ``timeout`` seconds for the calls queued so far,
+        and those failed calls still to be tried again, to be made and
+        stop the worker. Return ``True`` if they were.
+        """
+        with self._lock:
+            worker, queue = self._worker, self._queue
+            if worker is None or self._pid != os.getpid():
+                return True
+            self._worker = self._queue = None
+        try:
+            queue.put(None, timeout=timeout)
+        except Full:
+            return False
+        worker.join(timeout)
+        return not worker.is_alive()
+
+    def stats(self):
+        """
+        Return a dict of the counters of the queue and the number of
+        calls waiting in it, its ``depth``.
+        """
+        with self._lock:
+            depth = 0
+            if self._queue is not None and self._pid == os.getpid():
+                depth = self._queue.qsize()
+            return {'depth': depth, 'max_depth': self.max_depth,
+                    'added': self.added, 'completed': self.completed,
+                    'retried': self.retried, 'failed': self.failed,
+                    'inline': self.inline}
+
+    def _start(self):
+        """
+        Start the worker, and a queue for it, if this process has none.
+        """
+        if self._worker is not None and self._pid == os.getpid():
+            return
+        self._queue = Queue(self.size)
+        self._pid = os.getpid()
+        self._worker = threading.Thread(target=self._work,
+                args=(self._queue,), name='tiddlyweb-deferred-hooks')
+        self._worker.daemon = True
+        self._worker.start()
+        if not self._flush_at_exit:
+            atexit.register(lambda: self.flush(self.exit_timeout))
+            self._flush_at_exit = True
+
+    def _work(self, queue):
+        """
+        Make the calls in ``queue``, and the failed calls to be tried
+        again as each falls due, until ``queue`` yields ``None`` and no
+        failed call is left.
+        """
+        # Failed calls as (due time, order failed, attempt, call).
+        waiting = []
+        failures = 0
+        stopping = False
+        while True:
+            if waiting and waiting[0][0] <= time.time():
+                _, _, attempt, call = heapq.heappop(waiting)
+            elif stopping:
+                if not waiting:
+                    return
+                time.sleep(max(0, waiting[0][0] - time.time()))
+                continue
+            else:
+                timeout = None
+                if waiting:
+                    timeout = max(0, waiting[0][0] - time.time())
+                try:
+                    call = queue.get(timeout=timeout)
+                except Empty:
+                    continue
+                if call is None:
+                    stopping = True
+                    continue
+                attempt = 0
+            if not self._call(attempt, *call):
+                failures += 1
+                heapq.heappush(waiting, (time.time()
+                    + self.retry_delay * (attempt + 1), failures,
+                    attempt + 1, call))
+
+    def _call(self, attempt, hook, engine, config, environ, thing):
+        """
+        Call ``hook`` for ``thing`` with a store of the worker. Return
+        ``False`` if it failed and should be tried again.
+        """
+        try:
+            store = pooled_store(engine, config, environ)
+            if getattr(thing, 'store', None):
+                thing.store = store
+            hook(store, thing)
+        except Exception as exc:
+            if attempt >= self.retries:
+                LOGGER.exception('deferred hook %s failed on %s: %s',
+                        hook.__name__, thing, exc)
+                with self._lock:
+                    self.failed += 1
+                return True
+            LOGGER.warning('retrying deferred hook %s on %s: %s',
+                    hook.__name__, thing, exc)
+            with self._lock:
+                self.retried += 1
+            return False
+        with self._lock:
+            self.completed += 1
+        return True
+
+
+def deferred_hook(hook):
+    """
+    Mark ``hook`` to be called by the worker of :py:class:`DeferredHooks`
+    rather than by the store method which calls it. Use it to decorate a
+    hook whose work, such as indexing or notifying, can wait::
+
+        @deferred_hook
+        def index_tiddler(store, tiddler):
+            ...
+
+        HOOKS['tiddler']['put'].append(index_tiddler)
+    """
+    hook.deferred = True
+    return hook
+
+
+def _copy_entity(thing):
+    """
+    Return a copy of ``thing`` which a deferred hook may use after
+    ``thing`` has been changed.
+    """
+    copied = thing.__class__.__new__(thing.__class__)
+    copy_entity_state(thing, copied)
+    for name in UNSTORED_ATTRIBUTES:
+        if name in thing.__dict__:
+            copied.__dict__[name] = thing.__dict__[name]
+    return copied
+
+
+class StoreMetrics(object):
+    """
+    The calls of the methods of instrumented :py:class:`stores <Store>`
+    in this process, keyed by engine, method and type of entity. For
+    each are kept the number of ``calls``, those which raised an
+    exception, ``errors``, the total ``seconds`` they took and a
+    histogram of their latency, the number which took no more than each
+    of ``LATENCY_BUCKETS`` seconds, and more.
+
+    The calls and seconds of the methods handling a tiddler or a bag
+    are also kept for each bag, to show which bags are busiest.
+
+    The metrics of the process are ``METRICS``. Read them with
+    :py:meth:`snapshot` or export them with :py:meth:`exposition`.
+    """
+
+    def __init__(self):
+        self._methods = {}
+        self._bags = {}
+        self._lock = threading.Lock()
+
+    def record(self, engine, method, entity_type, seconds, bag=None,
+            error=False):
+        """
+        Record a call of ``method`` of a store of ``engine``, which
+        handled an ``entity_type``, perhaps in ``bag``, and took
+        ``seconds``.
+        """
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        key = (engine, method, entity_type)
+        with self._lock:
+            entry = self._methods.get(key)
+            if entry is None:
+                entry = self._methods[key] = {'calls': 0, 'errors': 0,
+                        'seconds': 0.0,
+                        'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['buckets'][bucket] += 1
+            if error:
+                entry['errors'] += 1
+            if bag is not None:
+                bag_entry = self._bags.setdefault((engine, bag), [0, 0.0])
+                bag_entry[0] += 1
+                bag_entry[1] += seconds
+
+    def snapshot(self):
+        """
+        Return a copy of the metrics as a dict of lists of dicts,
+        ``methods`` and ``bags``, which may be serialized as JSON.
+        The ``buckets`` of a method count the calls in each bucket, not
+        including those in the buckets before it.
+        """
+        with self._lock:
+            methods = [dict(entry, engine=engine, method=method,
+                entity=entity_type, buckets=list(entry['buckets']))
+                for (engine, method, entity_type), entry
+                in sorted(self._methods.items())]
+            bags = [{'engine': engine, 'bag': bag, 'calls': calls,
+                'seconds': seconds} for (engine, bag), (calls, seconds)
+                in sorted(self._bags.items())]
+        return {'methods': methods, 'bags': bags}
+
+    def exposition(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = ['# TYPE tiddlyweb_store_seconds histogram']
+        for entry in snapshot['methods']:
+            labels = _labels(engine=entry['engine'], method=entry['method'],
+                    entity=entry['entity'])
+            count = 0
+            for bound, calls in zip(LATENCY_BUCKETS + ('+Inf',),
+                    entry['buckets']):
+                count += calls
+                lines.append('tiddlyweb_store_seconds_bucket{%s,le="%s"} %s'
+                        % (labels, bound, count))
+            lines.append('tiddlyweb_store_seconds_sum{%s} %r'
+                    % (labels, entry['seconds']))
+            lines.append('tiddlyweb_store_seconds_count{%s} %s'
+                    % (labels, entry['calls']))
+        lines.append('# TYPE tiddlyweb_store_errors_total counter')
+        for entry in snapshot['methods']:
+            lines.append('tiddlyweb_store_errors_total{%s} %s'
+                    % (_labels(engine=entry['engine'],
+                        method=entry['method'], entity=entry['entity']),
+                        entry['errors']))
+        lines.append('# TYPE tiddlyweb_store_bag_calls_total counter')
+        lines.append('# TYPE tiddlyweb_store_bag_seconds_total counter')
+        for entry in snapshot['bags']:
+            labels = _labels(engine=entry['engine'], bag=entry['bag'])
+            lines.append('tiddlyweb_store_bag_calls_total{%s} %s'
+                    % (labels, entry['calls']))
+            lines.append('tiddlyweb_store_bag_seconds_total{%s} %r'
+                    % (labels, entry['seconds']))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """
+        Forget every call recorded.
+        """
+        with self._lock:
+            self._methods.clear()
+            self._bags.clear()
+
+
+def _labels(**labels):
+    """
+    Return ``labels`` as the labels of a Prometheus sample.
+    """
+    return ','.join('%s="%s"' % (name, ('%s' % value).replace('\\',
+        '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items()))
 
 
 def get_entity(entity, store):
@@ -306,6 +1008,125 @@ def get_entity(entity, store):
     return stored_entity
 
 
+def _negative_groups(key):
+    """
+    Return the keys of the groups in :py:class:`NegativeCache` of the
+    entry at ``key``.
+    """
+    entity = key[1:]
+    if entity[0] == 'tiddler':
+        return [entity[:3], ('bag', entity[1])]
+    return [entity]
+
+
+def _forget_missing(store, thing):
+    """
+    A put hook which removes ``thing`` from the negative cache.
+    """
+    MISSING.forget(thing)
+
+
+def _hook_negative_cache():
+    """
+    Register :py:func:`_forget_missing` as a put hook of every entity,
+    if it is not already, so that processes which never use the
+    negative cache do not pay for it on each put.
+    """
+    with NEGATIVE_CACHE_LOCK:
+        for entity in ['recipe', 'bag', 'tiddler', 'user']:
+            if _forget_missing not in HOOKS[entity]['put']:
+                HOOKS[entity]['put'].append(_forget_missing)
+
+
+def pooled_store(engine, config, environ):
+    """
+    Return a :py:class:`Store` of ``engine`` and ``config`` for
+    ``environ``, whose storage is made the first time each thread asks
+    for it and reused, :py:meth:`bound
+    <tiddlyweb.stores.StorageInterface.bind>` to ``environ``, after
+    that. This saves importing and initializing the storage for each
+    request and lets it keep connections, caches and open files between
+    them.
+
+    Each thread has its own storage, so it need not be thread safe, but
+    it must not keep state particular to one request other than its
+    ``environ``.
+    """
+    try:
+        storages = POOL.storages
+    except AttributeError:
+        storages = POOL.storages = {}
+    key = _storage_key(engine, config, environ)
+    storage = storages.get(key)
+    if storage is None:
+        store = Store(engine, config, environ)
+        storages[key] = store.storage
+        return store
+    storage.bind(environ)
+    return Store(engine, config, environ, storage=storage)
+
+
+def _storage_key(engine, config, environ):
+    """
+    Return a string describing the storage made by ``engine`` with
+    ``config`` in the ``root_dir`` of ``environ``.
+    """
+    tiddlyweb_config = (environ or {}).get('tiddlyweb.config', {})
+    return simplejson.dumps([engine, config,
+        tiddlyweb_config.get('root_dir', '')], sort_keys=True,
+        default=repr)
+
+
+def get_entities(entities, store):
+    """
+    Yield each of ``entities`` paired with the entity
+    :py:func:`get_entity` would return for it. Tiddlers are loaded
+    with :py:meth:`Store.get_many`, ``GET_MANY_SIZE`` at a time.
+    """
+    chunk = []
+    for entity in entities:
+        chunk.append(entity)
+        if len(chunk) == GET_MANY_SIZE:
+            for pair in _get_chunk(chunk, store):
+                yield pair
+            chunk = []
+    for pair in _get_chunk(chunk, store):
+        yield pair
+
+
+def _get_chunk(entities, store):
+    """
+    Return ``entities`` paired with the entity :py:func:`get_entity`
+    would return for each, getting the tiddlers with one
+    :py:meth:`Store.get_many`.
+    """
+    wanted = []
+    copies = []
+    for entity in entities:
+        if (store and not entity.store
+                and superclass_name(entity) == 'tiddler'):
+            stored_entity = entity.__class__(entity.title, entity.bag)
+            if entity.revision:
+                stored_entity.revision = entity.revision
+            wanted.append(id(entity))
+            copies.append(stored_entity)
+    got = {}
+    if copies:
+        for key, stored_entity in zip(wanted, store.get_many(copies)):
+            if stored_entity.store:
+                got[key] = stored_entity
+
+    pairs = []
+    for entity in entities:
+        if id(entity) in got:
+            pairs.append((entity, got[id(entity)]))
+        elif superclass_name(entity) == 'tiddler':
+            pairs.append((entity, entity))
+        else:
+            pairs.append((entity, get_entity(entity, store)))
+    return pairs
+
+
 def _get_hooks(method, name):
     """
     Look in HOOKS for the list of functions to run
@@ -316,3 +1137,11 @@ def _get_hooks(method, name):
         return HOOKS[name][method]
     except KeyError:
         return []
+
+
+MISSING = NegativeCache()
+NEGATIVE_CACHE_LOCK = threading.Lock()
+
+DEFERRED = DeferredHooks()
+
+METRICS = StoreMetrics()
@@ -5,7 +5,7 @@ The base class and Interface for classes used to get and put data
 into a storage system.
 """
 
-from tiddlyweb.store import StoreMethodNotImplemented
+from tiddlyweb.store import StoreError, StoreMethodNotImplemented
 
 
 class StorageInterface(object):
@@ -57,6 +57,15 @@ class StorageInterface(object):
         self.environ = environ
         self.store_config = store_config
 
+    def bind(self, environ):
+        """
+        Use ``environ`` as the WSGI environment of this storage, when it
+        is reused for another request by :py:func:`pooled_store
+        <tiddlyweb.store.pooled_store>`. A storage which copies anything
+        out of ``environ`` when it is initialized should copy it again.
+        """
+        self.environ = environ
+
     def recipe_delete(self, recipe):
         """
         Remove the :py:class:`recipe <tiddlyweb.model.recipe.Recipe>`
@@ -123,6 +132,25 @@ class StorageInterface(object):
         raise StoreMethodNotImplemented(
                 'this store does not handle getting tiddlers')
 
+    def tiddler_get_many(self, tiddlers):
+        """
+        Get each of the :py:class:`tiddlers
+        <tiddlyweb.model.tiddler.Tiddler>` from the store, yielding, in
+        the order given, each one populated or the :py:class:`StoreError
+        <tiddlyweb.store.StoreError>` raised trying to get it.
+
+        This implementation gets the tiddlers one at a time with
+        :py:func:`tiddler_get`. Stores which can read many tiddlers
+        more efficiently than that may override it.
+        """
+        for tiddler in tiddlers:
+            try:
+                yield self.tiddler_get(tiddler)
+            except StoreMethodNotImplemented:
+                raise
+            except StoreError as exc:
+                yield exc
+
     def tiddler_put(self, tiddler):
         """
         Put :py:class:`tiddler <tiddlyweb.model.tiddler.Tiddler>`
@@ -131,6 +159,21 @@ class StorageInterface(object):
         raise StoreMethodNotImplemented(
                 'this store does not handle putting tiddlers')
 
+    def tiddlers_put(self, tiddlers):
+        """
+        Put each of the :py:class:`tiddlers
+        <tiddlyweb.model.tiddler.Tiddler>` into the store, yielding each
+        one once it is stored. Nothing is stored until the generator is
+        consumed.
+
+        This implementation puts the tiddlers one at a time with
+        :py:func:`tiddler_put`. Stores which can write many tiddlers
+        more efficiently than that may override it.
+        """
+        for tiddler in tiddlers:
+            self.tiddler_put(tiddler)
+            yield tiddler
+
     def user_delete(self, user):
         """
         Delete :py:class:`user <tiddlyweb.model.user.User>` from the store.
@@ -0,0 +1,1002 @@
+"""
+A :py:class:`StorageInterface <tiddlyweb.stores.StorageInterface>`
+after the design of Bitcask: a log structured store of append only
+segment files, with an in memory key directory giving the place in
+those files of the latest value of every key.
+
+Every put or delete is a single append to the active segment. Every
+get is a single positioned read of the value the key directory points
+to. When the active segment is large enough it is sealed, with a hint
+file listing the keys in it and where their values are, and a new
+segment is started. Opening the store builds the key directory from
+those hint files, reading only the active segment in full, so the time
+it takes depends on the number of keys, not the size of their values.
+
+Old values and deleted entities are left in the segment files until a
+:py:meth:`merge <Cask.merge>` copies what is still live out of the
+sealed segments into new ones and removes the old. A merge is started
+in the background when enough of the sealed segments is dead.
+
+Only one process may have a store open at a time.
+"""
+
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from base64 import b64encode, b64decode
+from bisect import insort
+
+import simplejson
+
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.user import User
+from tiddlyweb.store import (NoBagError, NoRecipeError, NoTiddlerError,
+        NoUserError, StoreError, StoreLockError)
+from tiddlyweb.stores import StorageInterface
+from tiddlyweb.util import binary_tiddler
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+LOGGER = logging.getLogger(__name__)
+
+# A record in a segment is this header, the key and the value. The
+# header is the crc32 of the rest of the record, the kind of record,
+# and the sizes of the key and value.
+RECORD = struct.Struct('>IBII')
+# An entry in a hint file is this header and the key. The header is
+# the kind of record, the size of the key, and the offset and size of
+# the value in the segment.
+HINT = struct.Struct('>BIQI')
+
+PUT = 0
+DELETE = 1
+
+SEGMENT_SUFFIX = '.data'
+HINT_SUFFIX = '.hint'
+MERGE_SUFFIX = '.merge'
+LOCK_FILENAME = 'lock'
+
+# The open casks of this process, keyed by root and process id.
+CASKS = {}
+CASKS_LOCK = threading.Lock()
+
+
+class Store(StorageInterface):
+    """
+    A :py:class:`StorageInterface <tiddlyweb.stores.StorageInterface>`
+    which keeps everything in a :py:class:`Cask`. Tiddler revisions are
+    numbered from ``1`` for each tiddler.
+
+    The store config understands the following keys:
+
+    store_root
+        The directory of the segment files, relative to the
+        ``root_dir`` of the config. Defaults to ``store``.
+
+    segment_size
+        The size in bytes at which the active segment is sealed.
+        Defaults to 64MB.
+
+    sync
+        If true, every append is synced to disk before the put
+        returns. Defaults to ``False``.
+
+    merge_ratio
+        The fraction of the sealed segments which must be dead before
+        a merge is started in the background. ``None`` never starts
+        one. Defaults to ``0.5``.
+    """
+
+    def __init__(self, store_config=None, environ=None):
+        super(Store, self).__init__(store_config, environ)
+        root = self.store_config.get('store_root', 'store')
+        if not os.path.isabs(root):
+            root = os.path.join(self.environ.get('tiddlyweb.config',
+                {}).get('root_dir', ''), root)
+        self.cask = _open_cask(root, self.store_config)
+
+    def recipe_delete(self, recipe):
+        """
+        Remove a :py:class:`recipe <tiddlyweb.model.recipe.Recipe>`
+        from the store. No impact on :py:class:`tiddlers
+        <tiddlyweb.model.tiddler.Tiddler>`.
+        """
+        if not self.cask.delete(('recipe', recipe.name)):
+            raise NoRecipeError('no recipe %s' % recipe.name)
+
+    def recipe_get(self, recipe):
+        """
+        Fill :py:class:`recipe <tiddlyweb.model.recipe.Recipe>` with
+        data in the store.
+        """
+        value = self.cask.get(('recipe', recipe.name))
+        if value is None:
+            raise NoRecipeError('no recipe %s' % recipe.name)
+        recipe.desc = value['desc']
+        recipe.policy = _load_policy(value['policy'])
+        recipe.set_recipe([tuple(item) for item in value['recipe']])
+        return recipe
+
+    def recipe_put(self, recipe):
+        """
+        Put :py:class:`recipe <tiddlyweb.model.recipe.Recipe>` into the
+        store.
+        """
+        self.cask.put([(('recipe', recipe.name), {'desc': recipe.desc,
+            'policy': _dump_policy(recipe.policy),
+            'recipe': recipe.get_recipe()})])
+
+    def bag_delete(self, bag):
+        """
+        Delete :py:class:`bag <tiddlyweb.model.bag.Bag>` **and** the
+        :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>` within from
+        the store.
+        """
+        if not self.cask.delete(('bag', bag.name)):
+            raise NoBagError('no bag %s' % bag.name)
+
+    def bag_get(self, bag):
+        """
+        Fill :py:class:`bag <tiddlyweb.model.bag.Bag>` with data
+        from the store.
+        """
+        value = self.cask.get(('bag', bag.name))
+        if value is None:
+            raise NoBagError('no bag %s' % bag.name)
+        bag.desc = value['desc']
+        bag.policy = _load_policy(value['policy'])
+        return bag
+
+    def bag_put(self, bag):
+        """
+        Put :py:class:`bag <tiddlyweb.model.bag.Bag>` into the store.
+        """
+        self.cask.put([(('bag', bag.name), {'desc': bag.desc,
+            'policy': _dump_policy(bag.policy)})])
+
+    def tiddler_delete(self, tiddler):
+        """
+        Remove :py:class:`tiddler <tiddlyweb.model.tiddler.Tiddler>`,
+        and all its revisions, from the store.
+        """
+        if not self.cask.delete(('tiddler', tiddler.bag, tiddler.title)):
+            raise NoTiddlerError('no tiddler %s in bag %s'
+                    % (tiddler.title, tiddler.bag))
+
+    def tiddler_get(self, tiddler):
+        """
+        Fill :py:class:`tiddler <tiddlyweb.model.tiddler.Tiddler>` with
+        the data of its head revision, or the revision it names.
+        """
+        revisions = self.cask.revisions(tiddler.bag, tiddler.title)
+        if not revisions:
+            raise NoTiddlerError('no tiddler %s in bag %s'
+                    % (tiddler.title, tiddler.bag))
+        try:
+            revision = int(tiddler.revision or revisions[-1])
+        except ValueError:
+            raise NoTiddlerError('no revision %s of tiddler %s'
+                    % (tiddler.revision, tiddler.title))
+        value = self.cask.get(('tiddler', tiddler.bag, tiddler.title,
+            revision))
+        if value is None:
+            raise NoTiddlerError('no revision %s of tiddler %s'
+                    % (revision, tiddler.title))
+        for attribute in ['created', 'creator', 'modified', 'modifier',
+                'type', 'tags', 'fields']:
+            setattr(tiddler, attribute, value[attribute])
+        if value['binary']:
+            tiddler.text = b64decode(value['text'].encode('ascii'))
+        else:
+            tiddler.text = value['text']
+        tiddler.revision = revision
+        return tiddler
+
+    def tiddler_put(self, tiddler):
+        """
+        Append a new revision of :py:class:`tiddler
+        <tiddlyweb.model.tiddler.Tiddler>` to the store, if its
+        :py:class:`bag <tiddlyweb.model.bag.Bag>` exists.
+
+        Each revision has the ``created`` and ``creator`` of the first
+        revision, whatever the incoming tiddler says.
+        """
+        for _ in self.tiddlers_put([tiddler]):
+            pass
+
+    def tiddlers_put(self, tiddlers):
+        """
+        Append new revisions of many :py:class:`tiddlers
+        <tiddlyweb.model.tiddler.Tiddler>` to the store in one write,
+        then yield each of them. If any can not be put, none are.
+        """
+        tiddlers = list(tiddlers)
+        with self.cask.lock:
+            records = []
+            revisions = {}
+            for tiddler in tiddlers:
+                records.append(self._tiddler_record(tiddler, revisions))
+            self.cask.put(records)
+        for tiddler in tiddlers:
+            yield tiddler
+
+    def user_delete(self, user):
+        """
+        Delete :py:class:`user <tiddlyweb.model.user.User>` from
+        the store.
+        """
+        if not self.cask.delete(('user', user.usersign)):
+            raise NoUserError('no user %s' % user.usersign)
+
+    def user_get(self, user):
+        """
+        Fill :py:class:`user <tiddlyweb.model.user.User>` with
+        data from the store.
+        """
+        value = self.cask.get(('user', user.usersign))
+        if value is None:
+            raise NoUserError('no user %s' % user.usersign)
+        user.note = value['note']
+        user._password = value['password']
+        user.roles = set(value['roles'])
+        return user
+
+    def user_put(self, user):
+        """
+        Put :py:class:`user <tiddlyweb.model.user.User>` into the store.
+        """
+        self.cask.put([(('user', user.usersign), {'note': user.note,
+            'password': user._password, 'roles': sorted(user.roles)})])
+
+    def list_recipes(self):
+        """
+        List all the :py:class:`recipes <tiddlyweb.model.recipe.Recipe>`
+        in the store.
+        """
+        return (Recipe(name) for name in self.cask.names('recipe'))
+
+    def list_bags(self):
+        """
+        List all the :py:class:`bags <tiddlyweb.model.bag.Bag>`
+        in the store.
+        """
+        return (Bag(name) for name in self.cask.names('bag'))
+
+    def list_bag_tiddlers(self, bag):
+        """
+        List all the :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`
+        in the provided :py:class:`bag <tiddlyweb.model.bag.Bag>`.
+        """
+        titles = self.cask.titles(bag.name)
+        if titles is None:
+            raise NoBagError('no bag %s' % bag.name)
+        return (Tiddler(title, bag.name) for title in titles)
+
+    def list_users(self):
+        """
+        List all the :py:class:`users <tiddlyweb.model.user.User>`
+        in the store.
+        """
+        return (User(usersign) for usersign in self.cask.names('user'))
+
+    def list_tiddler_revisions(self, tiddler):
+        """
+        List all the revisions of one :py:class:`tiddler
+        <tiddlyweb.model.tiddler.Tiddler>`, newest first.
+        """
+        revisions = self.cask.revisions(tiddler.bag, tiddler.title)
+        if not revisions:
+            raise NoTiddlerError('no tiddler %s in bag %s'
+                    % (tiddler.title, tiddler.bag))
+        return list(reversed(revisions))
+
+    def search(self, search_query):
+        """
+        Search the head revisions of all the :py:class:`tiddlers
+        <tiddlyweb.model.tiddler.Tiddler>` in the store for those with
+        ``search_query`` in their title or text, without case.
+
+        This reads every head revision.
+        """
+        query = search_query.lower()
+        for bag_name in self.cask.names('bag'):
+            for title in self.cask.titles(bag_name) or []:
+                tiddler = Tiddler(title, bag_name)
+                if query in title.lower():
+                    yield tiddler
+                    continue
+                try:
+                    tiddler = self.tiddler_get(tiddler)
+                except NoTiddlerError:
+                    continue
+                text = tiddler.text
+                if binary_tiddler(tiddler):
+                    text = text.decode('utf-8', 'ignore')
+                if query in text.lower():
+                    yield Tiddler(title, bag_name)
+
+    def merge(self):
+        """
+        Compact the store. See :py:meth:`Cask.merge`.
+        """
+        return self.cask.merge()
+
+    def _tiddler_record(self, tiddler, revisions):
+        """
+        Return the key and value of the next revision of ``tiddler``,
+        and set its revision. ``revisions`` holds the revisions given
+        to tiddlers earlier in the same write.
+        """
+        if not self.cask.has(('bag', tiddler.bag)):
+            raise NoBagError('no bag %s' % tiddler.bag)
+
+        created, creator = tiddler.modified, tiddler.modifier
+        head = revisions.get((tiddler.bag, tiddler.title))
+        if head is None:
+            stored = self.cask.revisions(tiddler.bag, tiddler.title)
+            if stored:
+                head = (stored[-1], self.cask.get(('tiddler', tiddler.bag,
+                    tiddler.title, stored[-1])))
+        if head is not None:
+            created, creator = head[1]['created'], head[1]['creator']
+        revision = head[0] + 1 if head else 1
+
+        binary = binary_tiddler(tiddler)
+        if binary:
+            text = b64encode(tiddler.text).decode('ascii')
+        else:
+            text = tiddler.text
+        value = {'created': created, 'creator': creator,
+                'modified': tiddler.modified, 'modifier': tiddler.modifier,
+                'type': tiddler.type, 'tags': tiddler.tags,
+                'fields': tiddler.fields, 'text': text, 'binary': binary}
+        revisions[(tiddler.bag, tiddler.title)] = (revision, value)
+        tiddler.revision = revision
+        return ('tiddler', tiddler.bag, tiddler.title, revision), value
+
+
+class Cask(object):
+    """
+    The segment files in the directory ``root`` and their key
+    directory.
+
+    A key is a tuple: ``('bag', name)``, ``('recipe', name)``,
+    ``('user', usersign)`` or ``('tiddler', bag, title, revision)``.
+    Deleting ``('tiddler', bag, title)`` deletes every revision of that
+    tiddler, deleting a bag deletes every tiddler in it.
+
+    A segment is named by a pair of numbers, its generation and part.
+    New segments start a new generation. A merge of the segments up to
+    and including one writes new parts of that segment's generation,
+    so they sort after the segments they replace, and replaying every
+    segment in order, should the merge not have finished removing
+    those, gives the same keys.
+
+    ``lock`` is held to change or look up the key directory and to
+    seal or merge segments, not while a value is read: a get finds
+    where the value is and takes the open file of its segment under
+    the lock, then reads it with ``pread``. The file of a merged
+    segment is closed once no read of it is in progress.
+    """
+
+    def __init__(self, root, segment_size=64 * 1024 * 1024, sync=False,
+            merge_ratio=0.5):
+        self.root = root
+        self.segment_size = segment_size
+        self.sync = sync
+        self.merge_ratio = merge_ratio
+        self.lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._merging = False
+
+        # Where the latest value of each key is: its segment, the
+        # offset and size of the value, and the size of the record.
+        self._keydir = {}
+        # The names of bags, recipes and users, and the revisions of
+        # each tiddler by bag and title.
+        self._names = {'bag': set(), 'recipe': set(), 'user': set()}
+        self._tiddlers = {}
+        self._segments = []
+        self._sizes = {}
+        self._dead = {}
+        self._readers = {}
+        # The files of merged segments, closed when _reading is 0.
+        self._retired = []
+        self._reading = 0
+        self._active = None
+        self._writer = None
+        self._hints = []
+        self._lock_file = None
+
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.inode = os.stat(root).st_ino
+        self._lock_root()
+        self._load()
+
+    def close(self):
+        """
+        Close every file, releasing the store to other processes.
+        """
+        with self.lock:
+            if self._writer is not None:
+                os.close(self._writer)
+                self._writer = None
+            for reader in list(self._readers.values()) + self._retired:
+                os.close(reader)
+            self._readers = {}
+            self._retired = []
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def get(self, key):
+        """
+        Return the latest value of ``key``, or ``None`` if it has none.
+        """
+        with self.lock:
+            location = self._keydir.get(key)
+            if location is None:
+                return None
+            reader = self._acquire_reader(location[0])
+        value = self._read(reader, location[0], location[1], location[2])
+        return simplejson.loads(value.decode('utf-8'))
+
+    def has(self, key):
+        """
+        Return true if ``key`` has a value.
+        """
+        return key in self._keydir
+
+    def names(self, entity):
+        """
+        Return the sorted names of the bags, recipes or users.
+        """
+        with self.lock:
+            return sorted(self._names[entity])
+
+    def titles(self, bag_name):
+        """
+        Return the sorted titles of the tiddlers in a bag, or ``None``
+        if there is no such bag.
+        """
+        with self.lock:
+            if bag_name not in self._names['bag']:
+                return None
+            return sorted(self._tiddlers.get(bag_name, {}))
+
+    def revisions(self, bag_name, title):
+        """
+        Return the revisions of a tiddler, oldest first.
+        """
+        with self.lock:
+            return list(self._tiddlers.get(bag_name, {}).get(title, []))
+
+    def put(self, items):
+        """
+        Append a value for each of the keys in ``items``, a list of key
+        and value pairs, in one write.
+        """
+        self._append([(PUT, key, simplejson.dumps(value).encode('utf-8'))
+            for key, value in items])
+
+    def delete(self, key):
+        """
+        Append a deletion of ``key``, returning false if it has no
+        value to delete.
+        """
+        with self.lock:
+            if key[0] == 'tiddler':
+                exists = bool(self._tiddlers.get(key[1], {}).get(key[2]))
+            else:
+                exists = key[1] in self._names[key[0]]
+            if exists:
+                self._append([(DELETE, key, b'')])
+        return exists
+
+    def merge(self):
+        """
+        Seal the active segment, then copy the live records of every
+        sealed segment into new segments and remove the old ones.
+
+        Return the number of bytes reclaimed.
+        """
+        with self._merge_lock:
+            with self.lock:
+                if self._hints:
+                    # Sealing here should not start another merge.
+                    merging, self._merging = self._merging, True
+                    self._seal()
+                    self._merging = merging
+                segments = [segment for segment in self._segments
+                        if segment != self._active]
+                if not segments:
+                    return 0
+                merging = set(segments)
+                live = sorted((location, key) for key, location
+                        in self._keydir.items() if location[0] in merging)
+                before = sum(self._sizes[segment] for segment in segments)
+
+            generation, part = segments[-1]
+            written = []
+            moves = []
+            output = None
+            for location, key in live:
+                if output is None or output.size >= self.segment_size:
+                    if output is not None:
+                        written.append(output.finish())
+                    part += 1
+                    output = _MergeOutput(self.root, (generation, part))
+                with self.lock:
+                    reader = self._acquire_reader(location[0])
+                value = self._read(reader, location[0], location[1],
+                        location[2])
+                moves.append((key, location,
+                    output.append(PUT, _encode_key(key), value)))
+            if output is not None:
+                written.append(output.finish())
+
+            with self.lock:
+                for key, old, new in moves:
+                    if self._keydir.get(key) == old:
+                        self._keydir[key] = new
+                    else:
+                        self._dead[new[0]] = (self._dead.get(new[0], 0)
+                                + new[3])
+                for segment, size in written:
+                    _rename_merged(self.root, segment)
+                    self._segments.append(segment)
+                    self._sizes[segment] = size
+                    self._dead.setdefault(segment, 0)
+                for segment in segments:
+                    reader = self._readers.pop(segment, None)
+                    if reader is not None:
+                        self._retired.append(reader)
+                    for suffix in [SEGMENT_SUFFIX, HINT_SUFFIX]:
+                        try:
+                            os.unlink(_segment_path(self.root, segment,
+                                suffix))
+                        except OSError:
+                            pass
+                    self._segments.remove(segment)
+                    del self._sizes[segment]
+                    del self._dead[segment]
+                self._segments.sort()
+                self._close_retired()
+                after = sum(size for _, size in written)
+            return before - after
+
+    def _lock_root(self):
+        """
+        Take an exclusive lock on the store, so that no other process
+        appends to it.
+        """
+        if fcntl is None:
+            return
+        self._lock_file = open(os.path.join(self.root, LOCK_FILENAME), 'a')
+        try:
+            fcntl.flock(self._lock_file.fileno(),
+                    fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as exc:
+            self._lock_file.close()
+            self._lock_file = None
+            raise StoreLockError('store %s is open in another process: %s'
+                    % (self.root, exc))
+
+    def _load(self):
+        """
+        Build the key directory from the hint files of the sealed
+        segments, and the records of the active one.
+        """
+        segments = []
+        for filename in os.listdir(self.root):
+            if filename.endswith(MERGE_SUFFIX):
+                # Left by a merge that did not finish.
+                os.unlink(os.path.join(self.root, filename))
+            elif filename.endswith(SEGMENT_SUFFIX):
+                segments.append(_segment_id(filename))
+        segments.sort()
+
+        for segment in segments:
+            self._segments.append(segment)
+            self._dead[segment] = 0
+            hint_path = _segment_path(self.root, segment, HINT_SUFFIX)
+            if os.path.exists(hint_path):
+                entries = _read_hints(hint_path)
+                self._sizes[segment] = os.path.getsize(
+                        _segment_path(self.root, segment, SEGMENT_SUFFIX))
+            else:
+                entries, size = _scan_segment(
+                        _segment_path(self.root, segment, SEGMENT_SUFFIX))
+                self._sizes[segment] = size
+                if segment == segments[-1]:
+                    self._active = segment
+                    self._hints = [_hint(kind, raw_key, offset, value_size)
+                            for kind, raw_key, offset, value_size
+                            in entries]
+                else:
+                    LOGGER.warn('segment %s has no hint file', segment)
+            for kind, raw_key, offset, value_size in entries:
+                self._apply(kind, _decode_key(raw_key), (segment, offset,
+                    value_size, RECORD.size + len(raw_key) + value_size))
+
+        if self._active is None:
+            if segments:
+                generation = segments[-1][0] + 1
+            else:
+                generation = 1
+            self._active = (generation, 0)
+            self._segments.append(self._active)
+            self._sizes[self._active] = 0
+            self._dead[self._active] = 0
+
+    def _append(self, records):
+        """
+        Append ``records``, a list of kind, key and value, to the active
+        segment in one write, and apply them to the key directory.
+        """
+        with self.lock:
+            if self._sizes[self._active] >= self.segment_size:
+                self._seal()
+            if self._writer is None:
+                self._writer = os.open(_segment_path(self.root,
+                    self._active, SEGMENT_SUFFIX),
+                    os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            offset = self._sizes[self._active]
+            data = []
+            applied = []
+            for kind, key, value in records:
+                raw_key = _encode_key(key)
+                record = _record(kind, raw_key, value)
+                value_offset = offset + RECORD.size + len(raw_key)
+                data.append(record)
+                applied.append((kind, key, raw_key, (self._active,
+                    value_offset, len(value), len(record))))
+                offset += len(record)
+            data = b''.join(data)
+            written = os.write(self._writer, data)
+            if written != len(data):
+                raise StoreError('short write to segment %s'
+                        % (self._active,))
+            if self.sync:
+                os.fsync(self._writer)
+            self._sizes[self._active] = offset
+            for kind, key, raw_key, location in applied:
+                self._hints.append(_hint(kind, raw_key, location[1],
+                    location[2]))
+                self._apply(kind, key, location)
+
+    def _apply(self, kind, key, location):
+        """
+        Update the key directory with one record.
+        """
+        entity = key[0]
+        if kind == PUT:
+            self._forget(self._keydir.get(key))
+            self._keydir[key] = location
+            if entity == 'tiddler':
+                revisions = self._tiddlers.setdefault(key[1],
+                        {}).setdefault(key[2], [])
+                if key[3] not in revisions:
+                    insort(revisions, key[3])
+            else:
+                self._names[entity].add(key[1])
+            return
+
+        self._forget(location)
+        if entity == 'tiddler':
+            self._forget_tiddler(key[1], key[2])
+            return
+        if entity == 'bag':
+            for title in list(self._tiddlers.get(key[1], {})):
+                self._forget_tiddler(key[1], title)
+            self._tiddlers.pop(key[1], None)
+        self._forget(self._keydir.pop(key, None))
+        self._names[entity].discard(key[1])
+
+    def _forget_tiddler(self, bag_name, title):
+        """
+        Remove every revision of a tiddler from the key directory.
+        """
+        titles = self._tiddlers.get(bag_name, {})
+        for revision in titles.pop(title, []):
+            self._forget(self._keydir.pop(('tiddler', bag_name, title,
+                revision), None))
+
+    def _forget(self, location):
+        """
+        Count the record at ``location`` as dead.
+        """
+        if location is not None and location[0] in self._dead:
+            self._dead[location[0]] += location[3]
+
+    def _seal(self):
+        """
+        Write the hint file of the active segment and start a new one,
+        then start a merge if enough of the sealed segments is dead.
+        """
+        if self._writer is not None:
+            os.fsync(self._writer)
+            os.close(self._writer)
+            self._writer = None
+        hint_path = _segment_path(self.root, self._active, HINT_SUFFIX)
+        with open(hint_path + MERGE_SUFFIX, 'wb') as hint_file:
+            hint_file.write(b''.join(self._hints))
+            hint_file.flush()
+            os.fsync(hint_file.fileno())
+        os.rename(hint_path + MERGE_SUFFIX, hint_path)
+        self._hints = []
+        self._active = (self._active[0] + 1, 0)
+        self._segments.append(self._active)
+        self._sizes[self._active] = 0
+        self._dead[self._active] = 0
+
+        if self.merge_ratio is None or self._merging:
+            return
+        sealed = [segment for segment in self._segments
+                if segment != self._active]
+        total = sum(self._sizes[segment] for segment in sealed)
+        dead = sum(self._dead[segment] for segment in sealed)
+        if total and float(dead) / total >= self.merge_ratio:
+            self._merging = True
+            thread = threading.Thread(target=self._background_merge)
+            thread.daemon = True
+            thread.start()
+
+    def _background_merge(self):
+        """
+        Merge, logging rather than raising any failure.
+        """
+        try:
+            reclaimed = self.merge()
+            LOGGER.debug('merged %s, reclaiming %s bytes', self.root,
+                    reclaimed)
+        except (IOError, OSError) as exc:
+            LOGGER.warn('unable to merge %s: %s', self.root, exc)
+        finally:
+            self._merging = False
+
+    def _acquire_reader(self, segment):
+        """
+        Return the open file of ``segment``, opening it if need be, and
+        count a read of it in progress until :py:meth:`_read` is done.
+        The caller must hold the lock.
+        """
+        reader = self._readers.get(segment)
+        if reader is None:
+            reader = os.open(_segment_path(self.root, segment,
+                SEGMENT_SUFFIX), os.O_RDONLY)
+            self._readers[segment] = reader
+        self._reading += 1
+        return reader
+
+    def _read(self, reader, segment, offset, size):
+        """
+        Read ``size`` bytes at ``offset`` in ``segment`` from
+        ``reader``, its file as given by :py:meth:`_acquire_reader`.
+        Where there is no ``pread`` the file is read under the lock.
+        """
+        try:
+            if PREAD is None:
+                with self.lock:
+                    os.lseek(reader, offset, os.SEEK_SET)
+                    data = os.read(reader, size)
+            else:
+                data = PREAD(reader, size, offset)
+        finally:
+            with self.lock:
+                self._reading -= 1
+                self._close_retired()
+        if len(data) != size:
+            raise StoreError('short read from segment %s' % (segment,))
+        return data
+
+    def _close_retired(self):
+        """
+        Close the files of merged segments if no read is in progress.
+        The caller must hold the lock.
+        """
+        if self._reading or not self._retired:
+            return
+        for reader in self._retired:
+            os.close(reader)
+        self._retired = []
+
+
+class _MergeOutput(object):
+    """
+    A segment, and its hint file, being written by a merge.
+    """
+
+    def __init__(self, root, segment):
+        self.segment = segment
+        self.path = _segment_path(root, segment, SEGMENT_SUFFIX)
+        self.data_file = open(self.path + MERGE_SUFFIX, 'wb')
+        self.hints = []
+        self.size = 0
+
+    def append(self, kind, raw_key, value):
+        """
+        Append one record, returning its location.
+        """
+        record = _record(kind, raw_key, value)
+        self.data_file.write(record)
+        value_offset = self.size + RECORD.size + len(raw_key)
+        self.hints.append(_hint(kind, raw_key, value_offset, len(value)))
+        self.size += len(record)
+        return (self.segment, value_offset, len(value), len(record))
+
+    def finish(self):
+        """
+        Sync the segment and write its hint file, returning the segment
+        and its size.
+        """
+        self.data_file.flush()
+        os.fsync(self.data_file.fileno())
+        self.data_file.close()
+        hint_path = self.path[:-len(SEGMENT_SUFFIX)] + HINT_SUFFIX
+        with open(hint_path + MERGE_SUFFIX, 'wb') as hint_file:
+            hint_file.write(b''.join(self.hints))
+            hint_file.flush()
+            os.fsync(hint_file.fileno())
+        return self.segment, self.size
+
+
+PREAD = getattr(os, 'pread', None)
+
+
+def _open_cask(root, store_config):
+    """
+    Return the open :py:class:`Cask` of ``root`` in this process,
+    opening it if need be, or again if the directory has been replaced.
+    """
+    key = (os.path.abspath(root), os.getpid())
+    with CASKS_LOCK:
+        cask = CASKS.get(key)
+        if cask is not None:
+            try:
+                inode = os.stat(root).st_ino
+            except OSError:
+                inode = None
+            if inode != cask.inode:
+                cask.close()
+                cask = None
+        if cask is None:
+            cask = Cask(root,
+                    segment_size=store_config.get('segment_size',
+                        64 * 1024 * 1024),
+                    sync=store_config.get('sync', False),
+                    merge_ratio=store_config.get('merge_ratio', 0.5))
+            CASKS[key] = cask
+        return cask
+
+
+def _record(kind, raw_key, value):
+    """
+    Return a segment record.
+    """
+    body = (struct.pack('>BII', kind, len(raw_key), len(value))
+            + raw_key + value)
+    return struct.pack('>I', zlib.crc32(body) & 0xffffffff) + body
+
+
+def _hint(kind, raw_key, value_offset, value_size):
+    """
+    Return a hint file entry.
+    """
+    return HINT.pack(kind, len(raw_key), value_offset, value_size) + raw_key
+
+
+def _read_hints(path):
+    """
+    Return the kind, key, value offset and value size of each entry in
+    the hint file at ``path``.
+    """
+    with open(path, 'rb') as hint_file:
+        data = hint_file.read()
+    entries = []
+    position = 0
+    while position + HINT.size <= len(data):
+        kind, key_size, value_offset, value_size = HINT.unpack_from(data,
+                position)
+        position += HINT.size
+        entries.append((kind, data[position:position + key_size],
+            value_offset, value_size))
+        position += key_size
+    return entries
+
+
+def _scan_segment(path):
+    """
+    Return the kind, key, value offset and value size of each record in
+    the segment at ``path``, and the segment's size. A record partly
+    written, or damaged, ends the segment and is removed.
+    """
+    entries = []
+    offset = 0
+    with open(path, 'r+b') as segment_file:
+        while True:
+            header = segment_file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                break
+            crc, kind, key_size, value_size = RECORD.unpack(header)
+            rest = segment_file.read(key_size + value_size)
+            if (len(rest) < key_size + value_size
+                    or zlib.crc32(header[4:] + rest) & 0xffffffff != crc):
+                break
+            entries.append((kind, rest[:key_size],
+                offset + RECORD.size + key_size, value_size))
+            offset += RECORD.size + key_size + value_size
+        segment_file.seek(0, os.SEEK_END)
+        if segment_file.tell() > offset:
+            LOGGER.warn('removing damaged tail of segment %s', path)
+            segment_file.truncate(offset)
+    return entries, offset
+
+
+def _encode_key(key):
+    """
+    Return ``key`` as bytes.
+    """
+    return simplejson.dumps(key).encode('utf-8')
+
+
+def _decode_key(raw_key):
+    """
+    Return the key in ``raw_key``.
+    """
+    return tuple(simplejson.loads(raw_key.decode('utf-8')))
+
+
+def _segment_id(filename):
+    """
+    Return the generation and part of the segment in ``filename``.
+    """
+    generation, part = filename[:-len(SEGMENT_SUFFIX)].split('-')
+    return int(generation), int(part)
+
+
+def _segment_path(root, segment, suffix):
+    """
+    Return the path of a file of ``segment``.
+    """
+    return os.path.join(root, '%010d-%04d%s' % (segment[0], segment[1],
+        suffix))
+
+
+def _rename_merged(root, segment):
+    """
+    Move the files of a merged segment into place, the segment before
+    its hint file so that no hint file names a missing segment.
+    """
+    for suffix in [SEGMENT_SUFFIX, HINT_SUFFIX]:
+        path = _segment_path(root, segment, suffix)
+        os.rename(path + MERGE_SUFFIX, path)
+
+
+def _dump_policy(policy):
+    """
+    Return ``policy`` as a dict.
+    """
+    return dict((key, getattr(policy, key)) for key in Policy.attributes)
+
+
+def _load_policy(policy_dict):
+    """
+    Return the :py:class:`Policy <tiddlyweb.model.policy.Policy>` in
+    ``policy_dict``.
+    """
+    policy = Policy()
+    for key, value in policy_dict.items():
+        setattr(policy, key, value)
+    return policy
@@ -0,0 +1,366 @@
+"""
+A :py:class:`StorageInterface <tiddlyweb.stores.StorageInterface>`
+which wraps the storage of another engine, keeping the tiddlers, bags,
+recipes and users it gets in an :py:class:`EntityCache` shared by every
+such store in the process, so that entities read on most requests, such
+as templates and system tiddlers, are read from the wrapped storage
+once.
+
+Cached entities are forgotten by store ``HOOKS`` when any
+:py:class:`Store <tiddlyweb.store.Store>` in the process puts or deletes
+them. Changes made by other processes are not seen until the changed
+entity is evicted from the cache.
+
+To use it, name it as the ``server_store`` in :py:mod:`config
+<tiddlyweb.config>`, with the engine to wrap::
+
+    config['server_store'] = ['cached', {
+        'wrapped_store': ['text', {'store_root': 'store'}],
+        'cache_bytes': 64 * 1024 * 1024}]
+"""
+
+import threading
+
+from collections import OrderedDict
+
+import simplejson
+
+from tiddlyweb.store import HOOKS, StoreError, Store as StoreFacade
+from tiddlyweb.stores import StorageInterface
+from tiddlyweb.util import copy_entity_state, entity_key
+
+from tiddlyweb.fixups import basestring, bytes
+
+
+DEFAULT_WRAPPED_STORE = ['text', {'store_root': 'store'}]
+DEFAULT_CACHE_BYTES = 16 * 1024 * 1024
+
+# A guess at the bytes used by a cached entity besides the size of its
+# attribute values.
+ENTITY_OVERHEAD = 512
+
+# The cache of each wrapped store in this process, keyed by a
+# description of that store.
+CACHES = {}
+CACHES_LOCK = threading.Lock()
+
+
+def _delegate(name):
+    """
+    Return a method which calls the method ``name`` of the wrapped
+    storage.
+    """
+    def method(self, *args):
+        return getattr(self.wrapped, name)(*args)
+    method.__name__ = name
+    method.__doc__ = 'Call ``%s`` of the wrapped storage.' % name
+    return method
+
+
+class Store(StorageInterface):
+    """
+    A :py:class:`StorageInterface <tiddlyweb.stores.StorageInterface>`
+    which gets entities from its :py:class:`EntityCache` when it can,
+    and otherwise from the storage it wraps. Everything else is done by
+    the wrapped storage, including any methods particular to it.
+
+    The store config understands the following keys:
+
+    wrapped_store
+        The engine and config of the wrapped storage, as in
+        ``server_store``. Defaults to a text store in ``store``.
+
+    cache_bytes
+        Roughly how many bytes of entities the cache may hold before the
+        least recently used are evicted. Defaults to 16MB. The first
+        store made for each wrapped store sets this for the process.
+    """
+
+    def __init__(self, store_config=None, environ=None):
+        super(Store, self).__init__(store_config, environ)
+        engine, wrapped_config = self.store_config.get('wrapped_store',
+                DEFAULT_WRAPPED_STORE)
+        self.wrapped = StoreFacade(engine, wrapped_config,
+                self.environ).storage
+        description = simplejson.dumps([engine, wrapped_config,
+            self.environ.get('tiddlyweb.config', {}).get('root_dir', '')],
+            sort_keys=True, default=repr)
+        self.cache = _get_cache(description,
+                self.store_config.get('cache_bytes', DEFAULT_CACHE_BYTES))
+
+    def __getattr__(self, name):
+        # Methods particular to the wrapped storage, such as pack.
+        if name == 'wrapped':
+            raise AttributeError(name)
+        return getattr(self.wrapped, name)
+
+    def bind(self, environ):
+        """
+        Use ``environ`` as the WSGI environment of this storage and the
+        storage it wraps.
+        """
+        super(Store, self).bind(environ)
+        self.wrapped.bind(environ)
+
+    def recipe_get(self, recipe):
+        """
+        Get ``recipe`` from the cache or the wrapped storage.
+        """
+        return self._get(recipe, self.wrapped.recipe_get)
+
+    def bag_get(self, bag):
+        """
+        Get ``bag`` from the cache or the wrapped storage.
+        """
+        return self._get(bag, self.wrapped.bag_get)
+
+    def tiddler_get(self, tiddler):
+        """
+        Get ``tiddler`` from the cache or the wrapped storage.
+        """
+        return self._get(tiddler, self.wrapped.tiddler_get)
+
+    def tiddler_get_many(self, tiddlers):
+        """
+        Get ``tiddlers`` from the cache, and those not cached with one
+        ``tiddler_get_many`` of the wrapped storage.
+        """
+        results = list(tiddlers)
+        generation = self.cache.generation
+        wanted = []
+        for index, tiddler in enumerate(results):
+            key = entity_key(tiddler)
+            known = self.cache.get(key)
+            if known is None:
+                wanted.append((index, key))
+            else:
+                copy_entity_state(known, tiddler)
+        got = self.wrapped.tiddler_get_many(
+                [results[index] for index, _ in wanted])
+        for (index, key), result in zip(wanted, got):
+            if not isinstance(result, StoreError):
+                self._remember(key, result, generation)
+            results[index] = result
+        for result in results:
+            yield result
+
+    def user_get(self, user):
+        """
+        Get ``user`` from the cache or the wrapped storage.
+        """
+        return self._get(user, self.wrapped.user_get)
+
+    # Puts and deletes forget the cached entity through the store HOOKS.
+    recipe_delete = _delegate('recipe_delete')
+    recipe_put = _delegate('recipe_put')
+    bag_delete = _delegate('bag_delete')
+    bag_put = _delegate('bag_put')
+    tiddler_delete = _delegate('tiddler_delete')
+    tiddler_put = _delegate('tiddler_put')
+    tiddlers_put = _delegate('tiddlers_put')
+    user_delete = _delegate('user_delete')
+    user_put = _delegate('user_put')
+    list_recipes = _delegate('list_recipes')
+    list_bags = _delegate('list_bags')
+    list_bag_tiddlers = _delegate('list_bag_tiddlers')
+    list_users = _delegate('list_users')
+    list_tiddler_revisions = _delegate('list_tiddler_revisions')
+    search = _delegate('search')
+
+    def _get(self, thing, getter):
+        """
+        Fill ``thing`` from a copy in the cache, or with ``getter``,
+        caching a copy of the result.
+        """
+        key = entity_key(thing)
+        generation = self.cache.generation
+        known = self.cache.get(key)
+        if known is not None:
+            copy_entity_state(known, thing)
+            return thing
+        thing = getter(thing)
+        self._remember(key, thing, generation)
+        return thing
+
+    def _remember(self, key, thing, generation):
+        """
+        Cache a copy of ``thing``, got from the wrapped storage with
+        ``key`` since ``generation``.
+        """
+        known = thing.__class__.__new__(thing.__class__)
+        copy_entity_state(thing, known)
+        self.cache.add(key, known, generation)
+
+
+class EntityCache(object):
+    """
+    Entities keyed by :py:func:`entity_key <tiddlyweb.util.entity_key>`,
+    the least recently used evicted when their estimated size is more
+    than ``max_bytes``.
+
+    ``hits``, ``misses`` and ``evictions`` count what happened to gets
+    and adds since the cache was made. ``generation`` counts the
+    entities forgotten. An entity read from storage is only added if
+    no entity has been forgotten since the read started, as it may be
+    a version older than the one put.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        # The keys of the cached revisions of each tiddler, by bag and
+        # title.
+        self._tiddlers = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the entity cached at ``key``, or ``None``.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def add(self, key, entity, generation):
+        """
+        Cache ``entity`` at ``key`` if nothing has been forgotten since
+        ``generation``, evicting others to make room.
+        """
+        size = _entity_size(entity)
+        with self._lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            self._remove(key)
+            self._entries[key] = (entity, size)
+            self.size += size
+            if key[0] == 'tiddler':
+                self._tiddlers.setdefault(key[1:3], set()).add(key)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def forget(self, entity):
+        """
+        Remove ``entity`` from the cache, with every revision of a
+        tiddler or every tiddler in a bag.
+        """
+        key = entity_key(entity)
+        with self._lock:
+            self.generation += 1
+            if key[0] == 'tiddler':
+                self._forget_tiddler(key[1:3])
+                return
+            self._remove(key)
+            if key[0] == 'bag':
+                for bag_title in [bag_title for bag_title in self._tiddlers
+                        if bag_title[0] == key[1]]:
+                    self._forget_tiddler(bag_title)
+
+    def clear(self):
+        """
+        Remove every entity from the cache.
+        """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tiddlers.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Return a dict of the counters of the cache, the number of
+        entities in it and their estimated size.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self.size}
+
+    def _forget_tiddler(self, bag_title):
+        """
+        Remove every cached revision of a tiddler.
+        """
+        for key in list(self._tiddlers.get(bag_title, [])):
+            self._remove(key)
+
+    def _remove(self, key):
+        """
+        Remove the entity at ``key``, if it is cached.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry[1]
+        if key[0] == 'tiddler':
+            keys = self._tiddlers[key[1:3]]
+            keys.discard(key)
+            if not keys:
+                del self._tiddlers[key[1:3]]
+
+
+def _get_cache(description, max_bytes):
+    """
+    Return the cache of the wrapped store described by ``description``,
+    making it if need be.
+    """
+    with CACHES_LOCK:
+        if description not in CACHES:
+            CACHES[description] = EntityCache(max_bytes)
+        return CACHES[description]
+
+
+def _entity_size(entity):
+    """
+    Estimate the bytes used by ``entity``.
+    """
+    return ENTITY_OVERHEAD + _value_size(entity.__dict__)
+
+
+def _value_size(value):
+    """
+    Estimate the bytes used by an attribute value.
+    """
+    if isinstance(value, (basestring, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_value_size(key) + _value_size(item)
+                for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(_value_size(item) for item in value)
+    if hasattr(value, '__dict__'):
+        return _value_size(value.__dict__)
+    return 8
+
+
+def _forget(store, thing):
+    """
+    A put and delete hook which removes ``thing`` from every cache.
+    """
+    with CACHES_LOCK:
+        caches = list(CACHES.values())
+    for cache in caches:
+        cache.forget(thing)
+
+
+def _register_hooks():
+    """
+    Add :py:func:`_forget` to the put and delete ``HOOKS`` of every
+    entity.
+    """
+    for entity_hooks in HOOKS.values():
+        for method in ['put', 'delete']:
+            if _forget not in entity_hooks[method]:
+                entity_hooks[method].append(_forget)
+
+
+_register_hooks()
@@ -0,0 +1,656 @@
+"""
+A :py:class:`StorageInterface <tiddlyweb.stores.StorageInterface>` that
+stores entities in a single SQLite database, using the ``sqlite3``
+module of the Python standard library.
+
+Every revision of every tiddler is kept. The head revision of each
+tiddler is indexed by bag and title, ``modified``, ``modifier``, tags
+and fields, and its title, tags and text are indexed for :py:meth:`search
+<Store.search>` with FTS5, where SQLite provides it.
+
+This module also provides an :py:func:`index_query` which may be named
+as the ``indexer`` in :py:mod:`config <tiddlyweb.config>` to satisfy
+:py:mod:`select filters <tiddlyweb.filters.select>` from those indexes.
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+
+import simplejson
+
+from tiddlyweb.filters import FilterIndexRefused
+from tiddlyweb.filters.select import ATTRIBUTE_SELECTOR
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import Policy
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.model.user import User
+from tiddlyweb.store import (NoBagError, NoRecipeError, NoTiddlerError,
+        NoUserError, StoreError, StoreLockError)
+from tiddlyweb.stores import StorageInterface
+from tiddlyweb.util import binary_tiddler
+
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS bags (name TEXT PRIMARY KEY, '
+    'desc TEXT, policy TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS recipes (name TEXT PRIMARY KEY, '
+    'desc TEXT, policy TEXT NOT NULL, recipe TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS users (usersign TEXT PRIMARY KEY, '
+    'note TEXT, password TEXT, roles TEXT NOT NULL)',
+    # The head revision of each tiddler, and the created and creator
+    # of its first.
+    'CREATE TABLE IF NOT EXISTS tiddlers (id INTEGER PRIMARY KEY, '
+    'bag TEXT NOT NULL, title TEXT NOT NULL, revision INTEGER NOT NULL, '
+    'created TEXT, creator TEXT, modified TEXT, modifier TEXT, type TEXT, '
+    'UNIQUE (bag, title))',
+    'CREATE INDEX IF NOT EXISTS tiddlers_modified ON tiddlers '
+    '(bag, modified)',
+    'CREATE INDEX IF NOT EXISTS tiddlers_modifier ON tiddlers '
+    '(bag, modifier)',
+    'CREATE TABLE IF NOT EXISTS revisions (tiddler INTEGER NOT NULL, '
+    'revision INTEGER NOT NULL, modified TEXT, modifier TEXT, type TEXT, '
+    'tags TEXT NOT NULL, fields TEXT NOT NULL, text, '
+    'PRIMARY KEY (tiddler, revision))',
+    # The tags and fields of the head revision of each tiddler.
+    'CREATE TABLE IF NOT EXISTS tags (tiddler INTEGER NOT NULL, '
+    'tag TEXT NOT NULL, PRIMARY KEY (tag, tiddler))',
+    'CREATE INDEX IF NOT EXISTS tags_tiddler ON tags (tiddler)',
+    'CREATE TABLE IF NOT EXISTS fields (tiddler INTEGER NOT NULL, '
+    'name TEXT NOT NULL, value TEXT, PRIMARY KEY (tiddler, name))',
+    'CREATE INDEX IF NOT EXISTS fields_name ON fields (name, value)',
+]
+
+SEARCH_SCHEMA = ('CREATE VIRTUAL TABLE IF NOT EXISTS tiddler_search '
+        'USING fts5(title, tags, text)')
+
+# The tiddler attributes kept in columns of the tiddlers table.
+HEAD_COLUMNS = ['title', 'bag', 'created', 'creator', 'modified',
+        'modifier', 'type']
+
+SEARCH_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# The number of tiddlers read by each query of tiddler_get_many.
+QUERY_CHUNK = 100
+
+# Whether each database whose schema this process has made sure of
+# has a search table, keyed by path and inode.
+DATABASES = {}
+DATABASES_LOCK = threading.Lock()
+
+
+class Store(StorageInterface):
+    """
+    A :py:class:`StorageInterface <tiddlyweb.stores.StorageInterface>`
+    which keeps everything in one SQLite database, in ``WAL`` journal
+    mode so that readers do not wait for writers.
+
+    Each put is one transaction. :py:meth:`tiddlers_put` puts many
+    tiddlers in one transaction. Tiddler revisions are numbered from
+    ``1`` for each tiddler.
+
+    The store config understands the following keys:
+
+    db_file
+        The path of the database file, relative to the ``root_dir`` of
+        the config. Defaults to ``store.db``.
+
+    lock_timeout
+        The number of seconds to wait for another writer to finish
+        before a put fails with :py:class:`StoreLockError
+        <tiddlyweb.store.StoreLockError>`. Defaults to ``5``.
+
+    synchronous
+        The SQLite ``synchronous`` setting. ``NORMAL`` may lose the
+        most recent transactions, but never corrupts the database, if
+        the machine fails. Defaults to ``FULL``.
+    """
+
+    def __init__(self, store_config=None, environ=None):
+        super(Store, self).__init__(store_config, environ)
+        db_file = self.store_config.get('db_file', 'store.db')
+        if not os.path.isabs(db_file):
+            db_file = os.path.join(self.environ.get('tiddlyweb.config',
+                {}).get('root_dir', ''), db_file)
+        self._db_file = db_file
+        self._lock_timeout = self.store_config.get('lock_timeout', 5)
+        self._synchronous = self.store_config.get('synchronous', 'FULL')
+        self._connection = None
+        self._searchable = None
+
+    def _connect(self):
+        """
+        Open the database, creating it and its schema if need be.
+        """
+        if self._connection is None:
+            db_dir = os.path.dirname(self._db_file)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            connection = sqlite3.connect(self._db_file,
+                    timeout=self._lock_timeout, isolation_level=None)
+            connection.execute('PRAGMA synchronous = %s'
+                    % self._synchronous)
+            with DATABASES_LOCK:
+                key = _database_key(self._db_file)
+                if key not in DATABASES:
+                    searchable = _init_database(connection)
+                    key = _database_key(self._db_file)
+                    DATABASES[key] = searchable
+                self._searchable = DATABASES[key]
+            self._connection = connection
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run the enclosed statements in one write transaction, yielding
+        the connection.
+        """
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as exc:
+            raise StoreLockError(exc)
+        try:
+            yield connection
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def recipe_delete(self, recipe):
+        """
+        Remove a :py:class:`recipe <tiddlyweb.model.recipe.Recipe>`
+        from the store. No impact on :py:class:`tiddlers
+        <tiddlyweb.model.tiddler.Tiddler>`.
+        """
+        with self._transaction() as connection:
+            if not connection.execute('DELETE FROM recipes WHERE name = ?',
+                    (recipe.name,)).rowcount:
+                raise NoRecipeError('no recipe %s' % recipe.name)
+
+    def recipe_get(self, recipe):
+        """
+        Fill :py:class:`recipe <tiddlyweb.model.recipe.Recipe>` with
+        data in the store.
+        """
+        row = self._connect().execute('SELECT desc, policy, recipe '
+                'FROM recipes WHERE name = ?', (recipe.name,)).fetchone()
+        if row is None:
+            raise NoRecipeError('no recipe %s' % recipe.name)
+        recipe.desc = row[0]
+        recipe.policy = _load_policy(row[1])
+        recipe.set_recipe([tuple(item) for item in simplejson.loads(row[2])])
+        return recipe
+
+    def recipe_put(self, recipe):
+        """
+        Put :py:class:`recipe <tiddlyweb.model.recipe.Recipe>` into the
+        store.
+        """
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO recipes '
+                    '(name, desc, policy, recipe) VALUES (?, ?, ?, ?)',
+                    (recipe.name, recipe.desc, _dump_policy(recipe.policy),
+                        simplejson.dumps(recipe.get_recipe())))
+
+    def bag_delete(self, bag):
+        """
+        Delete :py:class:`bag <tiddlyweb.model.bag.Bag>` **and** the
+        :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>` within from
+        the store.
+        """
+        with self._transaction() as connection:
+            if not connection.execute('DELETE FROM bags WHERE name = ?',
+                    (bag.name,)).rowcount:
+                raise NoBagError('no bag %s' % bag.name)
+            for tiddler_id, in connection.execute(
+                    'SELECT id FROM tiddlers WHERE bag = ?',
+                    (bag.name,)).fetchall():
+                self._delete_tiddler(connection, tiddler_id)
+
+    def bag_get(self, bag):
+        """
+        Fill :py:class:`bag <tiddlyweb.model.bag.Bag>` with data
+        from the store.
+        """
+        row = self._connect().execute('SELECT desc, policy FROM bags '
+                'WHERE name = ?', (bag.name,)).fetchone()
+        if row is None:
+            raise NoBagError('no bag %s' % bag.name)
+        bag.desc = row[0]
+        bag.policy = _load_policy(row[1])
+        return bag
+
+    def bag_put(self, bag):
+        """
+        Put :py:class:`bag <tiddlyweb.model.bag.Bag>` into the store.
+        """
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO bags '
+                    '(name, desc, policy) VALUES (?, ?, ?)',
+                    (bag.name, bag.desc, _dump_policy(bag.policy)))
+
+    def tiddler_delete(self, tiddler):
+        """
+        Remove :py:class:`tiddler <tiddlyweb.model.tiddler.Tiddler>`,
+        and all its revisions, from the store.
+        """
+        with self._transaction() as connection:
+            row = connection.execute('SELECT id FROM tiddlers '
+                    'WHERE bag = ? AND title = ?',
+                    (tiddler.bag, tiddler.title)).fetchone()
+            if row is None:
+                raise NoTiddlerError('no tiddler %s in bag %s'
+                        % (tiddler.title, tiddler.bag))
+            self._delete_tiddler(connection, row[0])
+
+    def tiddler_get(self, tiddler):
+        """
+        Fill :py:class:`tiddler <tiddlyweb.model.tiddler.Tiddler>` with
+        the data of its head revision, or the revision it names.
+        """
+        connection = self._connect()
+        row = connection.execute('SELECT id, revision, created, creator '
+                'FROM tiddlers WHERE bag = ? AND title = ?',
+                (tiddler.bag, tiddler.title)).fetchone()
+        if row is None:
+            raise NoTiddlerError('no tiddler %s in bag %s'
+                    % (tiddler.title, tiddler.bag))
+        tiddler_id, head, created, creator = row
+        try:
+            revision = int(tiddler.revision or head)
+        except ValueError:
+            raise NoTiddlerError('no revision %s of tiddler %s'
+                    % (tiddler.revision, tiddler.title))
+        row = connection.execute('SELECT modified, modifier, type, tags, '
+                'fields, text FROM revisions WHERE tiddler = ? '
+                'AND revision = ?', (tiddler_id, revision)).fetchone()
+        if row is None:
+            raise NoTiddlerError('no revision %s of tiddler %s'
+                    % (revision, tiddler.title))
+        return _fill_tiddler(tiddler, (revision, created, creator) + row)
+
+    def tiddler_get_many(self, tiddlers):
+        """
+        Fill many :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`
+        as :py:meth:`tiddler_get` would, yielding each, or the
+        :py:class:`StoreError <tiddlyweb.store.StoreError>` raised
+        trying to fill it, in the order given.
+
+        The head revisions are read with one query for each
+        ``QUERY_CHUNK`` tiddlers. Other revisions are read one by one.
+        """
+        tiddlers = list(tiddlers)
+        heads = [(tiddler.bag, tiddler.title) for tiddler in tiddlers
+                if not tiddler.revision]
+        rows = {}
+        connection = self._connect()
+        for start in range(0, len(heads), QUERY_CHUNK):
+            chunk = heads[start:start + QUERY_CHUNK]
+            arguments = []
+            for bag_title in chunk:
+                arguments.extend(bag_title)
+            for row in connection.execute('SELECT tiddlers.bag, '
+                    'tiddlers.title, tiddlers.revision, created, creator, '
+                    'revisions.modified, revisions.modifier, revisions.type, '
+                    'tags, fields, text FROM tiddlers JOIN revisions '
+                    'ON revisions.tiddler = tiddlers.id '
+                    'AND revisions.revision = tiddlers.revision WHERE %s'
+                    % ' OR '.join(['(tiddlers.bag = ? AND tiddlers.title = ?)']
+                        * len(chunk)), arguments):
+                rows[(row[0], row[1])] = row[2:]
+        for tiddler in tiddlers:
+            try:
+                if tiddler.revision:
+                    yield self.tiddler_get(tiddler)
+                elif (tiddler.bag, tiddler.title) in rows:
+                    yield _fill_tiddler(tiddler,
+                            rows[(tiddler.bag, tiddler.title)])
+                else:
+                    raise NoTiddlerError('no tiddler %s in bag %s'
+                            % (tiddler.title, tiddler.bag))
+            except StoreError as exc:
+                yield exc
+
+    def tiddler_put(self, tiddler):
+        """
+        Write a new revision of :py:class:`tiddler
+        <tiddlyweb.model.tiddler.Tiddler>` into the store, if its
+        :py:class:`bag <tiddlyweb.model.bag.Bag>` exists.
+
+        Each revision has the ``created`` and ``creator`` of the first
+        revision, whatever the incoming tiddler says.
+        """
+        with self._transaction() as connection:
+            self._put_tiddler(connection, tiddler)
+
+    def tiddlers_put(self, tiddlers):
+        """
+        Put many :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`
+        into the store in one transaction, then yield each of them.
+        If any can not be put, none are.
+        """
+        stored = []
+        with self._transaction() as connection:
+            for tiddler in tiddlers:
+                self._put_tiddler(connection, tiddler)
+                stored.append(tiddler)
+        for tiddler in stored:
+            yield tiddler
+
+    def user_delete(self, user):
+        """
+        Delete :py:class:`user <tiddlyweb.model.user.User>` from
+        the store.
+        """
+        with self._transaction() as connection:
+            if not connection.execute('DELETE FROM users WHERE usersign = ?',
+                    (user.usersign,)).rowcount:
+                raise NoUserError('no user %s' % user.usersign)
+
+    def user_get(self, user):
+        """
+        Fill :py:class:`user <tiddlyweb.model.user.User>` with
+        data from the store.
+        """
+        row = self._connect().execute('SELECT note, password, roles '
+                'FROM users WHERE usersign = ?', (user.usersign,)).fetchone()
+        if row is None:
+            raise NoUserError('no user %s' % user.usersign)
+        user.note, user._password, roles = row
+        user.roles = set(simplejson.loads(roles))
+        return user
+
+    def user_put(self, user):
+        """
+        Put :py:class:`user <tiddlyweb.model.user.User>` into the store.
+        """
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO users '
+                    '(usersign, note, password, roles) VALUES (?, ?, ?, ?)',
+                    (user.usersign, user.note, user._password,
+                        simplejson.dumps(sorted(user.roles))))
+
+    def list_recipes(self):
+        """
+        List all the :py:class:`recipes <tiddlyweb.model.recipe.Recipe>`
+        in the store.
+        """
+        return (Recipe(name) for name, in self._connect().execute(
+            'SELECT name FROM recipes ORDER BY name').fetchall())
+
+    def list_bags(self):
+        """
+        List all the :py:class:`bags <tiddlyweb.model.bag.Bag>`
+        in the store.
+        """
+        return (Bag(name) for name, in self._connect().execute(
+            'SELECT name FROM bags ORDER BY name').fetchall())
+
+    def list_bag_tiddlers(self, bag):
+        """
+        List all the :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`
+        in the provided :py:class:`bag <tiddlyweb.model.bag.Bag>`.
+        """
+        connection = self._connect()
+        if connection.execute('SELECT 1 FROM bags WHERE name = ?',
+                (bag.name,)).fetchone() is None:
+            raise NoBagError('no bag %s' % bag.name)
+        return (Tiddler(title, bag.name) for title, in connection.execute(
+            'SELECT title FROM tiddlers WHERE bag = ? ORDER BY title',
+            (bag.name,)).fetchall())
+
+    def list_users(self):
+        """
+        List all the :py:class:`users <tiddlyweb.model.user.User>`
+        in the store.
+        """
+        return (User(usersign) for usersign, in self._connect().execute(
+            'SELECT usersign FROM users ORDER BY usersign').fetchall())
+
+    def list_tiddler_revisions(self, tiddler):
+        """
+        List all the revisions of one :py:class:`tiddler
+        <tiddlyweb.model.tiddler.Tiddler>`, newest first.
+        """
+        revisions = [revision for revision, in self._connect().execute(
+            'SELECT revisions.revision FROM revisions JOIN tiddlers '
+            'ON revisions.tiddler = tiddlers.id WHERE bag = ? AND title = ? '
+            'ORDER BY revisions.revision DESC',
+            (tiddler.bag, tiddler.title)).fetchall()]
+        if not revisions:
+            raise NoTiddlerError('no tiddler %s in bag %s'
+                    % (tiddler.title, tiddler.bag))
+        return revisions
+
+    def search(self, search_query):
+        """
+        Search the head revisions of all the :py:class:`tiddlers
+        <tiddlyweb.model.tiddler.Tiddler>` in the store for those
+        with every word of ``search_query`` in their title, tags or
+        text. Without FTS5 the words are looked for anywhere in those,
+        without case.
+
+        The returned tiddlers are not loaded from the store.
+        """
+        words = SEARCH_TOKEN_RE.findall(search_query)
+        if not words:
+            return iter([])
+        connection = self._connect()
+        if self._searchable:
+            rows = connection.execute('SELECT bag, tiddlers.title '
+                    'FROM tiddlers JOIN tiddler_search '
+                    'ON tiddler_search.rowid = tiddlers.id '
+                    'WHERE tiddler_search MATCH ? '
+                    'ORDER BY bag, tiddlers.title',
+                    (' '.join('"%s"' % word for word in words),)).fetchall()
+        else:
+            conditions = ' AND '.join(['(tiddlers.title LIKE ? '
+                'OR revisions.tags LIKE ? OR revisions.text LIKE ?)']
+                * len(words))
+            arguments = []
+            for word in words:
+                arguments.extend(['%%%s%%' % word] * 3)
+            rows = connection.execute('SELECT bag, title FROM tiddlers '
+                    'JOIN revisions ON revisions.tiddler = tiddlers.id '
+                    'AND revisions.revision = tiddlers.revision WHERE %s '
+                    'ORDER BY bag, title' % conditions, arguments).fetchall()
+        return (Tiddler(title, bag) for bag, title in rows)
+
+    def _put_tiddler(self, connection, tiddler):
+        """
+        Write a new revision of ``tiddler`` within the current
+        transaction, and set its revision.
+        """
+        if connection.execute('SELECT 1 FROM bags WHERE name = ?',
+                (tiddler.bag,)).fetchone() is None:
+            raise NoBagError('no bag %s' % tiddler.bag)
+
+        row = connection.execute('SELECT id, revision FROM tiddlers '
+                'WHERE bag = ? AND title = ?',
+                (tiddler.bag, tiddler.title)).fetchone()
+        if row is None:
+            tiddler_id = connection.execute('INSERT INTO tiddlers '
+                    '(bag, title, revision, created, creator) '
+                    'VALUES (?, ?, 0, ?, ?)', (tiddler.bag, tiddler.title,
+                        tiddler.modified, tiddler.modifier)).lastrowid
+            revision = 1
+        else:
+            tiddler_id, revision = row[0], row[1] + 1
+
+        # server fields describe a tiddler as it is served, so as in
+        # the text serialization they are not stored.
+        fields = dict((name, value) for name, value
+                in tiddler.fields.items() if not name.startswith('server.'))
+        binary = binary_tiddler(tiddler)
+        if binary:
+            text = sqlite3.Binary(tiddler.text)
+        else:
+            text = tiddler.text
+        connection.execute('UPDATE tiddlers SET revision = ?, modified = ?, '
+                'modifier = ?, type = ? WHERE id = ?', (revision,
+                    tiddler.modified, tiddler.modifier, tiddler.type,
+                    tiddler_id))
+        connection.execute('INSERT INTO revisions (tiddler, revision, '
+                'modified, modifier, type, tags, fields, text) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (tiddler_id, revision,
+                    tiddler.modified, tiddler.modifier, tiddler.type,
+                    simplejson.dumps(tiddler.tags),
+                    simplejson.dumps(fields), text))
+
+        connection.execute('DELETE FROM tags WHERE tiddler = ?',
+                (tiddler_id,))
+        connection.executemany('INSERT OR IGNORE INTO tags (tiddler, tag) '
+                'VALUES (?, ?)', [(tiddler_id, tag) for tag in tiddler.tags])
+        connection.execute('DELETE FROM fields WHERE tiddler = ?',
+                (tiddler_id,))
+        connection.executemany('INSERT INTO fields (tiddler, name, value) '
+                'VALUES (?, ?, ?)', [(tiddler_id, name, value)
+                    for name, value in fields.items()])
+        if self._searchable:
+            connection.execute('DELETE FROM tiddler_search WHERE rowid = ?',
+                    (tiddler_id,))
+            connection.execute('INSERT INTO tiddler_search '
+                    '(rowid, title, tags, text) VALUES (?, ?, ?, ?)',
+                    (tiddler_id, tiddler.title, ' '.join(tiddler.tags),
+                        u'' if binary else tiddler.text))
+        tiddler.revision = revision
+
+    def _delete_tiddler(self, connection, tiddler_id):
+        """
+        Remove every trace of the tiddler with ``tiddler_id`` within
+        the current transaction.
+        """
+        for table in ['revisions', 'tags', 'fields']:
+            connection.execute('DELETE FROM %s WHERE tiddler = ?' % table,
+                    (tiddler_id,))
+        if self._searchable:
+            connection.execute('DELETE FROM tiddler_search WHERE rowid = ?',
+                    (tiddler_id,))
+        connection.execute('DELETE FROM tiddlers WHERE id = ?',
+                (tiddler_id,))
+
+
+def index_query(environ, **kwords):
+    """
+    Satisfy a select filter on a bag, or a check for the existence of a
+    tiddler in a bag (``id=bag:title``), from the indexes of the head
+    revisions of tiddlers.
+
+    Refuse, with :py:class:`FilterIndexRefused
+    <tiddlyweb.filters.FilterIndexRefused>`, when the current store is
+    not a SQLite store, or when the attribute being selected is not
+    indexed.
+
+    The returned tiddlers are not loaded from the store.
+    """
+    storage = getattr(environ.get('tiddlyweb.store'), 'storage', None)
+    if not isinstance(storage, Store):
+        raise FilterIndexRefused('store is not a sqlite store')
+    connection = storage._connect()
+
+    if 'id' in kwords:
+        bag_name, title = kwords['id'].split(':', 1)
+        query = 'SELECT title FROM tiddlers WHERE bag = ? AND title = ?'
+        arguments = (bag_name, title)
+    else:
+        bag_name = kwords.pop('bag')
+        try:
+            (attribute, value), = kwords.items()
+        except ValueError:
+            raise FilterIndexRefused('unable to select on %s' % kwords)
+        if attribute == 'tag':
+            query = ('SELECT title FROM tiddlers JOIN tags '
+                    'ON tags.tiddler = tiddlers.id '
+                    'WHERE bag = ? AND tag = ?')
+        elif attribute == 'field':
+            query = ('SELECT title FROM tiddlers JOIN fields '
+                    'ON fields.tiddler = tiddlers.id '
+                    'WHERE bag = ? AND name = ?')
+        elif attribute in HEAD_COLUMNS:
+            query = ('SELECT title FROM tiddlers WHERE bag = ? AND %s = ?'
+                    % attribute)
+        elif attribute in ATTRIBUTE_SELECTOR or attribute in Tiddler.slots:
+            raise FilterIndexRefused('%s is not indexed' % attribute)
+        else:
+            query = ('SELECT title FROM tiddlers JOIN fields '
+                    'ON fields.tiddler = tiddlers.id '
+                    'WHERE bag = ? AND name = ? AND value = ?')
+            value = (attribute, value)
+        if isinstance(value, tuple):
+            arguments = (bag_name,) + value
+        else:
+            arguments = (bag_name, value)
+
+    return [Tiddler(title, bag_name)
+            for title, in connection.execute(query, arguments).fetchall()]
+
+
+def _init_database(connection):
+    """
+    Put the database of ``connection`` in ``WAL`` mode and create its
+    schema. Return ``True`` if it has a search table.
+    """
+    connection.execute('PRAGMA journal_mode = WAL')
+    for statement in SCHEMA:
+        connection.execute(statement)
+    try:
+        connection.execute(SEARCH_SCHEMA)
+    except sqlite3.OperationalError as exc:
+        LOGGER.warn('no full text search in sqlite store: %s', exc)
+        return False
+    return True
+
+
+def _database_key(db_file):
+    """
+    Return the key of ``db_file`` in ``DATABASES``, so that a database
+    replaced by another at the same path is seen to be new.
+    """
+    try:
+        return (db_file, os.stat(db_file).st_ino)
+    except OSError:
+        return None
+
+
+def _fill_tiddler(tiddler, row):
+    """
+    Fill ``tiddler`` from the revision, created, creator, modified,
+    modifier, type, tags, fields and text in ``row``.
+    """
+    (tiddler.revision, tiddler.created, tiddler.creator, tiddler.modified,
+            tiddler.modifier, tiddler.type, tags, fields, text) = row
+    tiddler.tags = simplejson.loads(tags)
+    tiddler.fields = simplejson.loads(fields)
+    if binary_tiddler(tiddler):
+        tiddler.text = bytes(text)
+    else:
+        tiddler.text = text
+    return tiddler
+
+
+def _dump_policy(policy):
+    """
+    Return ``policy`` as a JSON string.
+    """
+    return simplejson.dumps(dict((key, getattr(policy, key))
+        for key in Policy.attributes))
+
+
+def _load_policy(policy_string):
+    """
+    Return the :py:class:`Policy <tiddlyweb.model.policy.Policy>` in
+    ``policy_string``.
+    """
+    policy = Policy()
+    for key, value in simplejson.loads(policy_string).items():
+        setattr(policy, key, value)
+    return policy
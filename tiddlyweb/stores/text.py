@@ -2,15 +2,38 @@
 A text-based :py:class:`StorageInterface
 <tiddlyweb.stores.StorageInterface>` that stores entities
 in a hierarchy of directories in the filesystem.
+
+This module also provides an :py:func:`index_query` which may be
+named as the ``indexer`` in :py:mod:`config <tiddlyweb.config>` to
+satisfy :py:mod:`select filters <tiddlyweb.filters.select>` from bag
+manifests, and store ``HOOKS`` which maintain the optional
+:py:class:`SearchIndex`. The optional :py:class:`Journal` of tiddler
+puts is also here.
 """
 
+import atexit
 import codecs
+import difflib
+import errno
+import gzip
+import io
 import logging
 import os
+import re
 import simplejson
 import shutil
+import threading
 import time
+import uuid
+import zlib
+
+from base64 import b64decode, b64encode
+from collections import OrderedDict, deque
+from copy import copy
+from hashlib import sha1
 
+from tiddlyweb.filters import FilterIndexRefused
+from tiddlyweb.filters.select import ATTRIBUTE_SELECTOR, default_func
 from tiddlyweb.model.bag import Bag
 from tiddlyweb.model.policy import Policy
 from tiddlyweb.model.recipe import Recipe
@@ -18,16 +41,77 @@ from tiddlyweb.model.tiddler import Tiddler
 from tiddlyweb.model.user import User
 from tiddlyweb.serializer import Serializer
 from tiddlyweb.store import (NoBagError, NoRecipeError, NoTiddlerError,
-        NoUserError, StoreLockError, StoreEncodingError)
+        NoUserError, StoreError, StoreLockError, StoreEncodingError,
+        StoreMethodNotImplemented, HOOKS)
 from tiddlyweb.stores import StorageInterface
-from tiddlyweb.util import (LockError, write_lock, write_unlock,
-        read_utf8_file, write_utf8_file)
+from tiddlyweb.util import (LockError, HIDDEN_FILE_PREFIX, binary_tiddler,
+        sha, write_lock, write_unlock, read_utf8_file, write_bytes_file,
+        write_utf8_file)
+
+from tiddlyweb.fixups import quote, unquote, scandir
 
-from tiddlyweb.fixups import quote, unquote
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 LOGGER = logging.getLogger(__name__)
 
+# The first line of a complete manifest.
+MANIFEST_HEADER = {'manifest': 1}
+
+# Manifest state, shared by every Store in the process, keyed
+# by manifest path.
+MANIFESTS = {}
+MANIFESTS_LOCK = threading.Lock()
+
+BAGS = {}
+BAGS_LOCK = threading.Lock()
+
+SEARCH_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# The connection of each thread to each search index database, keyed
+# by path, and the databases whose schema this process has made sure
+# of, keyed by path and inode.
+SEARCH_CONNECTIONS = threading.local()
+SEARCH_DATABASES = set()
+SEARCH_DATABASES_LOCK = threading.Lock()
+
+# The most directory listings a store will keep.
+LISTINGS_LIMIT = 1000
+
+# The header in a revision file naming the file holding the body
+# of a binary tiddler, or a compressed body.
+BODY_HEADER = 'server.body'
+
+# The suffix of body files and blobs kept gzip compressed.
+GZIP_SUFFIX = '.gz'
+
+# The header in a revision file naming the blob holding its body.
+BLOB_HEADER = 'server.blob'
+
+# The header in a revision file whose body is a delta from an earlier
+# revision: the base revision, the sha1 of its text and the sha1 of
+# the text the delta makes.
+DELTA_HEADER = 'server.delta'
+
+# The open Journal of each store root in this process.
+JOURNALS = {}
+JOURNALS_LOCK = threading.Lock()
+
+JOURNAL_DURABILITIES = ['write', 'sync', 'apply']
+
+# The seconds to wait before first trying again to write a journaled
+# put which failed, doubling with each failure up to the most.
+JOURNAL_RETRY_DELAY = 0.1
+JOURNAL_MAX_RETRY_DELAY = 5
+
+# Recently reconstructed texts of delta revisions, keyed by sha1.
+DELTA_TEXTS = OrderedDict()
+DELTA_TEXTS_LOCK = threading.Lock()
+DELTA_TEXTS_LIMIT = 64
+
 
 class Store(StorageInterface):
     """
@@ -38,14 +122,137 @@ class Store(StorageInterface):
     Some of the entities are serialized to and from text by the
     :py:class:`text <tiddlyweb.serializations.text.Serialization>`
     :py:class:`Serializer <tiddlyweb.serializer.Serializer>`.
+    The bodies of binary tiddlers are kept, unencoded, in a ``.bin``
+    file beside each revision file, unless ``blobs`` are used.
+
+    The store config understands the following keys:
+
+    store_root
+        The directory in which the store lives. Required.
+
+    manifest
+        If ``True``, keep a ``manifest`` file in each bag recording
+        the title and metadata of the most recent revision of every
+        tiddler in the bag. Tiddlers in the bag are then listed from the
+        manifest and :py:func:`index_query` can answer metadata selects.
+        A missing or incomplete manifest is rebuilt from the tiddlers
+        when first needed. A store without this option removes the
+        manifest of each bag it changes, so that turning the option on
+        again rebuilds it. Defaults to ``False``.
+
+    search_index
+        If ``True``, :py:meth:`search` is answered from a
+        :py:class:`SearchIndex` kept in ``search.db`` in the
+        ``store_root``. The index is maintained by store ``HOOKS`` so
+        only changes made through a :py:class:`tiddlyweb.store.Store`
+        are indexed. When enabling this on an existing store run
+        ``twanager reindex``, until then search falls back to reading
+        every tiddler, matching them as the index would. Defaults to
+        ``False``.
+
+    pack_revisions
+        If ``True``, each put of a tiddler moves its previous revisions
+        into an append-only ``pack`` file in the tiddler's directory,
+        with offsets recorded in ``pack.index``, so only the head
+        revision remains a file of its own. ``twanager pack`` does the
+        same for every tiddler in an existing store, and compacts the
+        lines each put appends to ``pack.index`` into one. Packed revisions
+        are read as any other. Defaults to ``False``.
+
+    blobs
+        If ``True``, the bodies of binary tiddlers, and of other
+        tiddlers whose text is at least ``blob_min_size`` long, are
+        kept in a ``blobs`` directory in the ``store_root``, named by
+        the sha1 of their content. Revision files refer to their blob,
+        so a body shared by many tiddlers or revisions is stored once
+        and a change to only the metadata of a tiddler does not write
+        its body again. Blobs are not removed when the tiddlers using
+        them are. Defaults to ``False``.
+
+    blob_min_size
+        The length, in characters, of the shortest text kept as a
+        blob. Defaults to ``4096``.
+
+    compress
+        If ``True``, the bodies of tiddlers written in full, and any
+        blobs, are kept gzip compressed in files of their own beside
+        the (then header only) revision files. They are decompressed
+        when read, and the compressed bytes are kept on the tiddler as
+        ``gzipped_text``, a pair of the text and its compressed form,
+        so the web can send them as they are to clients that accept
+        gzip. Defaults to ``False``.
+
+    revision_deltas
+        An integer ``N``. If set, every ``N`` th revision of a text
+        tiddler is written in full and those in between as a delta from
+        the revision before. Reading a revision rebuilds its text from
+        the previous full revision, with recently rebuilt texts kept in
+        memory. A revision is written in full whenever a delta would not
+        be smaller. Defaults to ``0``, every revision in full.
+
+    tiddler_fanout
+        The number of levels of buckets between a bag's ``tiddlers``
+        directory and the directories of its tiddlers. Each level is
+        named by two hex digits of a hash of the tiddler's title, so
+        ``2`` spreads a bag over 65536 directories. Use this for bags
+        with very many tiddlers. After changing it run ``twanager
+        reshard``, with no server running, to move existing tiddlers.
+        Defaults to ``0``, all tiddlers in one directory.
+
+    journal
+        If ``True``, a put of a tiddler is appended to a write-ahead
+        journal in the ``journal`` directory of the ``store_root`` and
+        written to the tiddler's directory later, in order, by a
+        thread of its own. See :py:class:`Journal`. Reads of a tiddler,
+        or listings of a bag, first wait for any puts to it journaled
+        by the same process, but not those journaled by others.
+        Defaults to ``False``.
+
+    journal_durability
+        How far a journaled put gets before it returns: ``write``, into
+        the journal, which survives the process but not the machine
+        failing; ``sync``, into the journal and synced to disk, with
+        puts arriving together sharing one sync; or ``apply``, synced
+        and written to the tiddler's directory. Defaults to ``sync``.
+
+    lock_timeout
+        The number of seconds to wait for another writer to release a
+        lock before a put fails with :py:class:`StoreLockError
+        <tiddlyweb.store.StoreLockError>`. Defaults to ``5``.
     """
 
     def __init__(self, store_config=None, environ=None):
         super(Store, self).__init__(store_config, environ)
         self.serializer = Serializer('text')
         self._root = self._fixup_root(store_config['store_root'])
+        self._manifest = store_config.get('manifest', False)
+        self._lock_timeout = store_config.get('lock_timeout', 5)
+        self._fanout = int(store_config.get('tiddler_fanout', 0))
+        self._pack = store_config.get('pack_revisions', False)
+        self._listings = {}
+        self._blobs = store_config.get('blobs', False)
+        self._blob_min_size = store_config.get('blob_min_size', 4096)
+        self._deltas = int(store_config.get('revision_deltas', 0))
+        self._compress = store_config.get('compress', False)
+        self._journaled = store_config.get('journal', False)
+        self._durability = store_config.get('journal_durability', 'sync')
+        if self._durability not in JOURNAL_DURABILITIES:
+            raise ValueError('journal_durability must be one of %s'
+                    % ', '.join(JOURNAL_DURABILITIES))
+        self._search_index = None
+        if store_config.get('search_index', False):
+            self._search_index = SearchIndex(
+                    os.path.join(self._root, 'search.db'))
         self._init_store()
 
+    def bind(self, environ):
+        """
+        Use ``environ`` as the WSGI environment of this storage,
+        forgetting the directory listings kept for the last request.
+        """
+        super(Store, self).bind(environ)
+        self._listings = {}
+
     def _fixup_root(self, path):
         """
         Adjust the ``store_root`` path so it is absolute.
@@ -67,6 +274,9 @@ class Store(StorageInterface):
                 path = os.path.join(self._store_root(), name)
                 if not os.path.exists(path):
                     os.mkdir(path)
+            # An index of an empty store is complete.
+            if self._search_index:
+                self._search_index.clear()
 
     def recipe_delete(self, recipe):
         """
@@ -121,11 +331,16 @@ class Store(StorageInterface):
         the system.
         """
         bag_path = self._bag_path(bag.name)
+        self._settle(bag.name)
 
         try:
             if not os.path.exists(bag_path):
                 raise NoBagError('%s not present' % bag_path)
             shutil.rmtree(bag_path)
+            with MANIFESTS_LOCK:
+                MANIFESTS.pop(os.path.join(bag_path, 'manifest'), None)
+            with BAGS_LOCK:
+                BAGS.pop(bag_path, None)
         except NoBagError:
             raise
         except Exception as exc:
@@ -139,8 +354,7 @@ class Store(StorageInterface):
         bag_path = self._bag_path(bag.name)
 
         try:
-            bag.desc = self._read_bag_description(bag_path)
-            bag.policy = self._read_policy(bag_path)
+            bag.desc, bag.policy = self._read_bag(bag_path)
         except IOError as exc:
             raise NoBagError(
                     'unable to read policy or description at %s: %s' %
@@ -160,6 +374,9 @@ class Store(StorageInterface):
 
         if not os.path.exists(tiddlers_dir):
             os.mkdir(tiddlers_dir)
+            if self._manifest:
+                write_utf8_file(os.path.join(bag_path, 'manifest'),
+                        '%s\n' % simplejson.dumps(MANIFEST_HEADER))
 
         self._write_bag_description(bag.desc, bag_path)
         self._write_policy(bag.policy, bag_path)
@@ -169,24 +386,50 @@ class Store(StorageInterface):
         Irrevocably remove :py:class:`tiddler
         <tiddlyweb.model.tiddler.Tiddler>` from the filesystem.
         """
+        self._settle(tiddler.bag, tiddler.title)
         try:
             tiddler_base_filename = self._tiddler_base_filename(tiddler)
             if not os.path.exists(tiddler_base_filename):
                 raise NoTiddlerError('%s not present' % tiddler_base_filename)
-            shutil.rmtree(tiddler_base_filename)
         except NoTiddlerError:
             raise
         except Exception as exc:
             raise IOError('unable to delete %s: %s' % (tiddler.title, exc))
+        self._write_lock(tiddler_base_filename)
+        try:
+            try:
+                shutil.rmtree(tiddler_base_filename)
+            except OSError as exc:
+                raise IOError('unable to delete %s: %s'
+                        % (tiddler.title, exc))
+            self._record_in_manifest(tiddler, deleted=True)
+        finally:
+            write_unlock(tiddler_base_filename)
 
     def tiddler_get(self, tiddler):
         """
         Fill :py:class:`tiddler <tiddlyweb.model.tiddler.Tiddler>` with
         data from the store.
         """
+        self._settle(tiddler.bag, tiddler.title)
         try:
+            revision_index = None
+            if not tiddler.revision:
+                revision_index = self._read_revision_index(tiddler)
+                if revision_index:
+                    tiddler.revision = revision_index['head']
             # read in the desired tiddler
             tiddler = self._read_tiddler_revision(tiddler)
+            if tiddler.created:
+                return tiddler
+            # This is a legacy revision which does not carry created
+            # and creator, get them from the index or first revision.
+            if revision_index is None:
+                revision_index = self._read_revision_index(tiddler)
+            if revision_index:
+                tiddler.created = revision_index['created']
+                tiddler.creator = revision_index['creator']
+                return tiddler
             # now make another tiddler to get created time
             first_rev = Tiddler(tiddler.title)
             first_rev.bag = tiddler.bag
@@ -200,45 +443,202 @@ class Store(StorageInterface):
             raise NoTiddlerError('no tiddler for %s: %s' %
                     (tiddler.title, exc))
 
+    def tiddler_get_many(self, tiddlers):
+        """
+        Fill many :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`
+        as :py:meth:`tiddler_get` would, yielding each, or the
+        :py:class:`StoreError <tiddlyweb.store.StoreError>` raised
+        trying to fill it, in the order given.
+
+        The tiddlers are read in the order of their directories, so
+        that tiddlers stored near each other are read together.
+        """
+        tiddlers = list(tiddlers)
+        results = {}
+        for index in sorted(range(len(tiddlers)),
+                key=lambda index: self._read_order(tiddlers[index])):
+            try:
+                results[index] = self.tiddler_get(tiddlers[index])
+            except StoreError as exc:
+                results[index] = exc
+        for index in range(len(tiddlers)):
+            yield results[index]
+
+    def _read_order(self, tiddler):
+        """
+        Return a key which sorts tiddlers by the path of their
+        directory.
+        """
+        try:
+            filename = _encode_filename(tiddler.title)
+        except StoreEncodingError:
+            filename = ''
+        return self._tiddler_dir(self._tiddlers_dir(tiddler.bag), filename)
+
     def tiddler_put(self, tiddler):
         """
         Write a :py:class:`tiddler <tiddlyweb.model.tiddler.Tiddler>`
         into the store. We only write if the tiddler's :py:class:`bag
         <tiddlyweb.model.bag.Bag>` already exists. Bag creation is a
         separate action.
+
+        Each revision records the ``created`` and ``creator`` of the
+        first revision, whatever the incoming tiddler says.
         """
+        if self._journaled:
+            self._journal().put(self, tiddler)
+            return
+
         tiddler_base_filename = self._tiddler_base_filename(tiddler)
         if not os.path.exists(tiddler_base_filename):
-            try:
-                os.mkdir(tiddler_base_filename)
-            except OSError as exc:
-                raise NoTiddlerError('unable to put tiddler: %s' % exc)
+            self._make_tiddler_dir(tiddler_base_filename)
 
-        locked = 0
-        lock_attempts = 0
-        while not locked:
-            try:
-                lock_attempts = lock_attempts + 1
-                write_lock(tiddler_base_filename)
-                locked = 1
-            except LockError as exc:
-                if lock_attempts > 4:
-                    raise StoreLockError(exc)
-                time.sleep(.1)
+        self._write_lock(tiddler_base_filename)
+        try:
+            self._record_in_manifest(self._put_revision(tiddler,
+                    tiddler_base_filename))
+        finally:
+            write_unlock(tiddler_base_filename)
+
+    def tiddlers_put(self, tiddlers):
+        """
+        Put many :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`
+        into the store, yielding each once it is stored.
+
+        Tiddlers are written one bag at a time. The existing tiddler
+        directories of the bag are listed once, rather than checked for
+        each tiddler.
+
+        Journaled puts are made one at a time.
+        """
+        if self._journaled:
+            for tiddler in tiddlers:
+                self.tiddler_put(tiddler)
+                yield tiddler
+            return
+
+        bag_tiddlers = {}
+        bag_names = []
+        for tiddler in tiddlers:
+            if tiddler.bag not in bag_tiddlers:
+                bag_tiddlers[tiddler.bag] = []
+                bag_names.append(tiddler.bag)
+            bag_tiddlers[tiddler.bag].append(tiddler)
+
+        for bag_name in bag_names:
+            tiddlers_dir = self._tiddlers_dir(bag_name)
+            if not os.path.exists(tiddlers_dir):
+                raise NoBagError('%s does not exist' % tiddlers_dir)
+            existing = set(path for _, path in self._tiddler_dirs(bag_name))
+            for tiddler in bag_tiddlers[bag_name]:
+                try:
+                    tiddler_base_filename = self._tiddler_dir(
+                            tiddlers_dir, _encode_filename(tiddler.title))
+                except StoreEncodingError as exc:
+                    raise NoTiddlerError(exc)
+                if tiddler_base_filename not in existing:
+                    self._make_tiddler_dir(tiddler_base_filename)
+                    existing.add(tiddler_base_filename)
+                self._write_lock(tiddler_base_filename)
+                try:
+                    self._record_in_manifest(self._put_revision(tiddler,
+                        tiddler_base_filename))
+                finally:
+                    write_unlock(tiddler_base_filename)
+                yield tiddler
+
+    def _make_tiddler_dir(self, tiddler_base_filename):
+        """
+        Create the directory for a tiddler, and any buckets above it.
+        """
+        try:
+            os.makedirs(tiddler_base_filename)
+        except OSError as exc:
+            if not os.path.isdir(tiddler_base_filename):
+                raise NoTiddlerError('unable to put tiddler: %s' % exc)
 
+    def _put_revision(self, tiddler, tiddler_base_filename):
+        """
+        Write a new revision of ``tiddler`` and update its revision
+        index, returning the tiddler as stored. The caller must hold
+        the tiddler's write lock.
+        """
         # Protect against incoming tiddlers that have revision
         # set. Since we are putting a new one, we want the system
         # to calculate.
         tiddler.revision = None
-        revision = self._tiddler_revision_filename(tiddler) + 1
-        tiddler_filename = self._tiddler_full_filename(tiddler, revision)
+        revision_index = self._next_revision_index(tiddler,
+                self._read_revision_index(tiddler))
+        stored_tiddler = self._stored_tiddler(tiddler, revision_index)
+        self._write_revision(stored_tiddler, tiddler_base_filename,
+                revision_index)
+        tiddler.revision = stored_tiddler.revision
+        return stored_tiddler
 
-        representation = self.serializer.serialization.tiddler_as(tiddler,
-                omit_empty=True, omit_members=['creator'])
-        write_utf8_file(tiddler_filename, representation)
-        write_unlock(tiddler_base_filename)
+    def _next_revision_index(self, tiddler, revision_index):
+        """
+        Return the revision index of ``tiddler`` once its next revision
+        is written, given its current ``revision_index``, if any.
+        """
+        if revision_index:
+            revision = revision_index['head'] + 1
+        else:
+            revision = self._tiddler_revision_filename(tiddler) + 1
 
-        tiddler.revision = revision
+        if revision == 1:
+            revision_index = {'first': 1, 'created': tiddler.modified,
+                    'creator': tiddler.modifier}
+        elif not revision_index:
+            first_rev = Tiddler(tiddler.title, tiddler.bag)
+            first_rev = self._read_tiddler_revision(first_rev, index=-1)
+            revision_index = {'first': first_rev.revision,
+                    'created': first_rev.modified,
+                    'creator': first_rev.modifier}
+        revision_index['head'] = revision
+        return revision_index
+
+    def _stored_tiddler(self, tiddler, revision_index):
+        """
+        Return a copy of ``tiddler`` as it will be stored as the head
+        revision of ``revision_index``.
+        """
+        stored_tiddler = copy(tiddler)
+        stored_tiddler.created = revision_index['created']
+        stored_tiddler.creator = revision_index['creator']
+        stored_tiddler.revision = revision_index['head']
+        return stored_tiddler
+
+    def _write_revision(self, stored_tiddler, tiddler_base_filename,
+            revision_index):
+        """
+        Write ``stored_tiddler`` as the head revision of
+        ``revision_index``, and then the index. The caller must hold
+        the tiddler's write lock.
+        """
+        revision = revision_index['head']
+        tiddler_filename = self._tiddler_full_filename(stored_tiddler,
+                revision)
+        if self._blobs and (binary_tiddler(stored_tiddler)
+                or len(stored_tiddler.text) >= self._blob_min_size):
+            representation = self._write_blob_body(stored_tiddler)
+        elif binary_tiddler(stored_tiddler):
+            representation = self._write_body(stored_tiddler,
+                    tiddler_filename)
+        else:
+            representation = None
+            if self._deltas and (revision - 1) % self._deltas:
+                representation = self._delta_representation(stored_tiddler,
+                        revision - 1)
+            if representation is None and self._compress:
+                representation = self._write_body(stored_tiddler,
+                        tiddler_filename)
+            if representation is None:
+                representation = self.serializer.serialization.tiddler_as(
+                        stored_tiddler, omit_empty=True)
+        write_utf8_file(tiddler_filename, representation)
+        self._write_revision_index(tiddler_base_filename, revision_index)
+        if self._pack:
+            self._pack_revisions(tiddler_base_filename)
 
     def user_delete(self, user):
         """
@@ -317,12 +717,16 @@ class Store(StorageInterface):
         List all the :py:class:`tiddlers <tiddlyweb.model.tiddler.Tiddler>`
         in the provided :py:class:`bag <tiddlyweb.model.bag.Bag>`.
         """
-        tiddlers_dir = self._tiddlers_dir(bag.name)
+        self._settle(bag.name)
+        if self._manifest:
+            # A copy, as the manifest changes with each put and delete.
+            for title in list(self._manifest_entries(bag.name)):
+                yield Tiddler(title, bag.name)
+            return
 
         try:
-            tiddlers = (filename for filename
-                    in self._files_in_dir(tiddlers_dir)
-                    if os.path.isdir(os.path.join(tiddlers_dir, filename)))
+            tiddlers = [filename for filename, _
+                    in self._tiddler_dirs(bag.name)]
         except (IOError, OSError) as exc:
             raise NoBagError('unable to list tiddlers in bag: %s' % exc)
         for title in tiddlers:
@@ -345,23 +749,92 @@ class Store(StorageInterface):
         List all the revisions of one :py:class:`tiddler
         <tiddlyweb.model.tiddler.Tiddler>`, returning a list of ints.
         """
+        self._settle(tiddler.bag, tiddler.title)
         tiddler_base_filename = self._tiddler_base_filename(tiddler)
         try:
-            revisions = sorted(
+            revisions = set(
                     int(x) for x in
                     self._numeric_files_in_dir(tiddler_base_filename))
         except OSError as exc:
             raise NoTiddlerError('unable to list revisions in tiddler: %s'
                     % exc)
-        revisions.reverse()
-        return revisions
+        pack_index = self._read_pack_index(tiddler_base_filename)
+        revisions.update(int(x) for x in pack_index if x.isdigit())
+        return sorted(revisions, reverse=True)
 
     def search(self, search_query):
         """
         Search in the store for :py:class:`tiddlers
         <tiddlyweb.model.tiddler.Tiddler>` that match ``search_query``.
-        This is intentionally implemented as a simple and limited grep
-        through files.
+
+        If the store has a search index, tiddlers match when every
+        word in ``search_query`` is a word in their title, text, tags
+        or fields, or when their title is ``search_query``. Until the
+        index is complete every tiddler is read to find those which
+        match in this way.
+
+        Otherwise this is intentionally implemented as a simple and
+        limited grep through files, matching tiddlers with
+        ``search_query`` in their title or in a line of their file.
+        """
+        self._settle()
+        if self._search_index:
+            if self._search_index.complete():
+                return (Tiddler(title, bag_name) for bag_name, title
+                        in self._search_index.search(search_query))
+            return self._scan(search_query)
+        return self._grep(search_query)
+
+    def reindex(self):
+        """
+        Rebuild the search index from every tiddler in the store,
+        returning the number of tiddlers indexed.
+        """
+        if not self._search_index:
+            raise StoreMethodNotImplemented(
+                    'this store has no search index')
+        self._settle()
+        self._search_index.clear(complete=False)
+        indexed = 0
+        for bag in self.list_bags():
+            for tiddler in self.list_bag_tiddlers(bag):
+                try:
+                    tiddler = self.tiddler_get(tiddler)
+                except NoTiddlerError as exc:
+                    LOGGER.warn('malformed tiddler during reindex: %s:%s, %s',
+                            bag.name, tiddler.title, exc)
+                    continue
+                self._search_index.index_tiddler(tiddler)
+                indexed += 1
+        self._search_index.mark_complete()
+        return indexed
+
+    def _scan(self, search_query):
+        """
+        Search by reading the head revision of every tiddler, matching
+        as the search index does.
+        """
+        tokens = set(_tokenize(search_query))
+        lower_title = search_query.lower()
+        for bag in self.list_bags():
+            for tiddler in self.list_bag_tiddlers(bag):
+                if tiddler.title.lower() == lower_title:
+                    yield Tiddler(tiddler.title, bag.name)
+                    continue
+                if not tokens:
+                    continue
+                try:
+                    tiddler = self.tiddler_get(tiddler)
+                except NoTiddlerError as exc:
+                    LOGGER.warn('malformed tiddler during search: %s:%s, %s',
+                            bag.name, tiddler.title, exc)
+                    continue
+                if tokens <= _tiddler_tokens(tiddler):
+                    yield Tiddler(tiddler.title, bag.name)
+
+    def _grep(self, search_query):
+        """
+        Search by reading the head revision of every tiddler.
         """
         bag_filenames = self._bag_filenames()
 
@@ -369,12 +842,10 @@ class Store(StorageInterface):
 
         for bagname in bag_filenames:
             bagname = unquote(bagname)
-            tiddler_dir = self._tiddlers_dir(bagname)
-            tiddler_files = self._files_in_dir(tiddler_dir)
-            for tiddler_name in tiddler_files:
+            for tiddler_name, _ in self._tiddler_dirs(bagname):
                 tiddler = Tiddler(title=unquote(tiddler_name), bag=bagname)
                 try:
-                    revision_id = self.list_tiddler_revisions(tiddler)[0]
+                    revision_id = self._tiddler_revision_filename(tiddler)
                     if query in tiddler.title.lower():
                         yield tiddler
                         continue
@@ -382,6 +853,11 @@ class Store(StorageInterface):
                         self._tiddler_full_filename(tiddler, revision_id),
                             encoding='utf-8') as tiddler_file:
                         for line in tiddler_file:
+                            if line.startswith(('%s: ' % BODY_HEADER,
+                                    '%s: ' % BLOB_HEADER,
+                                    '%s: ' % DELTA_HEADER)):
+                                line = self._stored_text(tiddler,
+                                        revision_id)
                             if query in line.lower():
                                 yield tiddler
                                 break
@@ -390,6 +866,282 @@ class Store(StorageInterface):
                             bagname, tiddler_name, exc)
         return
 
+    def _stored_text(self, tiddler, revision_id):
+        """
+        Return the text of one revision of ``tiddler`` as unicode,
+        however it is stored.
+        """
+        stored_tiddler = Tiddler(tiddler.title, tiddler.bag)
+        stored_tiddler.revision = revision_id
+        stored_tiddler = self._read_tiddler_revision(stored_tiddler)
+        if binary_tiddler(stored_tiddler):
+            return stored_tiddler.text.decode('utf-8', 'ignore')
+        return stored_tiddler.text
+
+    def upgrade(self):
+        """
+        Rewrite any revisions written by earlier versions of this store
+        so that they carry the ``created`` and ``creator`` of the first
+        revision, and give every tiddler a revision index. Return the
+        number of revisions rewritten.
+        """
+        self._settle()
+        upgraded = 0
+        for bag_filename in self._bag_filenames():
+            bag_name = unquote(bag_filename)
+            for filename, tiddler_base_filename in self._tiddler_dirs(
+                    bag_name):
+                tiddler = Tiddler(unquote(filename), bag_name)
+                self._write_lock(tiddler_base_filename)
+                try:
+                    upgraded += self._upgrade_tiddler(tiddler,
+                            tiddler_base_filename)
+                finally:
+                    write_unlock(tiddler_base_filename)
+        return upgraded
+
+    def reshard(self):
+        """
+        Move the directories of tiddlers to where the current
+        ``tiddler_fanout`` expects them, whatever layout they were
+        written with, and remove emptied buckets. Return the number of
+        tiddlers moved.
+
+        Tiddlers to be moved are first gathered in a staging directory
+        so that a new bucket never lands inside an old tiddler
+        directory of the same name. Nothing else should be writing to
+        the store while this runs.
+        """
+        self._settle()
+        moved = 0
+        for bag_filename in self._bag_filenames():
+            tiddlers_dir = self._tiddlers_dir(unquote(bag_filename))
+            staging_dir = os.path.join(tiddlers_dir,
+                    '%sreshard' % HIDDEN_FILE_PREFIX)
+            if not os.path.exists(staging_dir):
+                os.mkdir(staging_dir)
+
+            for filename, path in self._find_tiddler_dirs(tiddlers_dir):
+                if path != self._tiddler_dir(tiddlers_dir, filename):
+                    os.rename(path, os.path.join(staging_dir, filename))
+            self._remove_empty_buckets(tiddlers_dir)
+
+            for filename in os.listdir(staging_dir):
+                target = self._tiddler_dir(tiddlers_dir, filename)
+                bucket = os.path.dirname(target)
+                if not os.path.exists(bucket):
+                    os.makedirs(bucket)
+                os.rename(os.path.join(staging_dir, filename), target)
+                moved += 1
+            os.rmdir(staging_dir)
+        return moved
+
+    def _find_tiddler_dirs(self, path):
+        """
+        List the encoded titles and paths of the tiddler directories
+        below ``path``, whatever the depth of buckets above them. A
+        tiddler directory holds only files, a bucket directories.
+        """
+        found = []
+        for filename in self._dirs_in_dir(path):
+            subpath = os.path.join(path, filename)
+            contents = self._scan_dir(subpath)
+            if contents and not any(is_dir for _, is_dir in contents):
+                found.append((filename, subpath))
+            else:
+                found.extend(self._find_tiddler_dirs(subpath))
+        return found
+
+    def _remove_empty_buckets(self, path):
+        """
+        Remove the bucket directories below ``path`` which hold no
+        tiddlers, along with any lock or temporary files in them.
+        """
+        for filename in self._dirs_in_dir(path):
+            subpath = os.path.join(path, filename)
+            self._remove_empty_buckets(subpath)
+            if not list(self._files_in_dir(subpath)):
+                shutil.rmtree(subpath)
+
+    def pack(self):
+        """
+        Move all but the head revision of every tiddler in the store
+        into the tiddler's pack file, and compact its pack index.
+        Return the number of revisions moved.
+        """
+        self._settle()
+        packed = 0
+        for bag_filename in self._bag_filenames():
+            for _, tiddler_base_filename in self._tiddler_dirs(
+                    unquote(bag_filename)):
+                self._write_lock(tiddler_base_filename)
+                try:
+                    packed += self._pack_revisions(tiddler_base_filename)
+                    self._compact_pack_index(tiddler_base_filename)
+                finally:
+                    write_unlock(tiddler_base_filename)
+        return packed
+
+    def _pack_revisions(self, tiddler_base_filename):
+        """
+        Append the files of all but the newest loose revision in
+        ``tiddler_base_filename`` to its pack file, record where they
+        are in the pack index and then remove them. Return the number
+        of revisions moved. The caller must hold the tiddler's write
+        lock.
+
+        The pack is synced before the index is appended to, and the
+        index before the loose files are removed, so an interrupted
+        pack leaves at worst some unreferenced bytes at the end of the
+        pack and a partial line at the end of the index.
+        """
+        revisions = sorted(int(x) for x in
+                self._numeric_files_in_dir(tiddler_base_filename))[:-1]
+        if not revisions:
+            return 0
+
+        pack_index = {}
+        filenames = []
+        with open(os.path.join(tiddler_base_filename, 'pack'),
+                'ab') as pack_file:
+            pack_file.seek(0, os.SEEK_END)
+            offset = pack_file.tell()
+            for revision in revisions:
+                for filename in [str(revision), '%s.bin' % revision,
+                        '%s%s' % (revision, GZIP_SUFFIX)]:
+                    path = os.path.join(tiddler_base_filename, filename)
+                    try:
+                        with open(path, 'rb') as member_file:
+                            content = member_file.read()
+                    except IOError as exc:
+                        if exc.errno == errno.ENOENT:
+                            continue
+                        raise
+                    pack_file.write(content)
+                    pack_index[filename] = [offset, len(content)]
+                    offset += len(content)
+                    filenames.append(path)
+            pack_file.flush()
+            os.fsync(pack_file.fileno())
+
+        self._append_pack_index(tiddler_base_filename, pack_index)
+        for path in filenames:
+            os.unlink(path)
+        return len(revisions)
+
+    def _append_pack_index(self, tiddler_base_filename, entries):
+        """
+        Append a line holding ``entries``, a dict from the names of
+        newly packed files to their offset and length in the pack, to
+        a tiddler's pack index, rather than rewriting the whole index.
+        The caller must hold the tiddler's write lock.
+        """
+        line = ('%s\n' % simplejson.dumps(entries)).encode('utf-8')
+        with open(os.path.join(tiddler_base_filename, 'pack.index'),
+                'a+b') as pack_index_file:
+            pack_index_file.seek(0, os.SEEK_END)
+            if pack_index_file.tell():
+                pack_index_file.seek(-1, os.SEEK_END)
+                # An index written whole, or a line cut short, has
+                # no newline at its end.
+                if pack_index_file.read(1) != b'\n':
+                    line = b'\n' + line
+            pack_index_file.write(line)
+
+    def _compact_pack_index(self, tiddler_base_filename):
+        """
+        Replace a tiddler's pack index of more than one line with one
+        line holding the whole index. The caller must hold the
+        tiddler's write lock.
+        """
+        lines = self._read_pack_index_lines(tiddler_base_filename)
+        if len(lines) > 1:
+            write_utf8_file(os.path.join(tiddler_base_filename,
+                'pack.index'), '%s\n' % simplejson.dumps(
+                    _merge_pack_index(lines)))
+
+    def _read_pack_index(self, tiddler_base_filename):
+        """
+        Read the index of a tiddler's pack file: a dict from the name
+        a packed file had to its offset and length in the pack. Return
+        an empty dict if there is no pack.
+        """
+        return _merge_pack_index(
+                self._read_pack_index_lines(tiddler_base_filename))
+
+    def _read_pack_index_lines(self, tiddler_base_filename):
+        """
+        Return the lines of a tiddler's pack index, as bytes, or an
+        empty list if there is no pack.
+        """
+        try:
+            with open(os.path.join(tiddler_base_filename, 'pack.index'),
+                    'rb') as pack_index_file:
+                return pack_index_file.read().splitlines()
+        except (IOError, OSError):
+            return []
+
+    def _read_revision_file(self, filename):
+        """
+        Return the content, as bytes, of the revision file ``filename``
+        (or the body file of a binary revision), from the file itself
+        or, if it has been packed, from the pack. Raise ``IOError``
+        if it is in neither.
+        """
+        try:
+            with open(filename, 'rb') as revision_file:
+                return revision_file.read()
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            tiddler_base_filename, name = os.path.split(filename)
+            try:
+                offset, length = self._read_pack_index(
+                        tiddler_base_filename)[name]
+            except KeyError:
+                raise exc
+        with open(os.path.join(tiddler_base_filename, 'pack'),
+                'rb') as pack_file:
+            pack_file.seek(offset)
+            return pack_file.read(length)
+
+    def _upgrade_tiddler(self, tiddler, tiddler_base_filename):
+        """
+        Upgrade the revisions of one tiddler, see :py:meth:`upgrade`.
+        """
+        revisions = self.list_tiddler_revisions(tiddler)
+        if not revisions:
+            return 0
+        first_rev = Tiddler(tiddler.title, tiddler.bag)
+        first_rev.revision = revisions[-1]
+        first_rev = self._read_tiddler_revision(first_rev)
+        created = first_rev.modified
+        creator = first_rev.modifier
+
+        upgraded = 0
+        # A revision without a creator header is read as legacy
+        # whatever we do, so only rewrite when there is one.
+        for revision in (revisions if creator else []):
+            tiddler_filename = self._tiddler_full_filename(tiddler, revision)
+            # A packed revision is rewritten as a loose file, which
+            # is read in preference to the pack.
+            tiddler_string = self._read_revision_file(
+                    tiddler_filename).decode('utf-8')
+            if tiddler_string.startswith('creator: '):
+                continue
+            header, body = tiddler_string.split('\n\n', 1)
+            headers = ['creator: %s' % creator, 'created: %s' % created]
+            headers.extend(line for line in header.split('\n')
+                    if line and not line.startswith('created: '))
+            write_utf8_file(tiddler_filename,
+                    '%s\n\n%s' % ('\n'.join(headers), body))
+            upgraded += 1
+
+        self._write_revision_index(tiddler_base_filename, {
+            'head': revisions[0], 'first': revisions[-1],
+            'created': created, 'creator': creator})
+        return upgraded
+
     def _bag_filenames(self):
         """
         List the filenames that are bags.
@@ -407,11 +1159,163 @@ class Store(StorageInterface):
         except (AttributeError, StoreEncodingError) as exc:
             raise NoBagError('No bag name: %s' % exc)
 
+    def _record_in_manifest(self, tiddler, deleted=False):
+        """
+        Record a stored or ``deleted`` tiddler in the manifest of its
+        bag. The caller holds the tiddler's write lock, so that entries
+        for the same tiddler are appended in the order of its changes.
+
+        Without the ``manifest`` option the manifest of the bag, if one
+        was kept before, is removed instead, as it no longer records
+        every tiddler and would otherwise be trusted when the option is
+        turned on again.
+        """
+        if not self._manifest:
+            try:
+                os.unlink(os.path.join(self._bag_path(tiddler.bag),
+                    'manifest'))
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+            return
+        if deleted:
+            entry = {'title': tiddler.title, 'deleted': True}
+        else:
+            entry = self._manifest_entry(tiddler)
+        self._append_manifest(tiddler.bag, [entry])
+
+    def _append_manifest(self, bag_name, entries):
+        """
+        Append a list of entries to the manifest of the named bag,
+        compacting the manifest if it has grown large with superseded
+        entries.
+        """
+        manifest_path = os.path.join(self._bag_path(bag_name), 'manifest')
+        self._write_lock(manifest_path)
+        try:
+            with open(manifest_path, 'a') as manifest_file:
+                manifest_file.write(''.join('%s\n' % simplejson.dumps(entry)
+                    for entry in entries))
+            manifest = _load_manifest(manifest_path)
+            if (manifest['complete'] and manifest['lines']
+                    > 2 * len(manifest['entries']) + 100):
+                self._write_manifest(manifest_path, manifest['entries'])
+        finally:
+            write_unlock(manifest_path)
+
+    def _manifest_entries(self, bag_name):
+        """
+        Return the manifest of the named bag as a dict of
+        manifest entries keyed by tiddler title.
+        """
+        bag_path = self._bag_path(bag_name)
+        manifest_path = os.path.join(bag_path, 'manifest')
+        manifest = _load_manifest(manifest_path)
+        if manifest is None or not manifest['complete']:
+            if not os.path.exists(self._tiddlers_dir(bag_name)):
+                raise NoBagError('unable to list tiddlers in bag: %s'
+                        % bag_name)
+            manifest = self._rebuild_manifest(bag_name, manifest_path)
+        return manifest['entries']
+
+    def _manifest_entry(self, tiddler):
+        """
+        Create the manifest entry for a stored tiddler.
+        """
+        entry = {}
+        for member in ['title', 'revision', 'modified', 'modifier',
+                'created', 'creator', 'type', 'tags']:
+            entry[member] = getattr(tiddler, member)
+        entry['fields'] = dict((key, value) for key, value
+                in tiddler.fields.items() if not key.startswith('server.'))
+        return entry
+
+    def _rebuild_manifest(self, bag_name, manifest_path):
+        """
+        Create a complete manifest for the named bag by reading every
+        tiddler in it. Entries appended while the bag was being read are
+        kept, as they are at least as recent as what was read.
+        """
+        LOGGER.debug('rebuilding manifest for bag %s', bag_name)
+        entries = {}
+        for filename, _ in self._tiddler_dirs(bag_name):
+            tiddler = Tiddler(unquote(filename), bag_name)
+            try:
+                tiddler = self.tiddler_get(tiddler)
+            except NoTiddlerError as exc:
+                LOGGER.warn('malformed tiddler during manifest rebuild: '
+                        '%s:%s, %s', bag_name, filename, exc)
+                continue
+            entries[tiddler.title] = self._manifest_entry(tiddler)
+
+        self._write_lock(manifest_path)
+        try:
+            manifest = _load_manifest(manifest_path)
+            if manifest is not None:
+                for title, entry in manifest['entries'].items():
+                    entries[title] = entry
+                for title in manifest['deleted']:
+                    entries.pop(title, None)
+            self._write_manifest(manifest_path, entries)
+            return _load_manifest(manifest_path)
+        finally:
+            write_unlock(manifest_path)
+
+    def _write_manifest(self, manifest_path, entries):
+        """
+        Replace the manifest at ``manifest_path`` with a complete manifest
+        holding ``entries``. The caller must hold the manifest lock.
+        """
+        lines = [simplejson.dumps(MANIFEST_HEADER)]
+        lines.extend(simplejson.dumps(entry) for entry in entries.values())
+        write_utf8_file(manifest_path, '%s\n' % '\n'.join(lines))
+
     def _files_in_dir(self, path):
         """
-        List the filenames in a dir that do not start with .
+        List the filenames in a dir that are not lock or
+        temporary files.
         """
-        return (x for x in os.listdir(path))
+        return (name for name, _ in self._scan_dir(path))
+
+    def _dirs_in_dir(self, path):
+        """
+        List the names of the directories in a dir.
+        """
+        return (name for name, is_dir in self._scan_dir(path) if is_dir)
+
+    def _scan_dir(self, path):
+        """
+        Return the names of the entries in a dir that are not lock or
+        temporary files, each paired with whether it is a directory.
+
+        Where ``scandir`` is available the type of each entry comes
+        from the directory listing, without a ``stat``. Listings are
+        kept for one request, until the store is :py:meth:`bound
+        <bind>` to another when it is pooled, up to ``LISTINGS_LIMIT``
+        of them, and reused while the modification time of the dir is
+        unchanged. The listing of a dir modified in the last second is
+        not kept, as a change within the resolution of its
+        modification time could go unseen.
+        """
+        modified = os.stat(path).st_mtime
+        listing = self._listings.get(path)
+        if listing and listing[0] == modified:
+            return listing[1]
+
+        if scandir is None:
+            entries = [(name, os.path.isdir(os.path.join(path, name)))
+                    for name in os.listdir(path)
+                    if not name.startswith(HIDDEN_FILE_PREFIX)]
+        else:
+            entries = [(entry.name, entry.is_dir())
+                    for entry in scandir(path)
+                    if not entry.name.startswith(HIDDEN_FILE_PREFIX)]
+
+        if modified < time.time() - 1:
+            if len(self._listings) >= LISTINGS_LIMIT:
+                self._listings.clear()
+            self._listings[path] = (modified, entries)
+        return entries
 
     def _numeric_files_in_dir(self, path):
         """
@@ -424,12 +1328,175 @@ class Store(StorageInterface):
         """
         Read a tiddler file from the disk, returning
         a tiddler object.
+
+        Revision files written before ``created`` and ``creator`` were
+        stored with each revision start with some other header. Any
+        ``created`` in those is not to be trusted, so it is emptied.
         """
-        tiddler_string = read_utf8_file(tiddler_filename)
+        tiddler_string = self._read_revision_file(
+                tiddler_filename).decode('utf-8')
         self.serializer.object = tiddler
         self.serializer.from_string(tiddler_string)
+        if not tiddler_string.startswith('creator: '):
+            tiddler.created = u''
+            tiddler.creator = u''
+        body_filename = tiddler.fields.pop(BODY_HEADER, None)
+        if body_filename:
+            self._set_body(tiddler, body_filename,
+                    self._read_revision_file(os.path.join(
+                        os.path.dirname(tiddler_filename), body_filename)))
+        blob = tiddler.fields.pop(BLOB_HEADER, None)
+        if blob:
+            self._set_body(tiddler, blob, self._read_blob(blob))
+        delta = tiddler.fields.pop(DELTA_HEADER, None)
+        if delta:
+            tiddler.text = self._delta_text(tiddler, tiddler_filename, delta)
         return tiddler
 
+    def _delta_representation(self, tiddler, base_revision):
+        """
+        Return the representation of a revision of ``tiddler`` with its
+        text as a delta from ``base_revision``, or ``None`` if the delta
+        would not be smaller than the text.
+        """
+        base = Tiddler(tiddler.title, tiddler.bag)
+        base.revision = base_revision
+        try:
+            base = self._read_tiddler_revision(base)
+        except (IOError, NoTiddlerError):
+            return None
+        if binary_tiddler(base):
+            return None
+        # Text read from a revision file is stripped, so the delta is
+        # made to match.
+        text = tiddler.text.rstrip()
+        body = simplejson.dumps(_make_delta(base.text, text))
+        if len(body) >= len(text):
+            return None
+        text_sha = sha(text).hexdigest()
+        _cache_delta_text(text_sha, text)
+        return self._body_reference(tiddler, DELTA_HEADER, '%s %s %s' % (
+            base_revision, sha(base.text).hexdigest(), text_sha),
+            '%s\n' % body)
+
+    def _delta_text(self, tiddler, tiddler_filename, delta):
+        """
+        Return the text of a delta revision of ``tiddler``, read from
+        ``tiddler_filename``, by applying its delta to the text of the
+        base revision named in the ``delta`` header.
+        """
+        base_revision, base_sha, text_sha = delta.split(' ')
+        text = _cached_delta_text(text_sha)
+        if text is not None:
+            return text
+
+        base_text = _cached_delta_text(base_sha)
+        if base_text is None:
+            base = Tiddler(tiddler.title, tiddler.bag)
+            base_text = self._read_tiddler_file(base, os.path.join(
+                os.path.dirname(tiddler_filename), base_revision)).text
+            if sha(base_text).hexdigest() != base_sha:
+                raise IOError('base revision %s of %s has changed'
+                        % (base_revision, tiddler_filename))
+            _cache_delta_text(base_sha, base_text)
+
+        text = _apply_delta(base_text, simplejson.loads(tiddler.text))
+        if sha(text).hexdigest() != text_sha:
+            raise IOError('delta in %s does not apply' % tiddler_filename)
+        _cache_delta_text(text_sha, text)
+        return text
+
+    def _write_body(self, tiddler, tiddler_filename):
+        """
+        Write the body of a tiddler to a file beside the revision file
+        ``tiddler_filename``: that of a binary tiddler as is, or, if
+        ``compress`` is set, any body compressed. Return the header-only
+        representation of the revision, naming that file.
+        """
+        content = _body_content(tiddler)
+        if self._compress:
+            body_filename = '%s%s' % (os.path.basename(tiddler_filename),
+                    GZIP_SUFFIX)
+            content = _gzip(content)
+        else:
+            body_filename = '%s.bin' % os.path.basename(tiddler_filename)
+        write_bytes_file(os.path.join(os.path.dirname(tiddler_filename),
+            body_filename), content)
+        return self._body_reference(tiddler, BODY_HEADER, body_filename)
+
+    def _set_body(self, tiddler, name, content):
+        """
+        Set the text of ``tiddler`` from the ``content`` of the body
+        file or blob called ``name``, decompressing it if it was kept
+        compressed.
+        """
+        gzipped = None
+        if name.endswith(GZIP_SUFFIX):
+            gzipped = content
+            content = _gunzip(content)
+        if not binary_tiddler(tiddler):
+            text = content.decode('utf-8')
+            # Match the text of a body kept in the revision file.
+            content = text.rstrip()
+            if len(content) != len(text):
+                # What was stored is not the text as read.
+                gzipped = None
+        tiddler.text = content
+        if gzipped is not None:
+            tiddler.gzipped_text = (content, gzipped)
+
+    def _write_blob_body(self, tiddler):
+        """
+        Write the text of a tiddler to the blob named by the sha1 of its
+        content, unless that blob already exists. Return the header-only
+        representation of the revision, naming the blob.
+        """
+        if binary_tiddler(tiddler):
+            content = tiddler.text
+        else:
+            content = tiddler.text.encode('utf-8')
+        blob = sha1(content).hexdigest()
+        if self._compress:
+            blob = '%s%s' % (blob, GZIP_SUFFIX)
+        blob_filename = self._blob_filename(blob)
+        if not os.path.exists(blob_filename):
+            blob_dir = os.path.dirname(blob_filename)
+            if not os.path.exists(blob_dir):
+                try:
+                    os.makedirs(blob_dir)
+                except OSError:
+                    if not os.path.isdir(blob_dir):
+                        raise
+            if self._compress:
+                content = _gzip(content)
+            write_bytes_file(blob_filename, content)
+        return self._body_reference(tiddler, BLOB_HEADER, blob)
+
+    def _read_blob(self, blob):
+        """
+        Return the content, as bytes, of the named blob.
+        """
+        with open(self._blob_filename(blob), 'rb') as blob_file:
+            return blob_file.read()
+
+    def _blob_filename(self, blob):
+        """
+        Return the path to the named blob.
+        """
+        return os.path.join(self._store_root(), 'blobs', blob[:2], blob)
+
+    def _body_reference(self, tiddler, header, value, body=''):
+        """
+        Return the representation of a revision of ``tiddler`` with
+        its headers, plus ``header``, which says where or how its text
+        is kept, and ``body`` in place of the text.
+        """
+        representation = self.serializer.serialization.tiddler_as(tiddler,
+                omit_empty=True, omit_members=['text']).rstrip('\n')
+        headers = [representation] if representation else []
+        headers.append('%s: %s' % (header, value))
+        return '%s\n\n%s' % ('\n'.join(headers), body)
+
     def _read_tiddler_revision(self, tiddler, index=0):
         """
         Read a specific revision of a tiddler from disk.
@@ -442,6 +1509,57 @@ class Store(StorageInterface):
         tiddler.revision = tiddler_revision
         return tiddler
 
+    def _read_revision_index(self, tiddler):
+        """
+        Read the revision index of a tiddler: its ``head`` and ``first``
+        revision ids and the ``created`` and ``creator`` taken from the
+        first revision. Return ``None`` if there is no index, as is the
+        case for tiddlers not written since indexes were introduced.
+        """
+        index_filename = os.path.join(
+                self._tiddler_base_filename(tiddler), 'index')
+        try:
+            return simplejson.loads(read_utf8_file(index_filename))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_revision_index(self, tiddler_base_filename, revision_index):
+        """
+        Replace the revision index of a tiddler. The new index is written
+        beside the old one and renamed over it, so readers see either the
+        old or new index, never a partial one. The caller must hold the
+        tiddler's write lock.
+        """
+        index_filename = os.path.join(tiddler_base_filename, 'index')
+        write_utf8_file(index_filename, simplejson.dumps(revision_index))
+
+    def _read_bag(self, bag_path):
+        """
+        Return the description and policy of the bag at ``bag_path``.
+
+        These are kept in ``BAGS``, shared by every store in the
+        process, and read from disk again only when the identity, size
+        or modification time of either file has changed. As the files
+        are replaced by rename when written, any write is seen.
+        """
+        signature = (_file_signature(os.path.join(bag_path, 'description')),
+                _file_signature(os.path.join(bag_path, 'policy')))
+        with BAGS_LOCK:
+            cached = BAGS.get(bag_path)
+        if cached and cached[0] == signature:
+            desc, policy = cached[1], cached[2]
+        else:
+            desc = self._read_bag_description(bag_path)
+            policy = self._read_policy(bag_path)
+            with BAGS_LOCK:
+                BAGS[bag_path] = (signature, desc, policy)
+
+        # Callers may change the policy they are given.
+        bag_policy = Policy()
+        for key, value in vars(policy).items():
+            bag_policy.__setattr__(key, copy(value))
+        return desc, bag_policy
+
     def _read_bag_description(self, bag_path):
         """
         Read and return the description of a bag.
@@ -492,16 +1610,43 @@ class Store(StorageInterface):
             raise NoBagError('%s does not exist' % store_dir)
 
         try:
-            return os.path.join(store_dir, _encode_filename(tiddler.title))
+            return self._tiddler_dir(store_dir,
+                    _encode_filename(tiddler.title))
         except StoreEncodingError as exc:
             raise NoTiddlerError(exc)
 
+    def _tiddler_dir(self, tiddlers_dir, filename):
+        """
+        Return the path to the directory for the tiddler with encoded
+        title ``filename`` in ``tiddlers_dir``, under its buckets if
+        there is a ``tiddler_fanout``.
+        """
+        if not self._fanout:
+            return os.path.join(tiddlers_dir, filename)
+        digest = sha(filename).hexdigest()
+        buckets = [digest[level * 2:level * 2 + 2]
+                for level in range(self._fanout)]
+        return os.path.join(tiddlers_dir, *(buckets + [filename]))
+
+    def _tiddler_dirs(self, bag_name):
+        """
+        List the encoded titles and paths of the directories of the
+        tiddlers in the named bag, looking through the buckets of the
+        ``tiddler_fanout``.
+        """
+        paths = [self._tiddlers_dir(bag_name)]
+        for _ in range(self._fanout):
+            paths = [os.path.join(path, bucket) for path in paths
+                    for bucket in self._dirs_in_dir(path)]
+        return [(filename, os.path.join(path, filename)) for path in paths
+                for filename in self._dirs_in_dir(path)]
+
     def _tiddler_full_filename(self, tiddler, revision):
         """
         Return the full path to the respective tiddler file.
         """
-        return os.path.join(self._tiddlers_dir(tiddler.bag),
-            _encode_filename(tiddler.title), str(revision))
+        return os.path.join(self._tiddler_dir(self._tiddlers_dir(tiddler.bag),
+            _encode_filename(tiddler.title)), str(revision))
 
     def _tiddlers_dir(self, bag_name):
         """
@@ -519,9 +1664,15 @@ class Store(StorageInterface):
         if tiddler.revision:
             revision = tiddler.revision
         else:
-            revisions = self.list_tiddler_revisions(tiddler)
-            if revisions:
-                revision = revisions[index]
+            revision_index = None
+            if index in (0, -1):
+                revision_index = self._read_revision_index(tiddler)
+            if revision_index:
+                revision = revision_index['head' if index == 0 else 'first']
+            else:
+                revisions = self.list_tiddler_revisions(tiddler)
+                if revisions:
+                    revision = revisions[index]
 
         try:
             revision = int(revision)
@@ -537,6 +1688,45 @@ class Store(StorageInterface):
         return os.path.join(self._store_root(), 'users',
                 _encode_filename(user.usersign))
 
+    def _journal(self):
+        """
+        Return the :py:class:`Journal` of this store's root in this
+        process, opening it if need be.
+        """
+        root = self._store_root()
+        with JOURNALS_LOCK:
+            journal = JOURNALS.get(root)
+            if journal is None or journal.pid != os.getpid():
+                # The journal writes with a store of its own.
+                journal = Journal(self.__class__(
+                    dict(self.store_config, journal=False), self.environ))
+                journal.open()
+                JOURNALS[root] = journal
+        return journal
+
+    def _settle(self, bag_name=None, title=None):
+        """
+        Wait until any journaled puts of the tiddler called ``title``
+        in the bag called ``bag_name``, of any tiddler in that bag if
+        there is no ``title``, or of any tiddler at all if there is no
+        ``bag_name``, are written to the tiddler directories.
+        """
+        if self._journaled:
+            journal = JOURNALS.get(self._store_root())
+            if journal is not None:
+                journal.wait(bag_name, title)
+
+    def _write_lock(self, filename):
+        """
+        Take the write lock on ``filename``, waiting up to
+        ``lock_timeout`` seconds before giving up with a
+        :py:class:`StoreLockError <tiddlyweb.store.StoreLockError>`.
+        """
+        try:
+            write_lock(filename, timeout=self._lock_timeout)
+        except LockError as exc:
+            raise StoreLockError(exc)
+
     def _write_bag_description(self, desc, bag_path):
         """
         Write the description of a bag to disk.
@@ -556,6 +1746,742 @@ class Store(StorageInterface):
         write_utf8_file(policy_filename, policy_string)
 
 
+class SearchIndex(object):
+    """
+    An inverted index from the words in :py:class:`tiddlers
+    <tiddlyweb.model.tiddler.Tiddler>` to their bag and title, kept in
+    an SQLite database at ``path``. Beside the words, a title index
+    allows tiddlers to be found by their exact title.
+
+    Words are runs of Unicode word characters, compared without case.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, '
+        'bag TEXT NOT NULL, title TEXT NOT NULL, lower_title TEXT NOT NULL, '
+        'UNIQUE (bag, title))',
+        'CREATE INDEX IF NOT EXISTS docs_lower_title ON docs (lower_title)',
+        'CREATE TABLE IF NOT EXISTS postings (token TEXT NOT NULL, '
+        'doc INTEGER NOT NULL, PRIMARY KEY (token, doc))',
+        'CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc)',
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+
+    def _connect(self):
+        """
+        Open, and if necessary create, the index database, sharing one
+        connection with every index of the same path in this thread.
+        """
+        connections = _search_connections()
+        if (self._connection is None or connections.get(self.path,
+                (None, None))[1] is not self._connection):
+            self._connection = _search_connection(self.path)
+        return self._connection
+
+    def close(self):
+        """
+        Close the connection this thread has to the index database.
+        It is opened again when next needed.
+        """
+        _close_search_connection(self.path)
+        self._connection = None
+
+    def complete(self):
+        """
+        Return ``True`` if the index holds every tiddler in the store.
+        """
+        if not os.path.exists(self.path):
+            return False
+        row = self._connect().execute(
+                "SELECT value FROM meta WHERE key = 'complete'").fetchone()
+        return bool(row and row[0] == '1')
+
+    def mark_complete(self):
+        """
+        Record that the index holds every tiddler in the store.
+        """
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) "
+                    "VALUES ('complete', '1')")
+
+    def clear(self, complete=True):
+        """
+        Empty the index.
+        """
+        with self._connect() as connection:
+            connection.execute('DELETE FROM postings')
+            connection.execute('DELETE FROM docs')
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) "
+                    "VALUES ('complete', ?)", ('1' if complete else '0',))
+
+    def index_tiddler(self, tiddler):
+        """
+        Replace the words recorded for ``tiddler``.
+        """
+        tokens = _tiddler_tokens(tiddler)
+
+        with self._connect() as connection:
+            doc = self._doc_id(connection, tiddler.bag, tiddler.title)
+            if doc is None:
+                doc = connection.execute('INSERT INTO docs '
+                        '(bag, title, lower_title) VALUES (?, ?, ?)',
+                        (tiddler.bag, tiddler.title,
+                            tiddler.title.lower())).lastrowid
+            else:
+                connection.execute('DELETE FROM postings WHERE doc = ?',
+                        (doc,))
+            connection.executemany('INSERT INTO postings (token, doc) '
+                    'VALUES (?, ?)', ((token, doc) for token in tokens))
+
+    def remove_tiddler(self, tiddler):
+        """
+        Remove ``tiddler`` from the index.
+        """
+        with self._connect() as connection:
+            doc = self._doc_id(connection, tiddler.bag, tiddler.title)
+            if doc is not None:
+                connection.execute('DELETE FROM postings WHERE doc = ?',
+                        (doc,))
+                connection.execute('DELETE FROM docs WHERE id = ?', (doc,))
+
+    def remove_bag(self, bag_name):
+        """
+        Remove every tiddler in the named bag from the index.
+        """
+        with self._connect() as connection:
+            connection.execute('DELETE FROM postings WHERE doc IN '
+                    '(SELECT id FROM docs WHERE bag = ?)', (bag_name,))
+            connection.execute('DELETE FROM docs WHERE bag = ?', (bag_name,))
+
+    def search(self, query):
+        """
+        Yield the bag and title of those tiddlers which contain every
+        word in ``query``, or whose title is ``query``.
+        """
+        tokens = sorted(set(_tokenize(query)))
+        statement = 'SELECT bag, title FROM docs WHERE lower_title = ?'
+        arguments = [query.lower()]
+        if tokens:
+            statement += ' OR id IN (%s)' % ' INTERSECT '.join(
+                    ['SELECT doc FROM postings WHERE token = ?'] * len(tokens))
+            arguments.extend(tokens)
+        for bag_name, title in self._connect().execute(statement, arguments):
+            yield bag_name, title
+
+    def _doc_id(self, connection, bag_name, title):
+        """
+        Return the id of the document for a tiddler, if there is one.
+        """
+        row = connection.execute('SELECT id FROM docs WHERE bag = ? '
+                'AND title = ?', (bag_name, title)).fetchone()
+        if row:
+            return row[0]
+        return None
+
+
+class Journal(object):
+    """
+    A write-ahead journal of tiddler puts for the text ``store``, which
+    writes them to the tiddler directories later, in the order they
+    were journaled, from a thread of its own.
+
+    Each process appends to a journal file of its own, holding a
+    ``flock`` on it while it is open. Puts arriving while the journal
+    is being synced are synced together by the next of them to sync.
+    The file is emptied whenever every put in it has been written.
+
+    A put takes the tiddler's write lock, as any other, and the lock is
+    held until every journaled put of the tiddler has been written, so
+    revisions are numbered in order across processes. Journal files
+    left by processes which have gone are written out when a journal
+    is opened, under the write lock of the journal directory, before
+    the journal takes any put. Where there is no ``fcntl`` that is
+    every journal file, so only one process should use a journaled
+    store.
+
+    Reads wait only for the puts journaled by their own process. A
+    process reading a tiddler put through another process's journal
+    sees the revision before until that journal writes it, so where
+    many processes serve the same store, use ``apply`` durability or
+    do not journal.
+
+    A put which can not be written is tried again, with a growing delay,
+    holding up the puts journaled after it. While it is failing, gets
+    and puts waiting for it, or for a put behind it, raise
+    :py:class:`StoreError <tiddlyweb.store.StoreError>` rather than
+    read the old revision, and the journal file is kept, so that the
+    put is recovered if the process exits before it is written.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.path = os.path.join(store._store_root(), 'journal')
+        self.pid = os.getpid()
+        self._lock = threading.Condition()
+        self._sync_lock = threading.Lock()
+        self._entries = deque()
+        # (bag, title) to a list of the number of puts waiting to be
+        # written and the revision index after the last of them.
+        self._pending = {}
+        self._written = 0
+        self._synced = 0
+        self._file = None
+        self._closed = False
+        # The key of the put which last failed to be written, and the
+        # exception, until it is written.
+        self._failure = None
+
+    def open(self):
+        """
+        Write out any journal files left by other processes, then start
+        a journal file and the thread that writes puts from it.
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            if not os.path.isdir(self.path):
+                raise
+        self.recover()
+        self._file = open(os.path.join(self.path, '%s-%s'
+            % (self.pid, uuid.uuid4().hex)), 'ab')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        thread = threading.Thread(target=self._write_entries,
+                name='tiddlyweb-journal')
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """
+        Wait until every journaled put is written, then remove the
+        journal file and stop. If a put is failing to be written, stop
+        at once, leaving the journal file to be recovered.
+        """
+        try:
+            self.wait()
+        except StoreError as exc:
+            LOGGER.error('leaving journal %s to be recovered: %s',
+                    self._file.name, exc)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lock.notify_all()
+            if not self._entries:
+                os.unlink(self._file.name)
+            self._file.close()
+        with JOURNALS_LOCK:
+            if JOURNALS.get(self.store._store_root()) is self:
+                del JOURNALS[self.store._store_root()]
+
+    def recover(self):
+        """
+        Write the puts in journal files whose process has gone, then
+        remove those files. Return the number of puts written.
+        """
+        recovered = 0
+        self.store._write_lock(self.path)
+        try:
+            for name in os.listdir(self.path):
+                recovered += self._recover_file(os.path.join(self.path,
+                    name))
+        finally:
+            write_unlock(self.path)
+        return recovered
+
+    def _recover_file(self, path):
+        """
+        Write the puts in the journal file at ``path`` and remove it,
+        unless its process is still using it. Return the number of puts
+        written.
+        """
+        try:
+            journal_file = open(path, 'rb')
+        except IOError:
+            return 0
+        recovered = 0
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(journal_file.fileno(),
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    return 0
+            for record in _read_journal(journal_file):
+                recovered += self._recover_entry(record)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        finally:
+            journal_file.close()
+        return recovered
+
+    def _recover_entry(self, record):
+        """
+        Write the put in journal ``record`` unless its revision is
+        already stored with the same content. If another writer has
+        used its revision id since, write it as a new revision. Return
+        the number of puts written.
+        """
+        tiddler, _ = _journal_tiddler(record)
+        tiddler_base_filename = self.store._tiddler_base_filename(tiddler)
+        if not os.path.exists(tiddler_base_filename):
+            self.store._make_tiddler_dir(tiddler_base_filename)
+        self.store._write_lock(tiddler_base_filename)
+        try:
+            if self._stored(tiddler):
+                return 0
+            tiddler.revision = None
+            revision_index = self.store._next_revision_index(tiddler,
+                    self.store._read_revision_index(tiddler))
+            self._write_entry(self.store._stored_tiddler(tiddler,
+                revision_index), tiddler_base_filename, revision_index)
+            return 1
+        finally:
+            write_unlock(tiddler_base_filename)
+
+    def _stored(self, tiddler):
+        """
+        True if the revision of ``tiddler`` is stored, with the same
+        content.
+        """
+        try:
+            if tiddler.revision not in self.store.list_tiddler_revisions(
+                    tiddler):
+                return False
+            stored = Tiddler(tiddler.title, tiddler.bag)
+            stored.revision = tiddler.revision
+            stored = self.store._read_tiddler_revision(stored)
+        except StoreError:
+            return False
+        # created and creator are kept in the revision index.
+        stored_text, journaled_text = [self.store.serializer.serialization.
+                tiddler_as(revision, omit_empty=True,
+                    omit_members=['created', 'creator']).rstrip()
+                for revision in (stored, tiddler)]
+        return stored_text == journaled_text
+
+    def put(self, store, tiddler):
+        """
+        Journal a put of ``tiddler``, made by ``store``, setting its
+        revision, and return once it is as durable as the store's
+        ``journal_durability`` asks.
+        """
+        key = (tiddler.bag, tiddler.title)
+        tiddler.revision = None
+        tiddler_base_filename = store._tiddler_base_filename(tiddler)
+        if not os.path.exists(tiddler_base_filename):
+            store._make_tiddler_dir(tiddler_base_filename)
+
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending:
+                # This process holds the tiddler's write lock already.
+                revision_index = store._next_revision_index(tiddler,
+                        dict(pending[1]))
+                sequence = self._append(key, tiddler_base_filename,
+                        store._stored_tiddler(tiddler, revision_index),
+                        revision_index)
+                pending[0] += 1
+                pending[1] = revision_index
+
+        if not pending:
+            store._write_lock(tiddler_base_filename)
+            try:
+                revision_index = store._next_revision_index(tiddler,
+                        store._read_revision_index(tiddler))
+                with self._lock:
+                    sequence = self._append(key, tiddler_base_filename,
+                            store._stored_tiddler(tiddler, revision_index),
+                            revision_index)
+                    self._pending[key] = [1, revision_index]
+            except Exception:
+                write_unlock(tiddler_base_filename)
+                raise
+
+        tiddler.revision = revision_index['head']
+        if store._durability != 'write':
+            self.sync(sequence)
+        if store._durability == 'apply':
+            self.wait(tiddler.bag, tiddler.title)
+
+    def _append(self, key, tiddler_base_filename, stored_tiddler,
+            revision_index):
+        """
+        Append a put of ``stored_tiddler``, the head of
+        ``revision_index``, to the journal file and queue it to be
+        written. The caller must hold ``_lock``. Return the put's
+        sequence number.
+        """
+        record = _journal_record(stored_tiddler, revision_index)
+        self._file.write(('%s\n' % simplejson.dumps(record)).encode('utf-8'))
+        self._file.flush()
+        self._written += 1
+        self._entries.append((key, tiddler_base_filename, record))
+        self._lock.notify_all()
+        return self._written
+
+    def sync(self, sequence):
+        """
+        Return once the put numbered ``sequence``, and every put before
+        it, is synced to disk, syncing every put journaled so far if
+        need be.
+        """
+        with self._sync_lock:
+            with self._lock:
+                if self._synced >= sequence:
+                    return
+                written = self._written
+                fileno = self._file.fileno()
+            os.fsync(fileno)
+            with self._lock:
+                self._synced = max(self._synced, written)
+
+    def wait(self, bag_name=None, title=None):
+        """
+        Return once no put of the tiddler called ``title`` in the bag
+        called ``bag_name``, or of any tiddler in that bag if there is
+        no ``title``, or of any tiddler at all if there is no
+        ``bag_name``, is waiting to be written.
+
+        Raise :py:class:`StoreError <tiddlyweb.store.StoreError>` if
+        such a put is waiting while a put is failing to be written.
+        """
+        with self._lock:
+            while any((bag_name is None or bag_name == key[0])
+                    and (title is None or title == key[1])
+                    for key in self._pending):
+                if self._failure is not None:
+                    key, exc = self._failure
+                    raise StoreError('unable to write journaled put of '
+                            '%s:%s: %s' % (key[0], key[1], exc))
+                self._lock.wait()
+
+    def _write_entries(self):
+        """
+        Write journaled puts to the tiddler directories, in order,
+        until the journal is closed, trying again a put which fails.
+        """
+        delay = JOURNAL_RETRY_DELAY
+        while True:
+            with self._lock:
+                while not self._entries and not self._closed:
+                    self._lock.wait()
+                if self._closed:
+                    return
+                key, tiddler_base_filename, record = self._entries[0]
+            try:
+                tiddler, revision_index = _journal_tiddler(record)
+                self._write_entry(tiddler, tiddler_base_filename,
+                        revision_index)
+            except Exception as exc:
+                LOGGER.error('unable to write journaled put of %s:%s, '
+                        'trying again in %s seconds: %s', key[0], key[1],
+                        delay, exc)
+                with self._lock:
+                    self._failure = (key, exc)
+                    self._lock.notify_all()
+                    if not self._closed:
+                        self._lock.wait(delay)
+                delay = min(delay * 2, JOURNAL_MAX_RETRY_DELAY)
+                continue
+            delay = JOURNAL_RETRY_DELAY
+            with self._lock:
+                self._failure = None
+                self._entries.popleft()
+                pending = self._pending[key]
+                pending[0] -= 1
+                if not pending[0]:
+                    del self._pending[key]
+                    write_unlock(tiddler_base_filename)
+                if not self._entries:
+                    self._file.seek(0)
+                    self._file.truncate()
+                self._lock.notify_all()
+
+    def _write_entry(self, tiddler, tiddler_base_filename, revision_index):
+        """
+        Write one journaled revision of a tiddler, and record it in
+        the manifest. The caller holds the tiddler's write lock.
+        """
+        self.store._write_revision(tiddler, tiddler_base_filename,
+                revision_index)
+        self.store._record_in_manifest(tiddler)
+
+
+def _journal_record(tiddler, revision_index):
+    """
+    Return a dict describing a journaled put of the stored ``tiddler``,
+    the head of ``revision_index``.
+    """
+    record = dict((member, getattr(tiddler, member))
+            for member in Tiddler.data_members)
+    record['bag'] = tiddler.bag
+    record['revision'] = tiddler.revision
+    record['first'] = revision_index['first']
+    if binary_tiddler(tiddler):
+        record['text'] = b64encode(tiddler.text).decode('ascii')
+        record['binary'] = True
+    return record
+
+
+def _journal_tiddler(record):
+    """
+    Return the tiddler and the revision index of the put described by
+    journal ``record``.
+    """
+    tiddler = Tiddler(record['title'], record['bag'])
+    for member in Tiddler.data_members:
+        setattr(tiddler, member, record[member])
+    if record.get('binary'):
+        tiddler.text = b64decode(record['text'])
+    tiddler.revision = record['revision']
+    return tiddler, {'head': record['revision'],
+            'created': tiddler.created, 'creator': tiddler.creator,
+            'first': record['first']}
+
+
+def _read_journal(journal_file):
+    """
+    Yield the records in ``journal_file``, stopping at any record left
+    partly written.
+    """
+    for line in journal_file:
+        if not line.endswith(b'\n'):
+            return
+        try:
+            yield simplejson.loads(line.decode('utf-8'))
+        except ValueError:
+            return
+
+
+def _tokenize(text):
+    """
+    Split text into lower case words.
+    """
+    return SEARCH_TOKEN_RE.findall(text.lower())
+
+
+def _tiddler_tokens(tiddler):
+    """
+    Return the set of words in the title, tags, fields and, if it is
+    not binary, text of ``tiddler``.
+    """
+    words = [tiddler.title] + list(tiddler.tags)
+    words.extend(value for key, value in tiddler.fields.items()
+            if not key.startswith('server.'))
+    if not binary_tiddler(tiddler):
+        words.append(tiddler.text)
+    return set(_tokenize(' '.join(words)))
+
+
+def _search_connections():
+    """
+    Return the connections of this thread to search index databases,
+    keyed by path, each with the key of its database.
+    """
+    try:
+        return SEARCH_CONNECTIONS.connections
+    except AttributeError:
+        SEARCH_CONNECTIONS.connections = {}
+        return SEARCH_CONNECTIONS.connections
+
+
+def _search_connection(path):
+    """
+    Return the connection of this thread to the search index database
+    at ``path``, opening it if it is not open or the database has been
+    replaced, and making sure once of the schema of a new database.
+    """
+    connections = _search_connections()
+    key, connection = connections.get(path, (None, None))
+    if connection is not None:
+        if key == _search_database_key(path):
+            return connection
+        _close_search_connection(path)
+    import sqlite3
+    connection = sqlite3.connect(path, timeout=30)
+    key = _search_database_key(path)
+    with SEARCH_DATABASES_LOCK:
+        if key not in SEARCH_DATABASES:
+            with connection:
+                for statement in SearchIndex.SCHEMA:
+                    connection.execute(statement)
+            SEARCH_DATABASES.add(key)
+    connections[path] = (key, connection)
+    return connection
+
+
+def _close_search_connection(path):
+    """
+    Close the connection of this thread to the search index database
+    at ``path``, forgetting its schema so that a database made later
+    at the same path and inode is not taken to have one.
+    """
+    key, connection = _search_connections().pop(path, (None, None))
+    if connection is not None:
+        connection.close()
+        with SEARCH_DATABASES_LOCK:
+            SEARCH_DATABASES.discard(key)
+
+
+def _search_database_key(path):
+    """
+    Return the key of the database at ``path`` in ``SEARCH_DATABASES``,
+    so that a database replaced by another at the same path is seen to
+    be new.
+    """
+    try:
+        return (path, os.stat(path).st_ino)
+    except OSError:
+        return None
+
+
+def _search_index(store):
+    """
+    Return the search index of the text store behind the
+    :py:class:`Store <tiddlyweb.store.Store>` facade ``store``, or
+    wrapped by its storage, as by the :py:mod:`cached
+    <tiddlyweb.stores.cached>` store, if it has one.
+    """
+    storage = getattr(store, 'storage', None)
+    while getattr(storage, 'wrapped', None) is not None:
+        storage = storage.wrapped
+    if isinstance(storage, Store):
+        return storage._search_index
+    return None
+
+
+def _index_tiddler_put(store, tiddler):
+    """
+    Store hook to update the search index when a tiddler is put.
+    """
+    search_index = _search_index(store)
+    if search_index:
+        search_index.index_tiddler(tiddler)
+
+
+def _index_tiddler_delete(store, tiddler):
+    """
+    Store hook to update the search index when a tiddler is deleted.
+    """
+    search_index = _search_index(store)
+    if search_index:
+        search_index.remove_tiddler(tiddler)
+
+
+def _index_bag_delete(store, bag):
+    """
+    Store hook to update the search index when a bag is deleted.
+    """
+    search_index = _search_index(store)
+    if search_index:
+        search_index.remove_bag(bag.name)
+
+
+HOOKS['tiddler']['put'].append(_index_tiddler_put)
+HOOKS['tiddler']['delete'].append(_index_tiddler_delete)
+HOOKS['bag']['delete'].append(_index_bag_delete)
+
+
+def _body_content(tiddler):
+    """
+    Return the body of ``tiddler`` as bytes: the text of a binary
+    tiddler as is, otherwise the text as read back from a revision
+    file, encoded.
+    """
+    if binary_tiddler(tiddler):
+        return tiddler.text
+    return tiddler.text.rstrip().encode('utf-8')
+
+
+def _gzip(content):
+    """
+    Compress ``content`` in the gzip format, so it may be sent as is
+    with a ``Content-Encoding`` of ``gzip``.
+    """
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode='wb', mtime=0) as gzip_file:
+        gzip_file.write(content)
+    return output.getvalue()
+
+
+def _gunzip(content):
+    """
+    Decompress gzip ``content``.
+    """
+    return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+
+
+def _make_delta(base, text):
+    """
+    Return a list describing how to make ``text`` from ``base``, line
+    by line: a pair of indexes for a run of lines taken from ``base``,
+    or a string of new lines.
+    """
+    base_lines = base.splitlines(True)
+    lines = text.splitlines(True)
+    matcher = difflib.SequenceMatcher(None, base_lines, lines,
+            autojunk=False)
+    delta = []
+    for tag, base_start, base_end, start, end in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([base_start, base_end])
+        elif end > start:
+            delta.append(''.join(lines[start:end]))
+    return delta
+
+
+def _apply_delta(base, delta):
+    """
+    Make text from ``base`` and a ``delta`` made by :py:func:`_make_delta`.
+    """
+    base_lines = base.splitlines(True)
+    return u''.join(''.join(base_lines[item[0]:item[1]])
+            if isinstance(item, list) else item for item in delta)
+
+
+def _cached_delta_text(text_sha):
+    """
+    Return the text with sha1 ``text_sha`` if it is in ``DELTA_TEXTS``.
+    """
+    with DELTA_TEXTS_LOCK:
+        text = DELTA_TEXTS.pop(text_sha, None)
+        if text is not None:
+            DELTA_TEXTS[text_sha] = text
+    return text
+
+
+def _cache_delta_text(text_sha, text):
+    """
+    Keep ``text`` in ``DELTA_TEXTS``, forgetting the least recently used
+    text if there are too many.
+    """
+    with DELTA_TEXTS_LOCK:
+        DELTA_TEXTS.pop(text_sha, None)
+        DELTA_TEXTS[text_sha] = text
+        if len(DELTA_TEXTS) > DELTA_TEXTS_LIMIT:
+            DELTA_TEXTS.popitem(last=False)
+
+
+def _file_signature(path):
+    """
+    Return the inode, size and modification time of the file at
+    ``path``, or ``None`` if there is no file.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
 def _encode_filename(filename):
     """
     utf-8 encode, then url escape, some filename,
@@ -567,3 +2493,121 @@ def _encode_filename(filename):
     if not filename or '../' in filename:
         raise StoreEncodingError('invalid name for entity')
     return quote(filename.encode('utf-8'), safe=".!~*'()")
+
+
+def index_query(environ, **kwords):
+    """
+    Satisfy a select filter on a bag, or a check for the existence of a
+    tiddler in a bag (``id=bag:title``), from the bag's manifest.
+
+    Refuse, with :py:class:`FilterIndexRefused
+    <tiddlyweb.filters.FilterIndexRefused>`, when the current store is
+    not a text store with manifests, or when the attribute being selected
+    is not recorded in the manifest.
+
+    The returned tiddlers are not loaded from the store.
+    """
+    storage = getattr(environ.get('tiddlyweb.store'), 'storage', None)
+    if not isinstance(storage, Store) or not storage._manifest:
+        raise FilterIndexRefused('store has no manifests')
+
+    if 'id' in kwords:
+        bag_name, title = kwords['id'].split(':', 1)
+        if title in storage._manifest_entries(bag_name):
+            return [Tiddler(title, bag_name)]
+        return []
+
+    bag_name = kwords.pop('bag')
+    try:
+        (attribute, value), = kwords.items()
+    except ValueError:
+        raise FilterIndexRefused('unable to select on %s' % kwords)
+    if attribute == 'text' or (attribute in ATTRIBUTE_SELECTOR
+            and attribute not in ['tag', 'field']):
+        raise FilterIndexRefused('%s is not in the manifest' % attribute)
+    select = ATTRIBUTE_SELECTOR.get(attribute, default_func)
+
+    tiddlers = []
+    for entry in list(storage._manifest_entries(bag_name).values()):
+        tiddler = _manifest_tiddler(entry, bag_name)
+        if select(tiddler, attribute, value):
+            tiddlers.append(Tiddler(tiddler.title, bag_name))
+    return tiddlers
+
+
+def _merge_pack_index(lines):
+    """
+    Merge the ``lines`` of a pack index, each a JSON dict from the
+    names of packed files to their offset and length in the pack, into
+    one dict. A line which is not whole, left by an interrupted append,
+    is skipped: the files it would have recorded were not removed.
+    """
+    pack_index = {}
+    for line in lines:
+        try:
+            pack_index.update(simplejson.loads(line.decode('utf-8')))
+        except ValueError:
+            continue
+    return pack_index
+
+
+def _load_manifest(manifest_path):
+    """
+    Return the current state of the manifest at ``manifest_path`` as
+    a dict, or ``None`` if there is no manifest. Only those lines
+    appended since the manifest was last read are parsed.
+    """
+    with MANIFESTS_LOCK:
+        try:
+            stat = os.stat(manifest_path)
+        except OSError:
+            MANIFESTS.pop(manifest_path, None)
+            return None
+        manifest = MANIFESTS.get(manifest_path)
+        if (manifest is None or manifest['inode'] != stat.st_ino
+                or manifest['offset'] > stat.st_size):
+            manifest = {'inode': stat.st_ino, 'offset': 0, 'lines': 0,
+                    'complete': False, 'entries': {}, 'deleted': set()}
+        if stat.st_size > manifest['offset']:
+            with open(manifest_path, 'rb') as manifest_file:
+                manifest_file.seek(manifest['offset'])
+                data = manifest_file.read(stat.st_size - manifest['offset'])
+            # Ignore a trailing partial line, it is still being written.
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].splitlines():
+                _apply_manifest_line(manifest,
+                        simplejson.loads(line.decode('utf-8')))
+            manifest['offset'] += end
+        MANIFESTS[manifest_path] = manifest
+        return manifest
+
+
+def _apply_manifest_line(manifest, entry):
+    """
+    Update ``manifest`` with one parsed line of a manifest file.
+
+    Writers may append entries for the same tiddler out of order, so
+    an entry for an older revision than the one recorded is ignored.
+    """
+    if 'title' not in entry:
+        manifest['complete'] = manifest['lines'] == 0
+    elif entry.get('deleted'):
+        manifest['entries'].pop(entry['title'], None)
+        manifest['deleted'].add(entry['title'])
+    else:
+        current = manifest['entries'].get(entry['title'])
+        if current is None or current['revision'] <= entry['revision']:
+            manifest['entries'][entry['title']] = entry
+        manifest['deleted'].discard(entry['title'])
+    manifest['lines'] += 1
+
+
+def _manifest_tiddler(entry, bag_name):
+    """
+    Create an unloaded tiddler holding the metadata in a manifest entry.
+    """
+    tiddler = Tiddler(entry['title'], bag_name)
+    for member in ['revision', 'modified', 'modifier', 'created',
+            'creator', 'type', 'tags', 'fields']:
+        setattr(tiddler, member, entry.get(member))
+    return tiddler
@@ -9,14 +9,38 @@ from __future__ import print_function
 
 import logging
 import codecs
+import errno
 import os
 import sys
+import threading
+import time
+
+from copy import deepcopy
 
 try:
     from hashlib import sha1
 except ImportError:
     from sha import sha as sha1
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# The names of lock and temporary files start with this, which is
+# never produced by url escaping, so they can not be mistaken for
+# entities in the text store.
+HIDDEN_FILE_PREFIX = '#'
+
+# Descriptors of the lock files held by this process.
+LOCKS = {}
+
+# Rename over an existing file, on all platforms where possible.
+REPLACE = getattr(os, 'replace', os.rename)
+
+# Attributes of entities which are not copied by copy_entity_state.
+UNSTORED_ATTRIBUTES = ('store', 'recipe')
 
 PSEUDO_BINARY_TYPES = [
     'application/javascript',
@@ -171,36 +195,109 @@ def superclass_name(instance):
     return instance.__class__.mro()[-2].__name__.lower()
 
 
+def entity_key(entity):
+    """
+    Return a tuple which identifies ``entity`` in the store: its
+    lowerclass name and its name, or for a tiddler its bag, title and
+    revision.
+    """
+    lower_class = superclass_name(entity)
+    if lower_class == 'tiddler':
+        return (lower_class, entity.bag, entity.title, entity.revision)
+    elif lower_class == 'user':
+        return (lower_class, entity.usersign)
+    return (lower_class, entity.name)
+
+
+def copy_entity_state(source, target):
+    """
+    Copy the stored attributes of entity ``source`` to ``target``, so
+    that changing one does not change the other.
+    """
+    for name, value in source.__dict__.items():
+        if name not in UNSTORED_ATTRIBUTES:
+            target.__dict__[name] = deepcopy(value)
+
+
 def write_utf8_file(filename, content):
     """
     Write the unicode string in ``content`` to a ``UTF-8`` encoded
     file named ``filename``.
 
+    The content is written to a temporary file which is then renamed
+    to ``filename``, so readers see either the old or the new file,
+    never a partial one.
+
+    Allow any exceptions to raise.
+    """
+    write_bytes_file(filename, content.encode('utf-8'))
+
+
+def write_bytes_file(filename, content):
+    """
+    Write the bytes in ``content`` to a file named ``filename``,
+    by way of a temporary file as in :py:func:`write_utf8_file`.
+
     Allow any exceptions to raise.
     """
-    dest_file = codecs.open(filename, 'w', encoding='utf-8')
-    dest_file.write(content)
-    dest_file.close()
+    pathname, basename = os.path.split(filename)
+    temp_filename = os.path.join(pathname, '%s%s.%s.%s.tmp' % (
+        HIDDEN_FILE_PREFIX, basename, os.getpid(),
+        threading.current_thread().ident))
+    temp_fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            0o666)
+    try:
+        with os.fdopen(temp_fd, 'wb') as dest_file:
+            dest_file.write(content)
+        REPLACE(temp_filename, filename)
+    except Exception:
+        try:
+            os.unlink(temp_filename)
+        except OSError:
+            pass
+        raise
 
 
-def write_lock(filename):
+def write_lock(filename, timeout=0):
     """
-    Create an advisory lock file based on ``filename``.
+    Take an advisory lock based on ``filename``, waiting up to
+    ``timeout`` seconds for another process or thread to release it.
+    Raise :py:class:`LockError` if the lock is not acquired.
+
+    Where ``fcntl`` is available the lock is an exclusive ``flock`` on
+    a lock file next to ``filename``, so a lock left by a process which
+    has died does not block others.
 
     This is primarily used by the :py:mod:`text store
     <tiddlyweb.stores.text>`.
     """
-
     lock_filename = _lock_filename(filename)
 
-    if os.path.exists(lock_filename):
-        pid = _read_lock_file(lock_filename)
-        raise LockError('write lock for %s taken by %s' % (filename, pid))
+    if fcntl is None:
+        _create_lock_file(filename, lock_filename, timeout)
+        return
+
+    deadline = time.time() + timeout
+    while True:
+        lock_fd = os.open(lock_filename, os.O_RDWR | os.O_CREAT, 0o666)
+        if not _flock(lock_fd, deadline - time.time()):
+            pid = _read_lock_file(lock_filename)
+            raise LockError('write lock for %s taken by %s'
+                    % (filename, pid))
+        # The holder we waited for may have removed the lock file
+        # before releasing it, in which case start again.
+        try:
+            current = (os.fstat(lock_fd).st_ino
+                    == os.stat(lock_filename).st_ino)
+        except OSError:
+            current = False
+        if current:
+            break
+        os.close(lock_fd)
 
-    lock = open(lock_filename, 'w')
-    pid = os.getpid()
-    lock.write(str(pid))
-    lock.close()
+    os.ftruncate(lock_fd, 0)
+    os.write(lock_fd, str(os.getpid()).encode('ascii'))
+    LOCKS[lock_filename] = lock_fd
 
 
 def write_unlock(filename):
@@ -208,7 +305,14 @@ def write_unlock(filename):
     Unlock the write lock associated with ``filename``.
     """
     lock_filename = _lock_filename(filename)
+    if fcntl is None:
+        os.unlink(lock_filename)
+        return
+
+    lock_fd = LOCKS.pop(lock_filename)
     os.unlink(lock_filename)
+    # Closing the file releases the lock.
+    os.close(lock_fd)
 
 
 def initialize_logging(config, server=False):
@@ -255,12 +359,94 @@ def _initialize_logging(config):
     logger.debug('TiddlyWeb starting up as %s', sys.argv[0])
 
 
+def _create_lock_file(filename, lock_filename, timeout):
+    """
+    Take the write lock on ``filename`` by exclusively creating
+    ``lock_filename``, for platforms without ``fcntl``.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            lock_fd = os.open(lock_filename,
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+            if time.time() >= deadline:
+                pid = _read_lock_file(lock_filename)
+                raise LockError('write lock for %s taken by %s'
+                        % (filename, pid))
+            time.sleep(.05)
+    os.write(lock_fd, str(os.getpid()).encode('ascii'))
+    os.close(lock_fd)
+
+
+def _flock(lock_fd, timeout):
+    """
+    Take an exclusive ``flock`` on ``lock_fd``, blocking for up to
+    ``timeout`` seconds, and return ``True`` if it was taken. When
+    ``False`` is returned, ``lock_fd`` has been or will be closed.
+    """
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except (IOError, OSError) as exc:
+        if exc.errno not in (errno.EAGAIN, errno.EACCES):
+            os.close(lock_fd)
+            raise
+    if timeout <= 0:
+        os.close(lock_fd)
+        return False
+    return _wait_for_flock(lock_fd, timeout)
+
+
+def _wait_for_flock(lock_fd, timeout):
+    """
+    Block for up to ``timeout`` seconds to take an exclusive ``flock``
+    on ``lock_fd``, returning ``True`` if it was taken.
+
+    ``flock`` has no timeout of its own, so the blocking call is made
+    in a helper thread. If we stop waiting before the helper gets the
+    lock, the helper owns ``lock_fd`` and closes it, releasing the lock
+    as soon as it is acquired.
+    """
+    acquired = threading.Event()
+    state = {'abandoned': False, 'error': None}
+    guard = threading.Lock()
+
+    def take_lock():
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        except (IOError, OSError) as exc:
+            state['error'] = exc
+        with guard:
+            if state['abandoned']:
+                os.close(lock_fd)
+            else:
+                acquired.set()
+
+    helper = threading.Thread(target=take_lock)
+    helper.daemon = True
+    helper.start()
+    acquired.wait(timeout)
+    with guard:
+        if not acquired.is_set():
+            state['abandoned'] = True
+            return False
+    if state['error']:
+        os.close(lock_fd)
+        raise state['error']
+    return True
+
+
 def _lock_filename(filename):
     """
     Return the pathname of the lock to used with ``filename``.
     """
     pathname, basename = os.path.split(filename)
-    lock_filename = os.path.join(pathname, '.%s' % basename)
+    lock_filename = os.path.join(pathname, '%s%s.lock' % (
+        HIDDEN_FILE_PREFIX, basename))
     return lock_filename
 
 
@@ -268,7 +454,10 @@ def _read_lock_file(lockfile):
     """
     Read the pid from the file named by ``lockfile``.
     """
-    lock = open(lockfile, 'r')
+    try:
+        lock = open(lockfile, 'r')
+    except IOError:
+        return 'an unknown process'
     pid = lock.read()
     lock.close()
     return pid
@@ -303,14 +303,21 @@ def _validate_tiddler_content(environ, tiddler):
         raise HTTP409('Tiddler content is invalid: %s' % exc)
 
 
-def validate_tiddler_headers(environ, tiddler):
+def validate_tiddler_headers(environ, tiddler, gzipped=False,
+        vary='Accept'):
     """
     Check ETag and last modified header information to
     see if a) on ``GET`` the user agent can use its cached tiddler
     b) on ``PUT`` we have edit contention.
+
+    If the tiddler is to be sent ``gzipped`` its ETag is distinct from
+    that of the identity encoding. ``vary`` is the ``Vary`` header of a
+    ``304`` response.
     """
     request_method = environ['REQUEST_METHOD']
     this_tiddlers_etag = tiddler_etag(environ, tiddler)
+    if gzipped:
+        this_tiddlers_etag = _gzip_etag(this_tiddlers_etag)
 
     LOGGER.debug('attempting to validate %s with revision %s',
             tiddler.title, tiddler.revision)
@@ -329,11 +336,11 @@ def validate_tiddler_headers(environ, tiddler):
                 pass  # if the value is not an int use default header
         incoming_etag = check_incoming_etag(environ, this_tiddlers_etag,
                 last_modified=last_modified_string,
-                cache_control=cache_header)
+                cache_control=cache_header, vary=vary)
         if not incoming_etag:  # only check last-modified if no etag
             check_last_modified(environ, last_modified_string,
                     etag=this_tiddlers_etag,
-                    cache_control=cache_header)
+                    cache_control=cache_header, vary=vary)
 
     else:
         incoming_etag = environ.get('HTTP_IF_MATCH', None)
@@ -347,6 +354,14 @@ def validate_tiddler_headers(environ, tiddler):
     return last_modified, etag
 
 
+def _gzip_etag(etag):
+    """
+    Return the ETag of the gzip encoding of the representation whose
+    ETag is ``etag``.
+    """
+    return '%s-gzip"' % etag[:-1]
+
+
 def _etag_write_match(incoming_etag, server_etag):
     """
     Compare two tiddler etags for a satisfactory match
@@ -378,15 +393,26 @@ def _send_tiddler(environ, start_response, tiddler):
     except NoTiddlerError as exc:
         raise HTTP404('%s not found, %s' % (tiddler.title, exc))
 
-    # this will raise 304
-    # have to do this check after we read from the store because
-    # we need the revision, which is sad
-    last_modified, etag = validate_tiddler_headers(environ, tiddler)
-
     # make choices between binary or serialization
     content, mime_type, serialized = _get_tiddler_content(environ, tiddler)
 
-    vary_header = ('Vary', 'Accept')
+    vary = 'Accept'
+    encoding_header = None
+    if not serialized:
+        gzipped = _stored_gzip(tiddler)
+        if gzipped is not None:
+            vary = 'Accept, Accept-Encoding'
+            if _accepts_gzip(environ):
+                content = gzipped
+                encoding_header = ('Content-Encoding', 'gzip')
+    vary_header = ('Vary', vary)
+
+    # this will raise 304
+    # have to do this check after we read from the store because
+    # we need the revision, which is sad, and after choosing the
+    # encoding, as the gzip encoding has an ETag of its own
+    last_modified, etag = validate_tiddler_headers(environ, tiddler,
+            gzipped=encoding_header is not None, vary=vary)
     cache_header = ('Cache-Control', 'no-cache')
     if CACHE_CONTROL_FIELD in tiddler.fields:
         try:
@@ -401,6 +427,8 @@ def _send_tiddler(environ, start_response, tiddler):
     content_header = ('Content-Type', str(mime_type))
 
     response = [cache_header, content_header, vary_header]
+    if encoding_header:
+        response.append(encoding_header)
     if last_modified:
         response.append(last_modified)
     if etag:
@@ -413,6 +441,41 @@ def _send_tiddler(environ, start_response, tiddler):
         return content
 
 
+def _stored_gzip(tiddler):
+    """
+    Return the gzip compressed text the store kept ``tiddler`` in,
+    if it did and the text has not changed since, otherwise ``None``.
+    """
+    gzipped_text = getattr(tiddler, 'gzipped_text', None)
+    if (gzipped_text and len(gzipped_text[0]) == len(tiddler.text)
+            and gzipped_text[0] == tiddler.text):
+        return gzipped_text[1]
+    return None
+
+
+def _accepts_gzip(environ):
+    """
+    True if the request's ``Accept-Encoding`` allows gzip, naming it
+    or, if it does not, ``*`` with a ``q`` above ``0``, as in RFC 7231
+    section 5.3.4.
+    """
+    qualities = {}
+    for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = [param.strip().lower() for param in coding.split(';')]
+        quality = 1.0
+        for param in params[1:]:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0
+        qualities.setdefault(params[0], quality)
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
 def _get_tiddler_content(environ, tiddler):
     """
     Extract the content of the tiddler, either straight up if
@@ -9,7 +9,7 @@ import time
 from httpexceptor import HTTP403, HTTP302
 
 from tiddlyweb.model.policy import UserRequiredError, ForbiddenError
-from tiddlyweb.store import Store
+from tiddlyweb.store import Store, pooled_store
 from tiddlyweb.web.util import server_base_url
 
 from tiddlyweb.fixups import quote
@@ -115,15 +115,24 @@ class StoreSet(object):
     WSGI Middleware that sets our choice of :py:class:`Store
     <tiddlyweb.store.Store>` in the ``environ``. That is, initialize
     the store for each request.
+
+    If the ``store.pool`` key of :py:mod:`config <tiddlyweb.config>` is
+    ``True`` the storage of the store is made once for each thread and
+    reused by later requests, see :py:func:`pooled_store
+    <tiddlyweb.store.pooled_store>`.
     """
 
     def __init__(self, application):
         self.application = application
 
     def __call__(self, environ, start_response):
-        database = Store(environ['tiddlyweb.config']['server_store'][0],
-                environ['tiddlyweb.config']['server_store'][1],
-                environ)
+        config = environ['tiddlyweb.config']
+        if config.get('store.pool'):
+            make_store = pooled_store
+        else:
+            make_store = Store
+        database = make_store(config['server_store'][0],
+                config['server_store'][1], environ)
         environ['tiddlyweb.store'] = database
         return self.application(environ, start_response)
 